@@ -0,0 +1,785 @@
+"""
+Benchmarks for pyqemulog.
+
+python bench.py [name ...] [--scale N] [--json results.json]
+python bench.py --generate armel --cpurfs N [--exceptions P] [--retranslations P] [--seed S] -o out.trace
+"""
+import argparse
+import bz2
+import gc
+import gzip
+import importlib.util
+import json
+import lzma
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from pyqemulog import get_pql, Batch, Filter, Stats
+from pyqemulog import ARMEL, MIPSEB, MIPSEL
+
+TRACES = {
+    ARMEL: 'tests/armel.trace',
+    MIPSEL: 'tests/mipsel.trace',
+}
+ARMEL_EXCEPTION_TRACE = 'tests/armel-exception.trace'
+
+
+def synthesize(arch, scale, trace=None):
+    """Write a large trace by repeating the sample trace of the arch."""
+    with open(trace or TRACES[arch]) as f:
+        sample = f.read()
+    fd, path = tempfile.mkstemp(suffix='.trace')
+    with os.fdopen(fd, 'w') as f:
+        for _ in range(scale):
+            f.write(sample)
+    return path
+
+
+ARM_INSTRUCTIONS = ['mov      r0, r1', 'add      r0, r0, #1', 'ldr      r1, [r2]',
+                    'str      r1, [r3, #4]', 'cmp      r0, #0', 'sub      r2, r2, #4']
+MIPS_INSTRUCTIONS = ['addiu\ta0,a0,1', 'lw\tv0,0(a1)', 'sw\tv0,4(a2)', 'or\ta3,a3,v1',
+                     'sll\tt0,t1,0x2', 'slt\tv1,a0,a1']
+MIPS_GPRS = ['r0', 'at', 'v0', 'v1', 'a0', 'a1', 'a2', 'a3',
+             't0', 't1', 't2', 't3', 't4', 't5', 't6', 't7',
+             's0', 's1', 's2', 's3', 's4', 's5', 's6', 's7',
+             't8', 't9', 'k0', 'k1', 'gp', 'sp', 's8', 'ra']
+
+
+def write_block(f, arch, address, words, rng):
+    f.write('----------------\nIN: \n')
+    for i, word in enumerate(words):
+        if arch == ARMEL:
+            text = 'b        #0x{:x}'.format(address) if i == len(words) - 1 else rng.choice(ARM_INSTRUCTIONS)
+        else:
+            text = 'j\t0x{:08x}'.format(address) if i == len(words) - 2 else rng.choice(MIPS_INSTRUCTIONS)
+        f.write('0x{:08x}:  {:08x}  {}\n'.format(address + 4 * i, word, text))
+    f.write('\n')
+
+
+def write_cpurf(f, arch, pc, registers, mode):
+    if arch == ARMEL:
+        registers = registers[:15] + [pc]
+        for row in range(0, 16, 4):
+            f.write(' '.join('R{:02d}={:08x}'.format(row + i, registers[row + i]) for i in range(4)) + '\n')
+        f.write('PSR={} -Z-- A {}\n'.format('400001d3' if mode == 'svc32' else '600001d2', mode))
+    else:
+        f.write('pc=0x{:08x} HI=0x00000000 LO=0x00000000 ds 0090 {:08x} 0\n'.format(pc, pc))
+        for row in range(0, 32, 4):
+            f.write('GPR{:02d}: '.format(row) + ' '.join(
+                '{} {:08x}'.format(MIPS_GPRS[row + i], registers[row + i]) for i in range(4)) + '\n')
+        f.write('CP0 Status  0x{:08x} Cause   0x00000000 EPC    0x00000000\n'.format(
+            0x10400000 if mode == 'kernel' else 0x10400002))
+        f.write('    Config0 0x80008482 Config1 0x9e190c8f LLAddr 0x0000000000000000\n')
+        f.write('    Config2 0x80000000 Config3 0x00000c20\n')
+        f.write('    Config4 0x00000000 Config5 0x00000000\n')
+
+
+def generate(arch, path, cpurfs, exceptions=0.001, retranslations=0.01, seed=0):
+    """
+    Write a deterministic trace of the arch (armel, mipsel or mipseb) with
+    about the number of cpurfs. exceptions is the chance that a cpurf takes
+    an exception, whose handler then returns, and retranslations the chance
+    that a block is translated again before it runs, as after a TB flush.
+    """
+    rng = random.Random(seed)
+    # a program of 512 blocks, looping mostly forward
+    address = 0x8000 if arch == ARMEL else 0x80020000
+    blocks = []
+    for _ in range(512):
+        words = [rng.getrandbits(32) for _ in range(rng.randint(2, 12))]
+        blocks.append((address, words))
+        address += 4 * len(words) + 4 * rng.randint(0, 8)
+    vectors = {
+        ARMEL: [(0xffff0018, [0xe25ef004], 'irq32', 'Taking exception 5 [IRQ]\n...from EL1 to EL1\n'
+                                                    '...with ESR 0x0/0x0\n'),
+                (0xffff0010, [0xe25ef008], 'abt32', 'Taking exception 4 [Data Abort]\n...from EL1 to EL1\n'
+                                                    '...with ESR 0x25/0x9600003f\n'
+                                                    '...with DFSR 0x8 DFAR 0x{:08x}\n')],
+        MIPSEL: [(0x80000180, [0x401a6800, 0x00000000, 0x42000018], 'kernel',
+                  'do_raise_exception_err: 28 0\n'
+                  'mips_cpu_do_interrupt enter: PC {:08x} EPC 00000000 data bus error exception\n'
+                  'mips_cpu_do_interrupt: PC 80000180 EPC {:08x} cause 7\n'
+                  '    S 10400002 C 0000001c A 00000000 D 00000000\n')],
+    }[ARMEL if arch == ARMEL else MIPSEL]
+    normal = 'svc32' if arch == ARMEL else 'kernel'
+    registers = [0] * 32
+    translated = set()
+    block, n = 0, 0
+    with open(path, 'w') as f:
+        while n < cpurfs:
+            address, words = blocks[block]
+            if address not in translated or rng.random() < retranslations:
+                write_block(f, arch, address, words, rng)
+                translated.add(address)
+            for _ in range(rng.randint(1, 3)):
+                registers[rng.randrange(1, 14)] = rng.getrandbits(32)
+            write_cpurf(f, arch, address, registers, normal)
+            n += 1
+            if rng.random() < exceptions:
+                vector, handler, mode, taking = rng.choice(vectors)
+                f.write(taking.format(address, address))
+                if vector not in translated:
+                    write_block(f, arch, vector, handler, rng)
+                    translated.add(vector)
+                write_cpurf(f, arch, vector, registers, mode)
+                if arch == ARMEL:
+                    f.write('Exception return from AArch32 {} to svc PC 0x{:08x}\n'.format(mode[:3], address))
+                n += 1
+            block = (block + rng.choice([1, 1, 1, 2, 3, -7])) % len(blocks)
+
+
+def retranslated(n):
+    """Write an ARMEL trace where one pc is retranslated after every exec."""
+    fd, path = tempfile.mkstemp(suffix='.trace')
+    with os.fdopen(fd, 'w') as f:
+        for i in range(n):
+            f.write('----------------\nIN: \n')
+            f.write('0x00008000:  e3a00000  mov      r0, #0\n')
+            f.write('0x00008004:  eafffffd  b        #0x8000\n\n')
+            f.write('R00={:08x} R01=00000000 R02=00000000 R03=00000000\n'.format(i))
+            f.write('R04=00000000 R05=00000000 R06=00000000 R07=00000000\n')
+            f.write('R08=00000000 R09=00000000 R10=00000000 R11=00000000\n')
+            f.write('R12=00000000 R13=00000000 R14=00000000 R15=00008000\n')
+            f.write('PSR=400001d3 -Z-- A svc32\n')
+    return path
+
+
+def bytes_read():
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def measure(func, repeat=3):
+    """Return the best wall-clock time and the bytes read by one run."""
+    best, nbytes = None, None
+    for _ in range(repeat):
+        before = bytes_read()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        after = bytes_read()
+        if best is None or elapsed < best:
+            best = elapsed
+        if before is not None:
+            nbytes = after - before
+    return best, nbytes
+
+
+# what was reported, for --json
+RESULTS = []
+
+
+def report(name, elapsed, nbytes=None, extra=''):
+    RESULTS.append({'benchmark': CURRENT, 'name': name.strip(), 'seconds': elapsed, 'bytes_read': nbytes})
+    line = '{:<28} {:>10.4f}s'.format(name, elapsed)
+    if nbytes is not None:
+        line += ' {:>12.1f}MB read'.format(nbytes / 2 ** 20)
+    print(line + extra)
+
+
+def bench_unified(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            def two_pass():
+                pql = get_pql(arch, path)
+                pql.load_cpurf()
+                pql.load_in_asm()
+
+            def one_pass():
+                pql = get_pql(arch, path)
+                pql.load_all()
+
+            print('{} ({:.1f}MB)'.format(arch, os.path.getsize(path) / 2 ** 20))
+            report('  load_cpurf+load_in_asm', *measure(two_pass))
+            report('  load_all', *measure(one_pass))
+        finally:
+            os.unlink(path)
+
+
+def bench_retranslation(scale):
+    def chain_walk(pql, cpurf):
+        # get_bb before the per-address index
+        target_bb = pql.bbs[pql.get_pc(cpurf)]
+        max_ln = cpurf['ln']
+        while target_bb['instructions'][-1]['ln'] < max_ln:
+            if not target_bb['chained']:
+                break
+            next_bb = target_bb['next']
+            if next_bb['instructions'][-1]['ln'] > max_ln:
+                break
+            target_bb = next_bb
+        return target_bb
+
+    n = scale * 25
+    path = retranslated(n)
+    try:
+        pql = get_pql(ARMEL, path)
+        print('armel, one pc retranslated {} times'.format(n))
+        report('  load_all', *measure(pql.load_all, repeat=1))
+        cpurfs = list(pql.cpurfs.values())
+        report('  get_bb (index)', measure(lambda: [pql.get_bb(c) for c in cpurfs])[0])
+        report('  get_bb (chain walk)', measure(lambda: [chain_walk(pql, c) for c in cpurfs], repeat=1)[0])
+    finally:
+        os.unlink(path)
+
+
+def retained(func):
+    """Return what func() returns and the memory it keeps alive."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def bench_memory(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            print('{} ({:.1f}MB)'.format(arch, os.path.getsize(path) / 2 ** 20))
+            for storage in ['dict', 'columnar', 'delta']:
+                def load():
+                    pql = get_pql(arch, path, storage=storage)
+                    pql.load_cpurf()
+                    return pql.cpurfs
+                cpurfs, nbytes = retained(load)
+                report('  {} cpurfs'.format(storage), measure(load, repeat=1)[0],
+                       extra=' {:>10.1f}MB kept for {} cpurfs'.format(nbytes / 2 ** 20, len(cpurfs)))
+                del cpurfs
+        finally:
+            os.unlink(path)
+
+
+def bench_cache(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            def load():
+                pql = get_pql(arch, path, storage='columnar', cache=True)
+                pql.load_all()
+
+            print('{} ({:.1f}MB)'.format(arch, os.path.getsize(path) / 2 ** 20))
+            report('  parse and save cache', *measure(load, repeat=1))
+            report('  reopen from cache', *measure(load))
+        finally:
+            os.unlink(path)
+            if os.path.exists(path + '.pqlcache'):
+                os.unlink(path + '.pqlcache')
+
+
+def bench_parallel(scale):
+    cores = os.cpu_count()
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            print('{} ({:.1f}MB), {} cores'.format(arch, os.path.getsize(path) / 2 ** 20, cores))
+            serial = None
+            jobs = 1
+            while True:
+                def load():
+                    pql = get_pql(arch, path, storage='columnar', jobs=jobs)
+                    pql.load_all()
+
+                elapsed = measure(load, repeat=1)[0]
+                serial = serial or elapsed
+                report('  jobs={}'.format(jobs), elapsed, extra=' {:>6.2f}x'.format(serial / elapsed))
+                if jobs >= cores:
+                    break
+                jobs = min(jobs * 2, cores)
+        finally:
+            os.unlink(path)
+
+
+def bench_stream(scale):
+    for arch in TRACES:
+        for factor in [1, 4]:
+            path = synthesize(arch, scale * factor)
+            try:
+                print('{} ({:.1f}MB)'.format(arch, os.path.getsize(path) / 2 ** 20))
+                for mode in ['generator', 'stream']:
+                    pql = get_pql(arch, path, mode=mode)
+                    tracemalloc.start()
+                    start = time.perf_counter()
+                    for _ in pql.get_cpurf():
+                        pass
+                    elapsed = time.perf_counter() - start
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    report('  {} mode'.format(mode), elapsed, extra=' {:>10.1f}MB peak'.format(peak / 2 ** 20))
+                    del pql
+            finally:
+                os.unlink(path)
+
+
+def bench_compressed(scale):
+    compressions = [('', None), ('.gz', gzip.open), ('.xz', lzma.open), ('.bz2', bz2.open)]
+    try:
+        import zstandard
+        compressions.append(('.zst', lambda path, mode: zstandard.open(path, mode)))
+    except ImportError:
+        pass
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        size = os.path.getsize(path)
+        try:
+            print('{} ({:.1f}MB)'.format(arch, size / 2 ** 20))
+            for ext, compress in compressions:
+                target = path + ext
+                if compress is not None:
+                    with open(path, 'rb') as f, compress(target, 'wb') as g:
+                        g.write(f.read())
+
+                def load():
+                    pql = get_pql(arch, target, storage='columnar')
+                    pql.load_all()
+
+                elapsed, nbytes = measure(load, repeat=1)
+                report('  {}'.format(ext or 'plain'), elapsed, nbytes,
+                       ' {:>8.1f}MB/s'.format(size / 2 ** 20 / elapsed))
+                if compress is not None:
+                    os.unlink(target)
+        finally:
+            os.unlink(path)
+
+
+def bench_seek(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            pql = get_pql(arch, path)
+            print('{} ({:.1f}MB)'.format(arch, os.path.getsize(path) / 2 ** 20))
+            report('  build_seek_index', *measure(pql.build_seek_index, repeat=1))
+            last = len(pql.seek_index.cpurf_offsets) - 1
+            report('  get_cpurf_at({})'.format(last), measure(lambda: pql.get_cpurf_at(last))[0])
+            ln = pql.seek_index.bb_lns[-1]
+            report('  get_bb_at({})'.format(ln), measure(lambda: pql.get_bb_at(ln))[0])
+
+            def scan():
+                for k, cpurf in get_pql(arch, path, mode='stream').get_cpurf():
+                    if k == last:
+                        return cpurf
+
+            report('  stream to cpurf {}'.format(last), measure(scan, repeat=1)[0])
+        finally:
+            os.unlink(path)
+
+
+def bench_fast(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        size = os.path.getsize(path) / 2 ** 20
+        try:
+            print('{} ({:.1f}MB)'.format(arch, size))
+            for storage in ['dict', 'columnar']:
+                for fast in [False, True]:
+                    def load():
+                        pql = get_pql(arch, path, storage=storage, fast=fast)
+                        pql.load_all()
+
+                    elapsed = measure(load)[0]
+                    report('  {}{}'.format(storage, ' fast' if fast else ''), elapsed,
+                           extra=' {:>8.1f}MB/s'.format(size / elapsed))
+        finally:
+            os.unlink(path)
+
+
+def bench_exceptions(scale):
+    path = synthesize(ARMEL, scale * 10, trace=ARMEL_EXCEPTION_TRACE)
+    try:
+        pql = get_pql(ARMEL, path, storage='columnar')
+        pql.load_all()
+        entries = list(pql.exceptions())
+        print('armel, {} exceptions in {} cpurfs'.format(len(entries), len(pql.cpurfs)))
+        report('  build_exception_index', measure(pql.build_exception_index)[0])
+        report('  exception returns (index)', measure(lambda: [pql.get_exception_return_bb(c) for c in entries])[0])
+        index, pql.exception_index = pql.exception_index, None
+        report('  exception returns (walk)', measure(lambda: [pql.get_exception_return_bb(c) for c in entries])[0])
+        pql.exception_index = index
+        report('  exception_span of all', measure(lambda: [pql.exception_span(c) for c in pql.cpurfs.values()])[0])
+    finally:
+        os.unlink(path)
+
+
+def bench_export(scale):
+    formats = ['npz']
+    if importlib.util.find_spec('pyarrow') is not None:
+        formats += ['parquet', 'arrow']
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            print('{} ({:.1f}MB)'.format(arch, os.path.getsize(path) / 2 ** 20))
+            pql = get_pql(arch, path)
+
+            def to_json():
+                with open(path + '.json', 'w') as f:
+                    for cpurf in pql.iter_cpurfs():
+                        f.write(json.dumps(cpurf) + '\n')
+
+            report('  cpurfs to json lines', measure(to_json, repeat=1)[0])
+            os.unlink(path + '.json')
+            for format in formats:
+                target = path + '.' + format
+                report('  cpurfs to {}'.format(format), measure(lambda: pql.export_cpurfs(target), repeat=1)[0],
+                       extra=' {:>10.1f}MB'.format(os.path.getsize(target) / 2 ** 20))
+                report('  instructions to {}'.format(format),
+                       measure(lambda: pql.export_instructions(target), repeat=1)[0])
+                os.unlink(target)
+        finally:
+            os.unlink(path)
+
+
+def bench_queries(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            for storage in ['dict', 'columnar']:
+                pql = get_pql(arch, path, storage=storage)
+                pql.load_cpurf()
+                sp = 'R13' if arch == ARMEL else 'sp'
+                print('{} {}, {} cpurfs'.format(arch, storage, len(pql.cpurfs)))
+
+                def loop():
+                    low = [cpurf['id'] for cpurf in pql.cpurfs.values()
+                           if int(cpurf['register_files'][sp], 16) < 0x80000000]
+                    histogram = {}
+                    for cpurf in pql.cpurfs.values():
+                        pc = int(pql.get_pc(cpurf), 16)
+                        histogram[pc] = histogram.get(pc, 0) + 1
+                    return low, histogram
+
+                def vectorized():
+                    pql.register_table = None
+                    return pql.where(pql.registers(sp) < 0x80000000), pql.pc_histogram()
+
+                report('  loop over cpurfs', measure(loop)[0])
+                report('  registers() + where()', measure(vectorized)[0])
+                report('  again, parsed once', measure(lambda: (pql.where(pql.registers(sp) < 0x80000000),
+                                                               pql.pc_histogram()))[0])
+        finally:
+            os.unlink(path)
+
+
+def bench_delta(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            print(arch)
+            for storage in ['dict', 'columnar', 'delta']:
+                pql = get_pql(arch, path, storage=storage)
+                pql.load_cpurf()
+                cpurfs = list(pql.cpurfs.values())
+                ids = list(range(len(cpurfs)))
+                random.Random(0).shuffle(ids)
+                report('  {} changed_registers'.format(storage),
+                       measure(lambda: [pql.changed_registers(cpurf) for cpurf in cpurfs])[0])
+                report('  {} random pc reads'.format(storage),
+                       measure(lambda: [pql.get_pc(pql.cpurfs[i]) for i in ids])[0])
+        finally:
+            os.unlink(path)
+
+
+def bench_coverage(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            print(arch)
+            for mode in ['plain', 'stream']:
+                def count():
+                    pql = get_pql(arch, path, mode=mode)
+                    if mode == 'plain':
+                        pql.load_all()
+                    return pql.coverage()
+                (coverage, nbytes) = retained(count)
+                report('  {} coverage'.format(mode), measure(count, repeat=1)[0],
+                       extra=' {:>10.1f}MB kept, {} blocks, {} edges'.format(
+                           nbytes / 2 ** 20, len(coverage.pcs), len(coverage.edges)))
+
+                def flatten():
+                    pql = get_pql(arch, path, mode=mode)
+                    if mode == 'plain':
+                        pql.load_all()
+                    return sum(1 for _ in pql.flatten())
+                report('  {} flatten'.format(mode), measure(flatten, repeat=1)[0])
+        finally:
+            os.unlink(path)
+
+
+def bench_intern(scale):
+    # every repetition of the sample flushes and retranslates every block
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            print('{} ({:.1f}MB, {} translations of each block)'.format(
+                arch, os.path.getsize(path) / 2 ** 20, scale))
+            for intern in [False, True]:
+                def load():
+                    pql = get_pql(arch, path, intern=intern)
+                    pql.load_in_asm()
+                    return pql.bb_index
+                bb_index, nbytes = retained(load)
+                report('  {} bbs'.format('interned' if intern else 'dict'), measure(load, repeat=1)[0],
+                       extra=' {:>10.1f}MB kept for {} translations'.format(
+                           nbytes / 2 ** 20, sum(len(chain) for _, chain in bb_index.values())))
+                del bb_index
+        finally:
+            os.unlink(path)
+
+
+def bench_calls(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            print(arch)
+            for mode in ['plain', 'stream']:
+                def calls():
+                    pql = get_pql(arch, path, mode=mode)
+                    if mode == 'plain':
+                        pql.load_all()
+                    call_stack = pql.call_stack()
+                    # what the engine keeps, not the loaded trace
+                    call_stack.pql = None
+                    return call_stack
+                call_stack, nbytes = retained(calls)
+                report('  {} call_stack'.format(mode), measure(calls, repeat=1)[0],
+                       extra=' {:>10.1f}MB kept, {} functions, {} calls'.format(
+                           nbytes / 2 ** 20, len(call_stack.functions), call_stack.transitions['call']))
+        finally:
+            os.unlink(path)
+
+
+def bench_stats(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            print(arch)
+            for name, stats in [('no stats', lambda: None), ('stats', Stats)]:
+                def load():
+                    pql = get_pql(arch, path, stats=stats())
+                    pql.load_all()
+                    for _, cpurf in pql.get_cpurf():
+                        pql.get_bb(cpurf)
+                report('  {}'.format(name), measure(load)[0])
+        finally:
+            os.unlink(path)
+
+
+def bench_filter(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            with open(path) as f:
+                lines = sum(1 for _ in f)
+            print(arch)
+            # lns keeps the first tenth of the trace
+            for name, f in [('no filter', None), ('lns', Filter(lns=[(0, lines // 10)])),
+                            ('pcs', Filter(pcs=[(0, 0x8100), (0x80000000, 0x80008d00)]))]:
+                def load():
+                    pql = get_pql(arch, path, filter=f)
+                    pql.load_all()
+                    return pql
+                pql = load()
+                report('  {}'.format(name), measure(load, repeat=1)[0],
+                       extra=' {:>10} cpurfs kept'.format(len(pql.cpurfs)))
+        finally:
+            os.unlink(path)
+
+
+def bench_diff(scale):
+    for arch in TRACES:
+        path = synthesize(arch, scale)
+        try:
+            print(arch)
+            for mode in ['plain', 'stream']:
+                def diff():
+                    left = get_pql(arch, path, mode=mode)
+                    right = get_pql(arch, path, mode=mode)
+                    if mode == 'plain':
+                        left.load_all()
+                        right.load_all()
+                    diff = left.diff(right)
+                    for _ in diff:
+                        pass
+                    return diff
+                report('  {} diff'.format(mode), measure(diff, repeat=1)[0],
+                       extra=' {:>10} cpurfs aligned'.format(diff().aligned))
+        finally:
+            os.unlink(path)
+
+
+def bench_batch(scale):
+    paths = [synthesize(ARMEL, 1) for _ in range(scale)]
+    try:
+        print('{} tracefiles of {:.1f}KB'.format(len(paths), os.path.getsize(paths[0]) / 2 ** 10))
+
+        def serial():
+            for path in paths:
+                pql = get_pql(ARMEL, path)
+                pql.load_cpurf()
+                pql.load_in_asm()
+        report('  serial load', measure(serial, repeat=1)[0])
+        for jobs in sorted({1, os.cpu_count()}):
+            def batch():
+                return sum(1 for _ in Batch([(ARMEL, path) for path in paths], jobs=jobs))
+            report('  batch jobs={}'.format(jobs), measure(batch, repeat=1)[0])
+    finally:
+        for path in paths:
+            os.unlink(path)
+
+
+SUITE = [
+    ('plain', {}),
+    ('generator', {'mode': 'generator'}),
+    ('stream', {'mode': 'stream'}),
+    ('columnar', {'storage': 'columnar'}),
+    ('fast', {'fast': True}),
+    ('fast columnar', {'fast': True, 'storage': 'columnar'}),
+    ('parallel', {'jobs': None}),
+]
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return {'p50': latencies[len(latencies) // 2], 'p90': latencies[len(latencies) * 9 // 10],
+            'p99': latencies[len(latencies) * 99 // 100], 'max': latencies[-1]}
+
+
+def run_case(arch, path, kwargs, samples=10000):
+    """
+    Load the trace in a fresh process, for its own peak RSS. In
+    mode='generator', get_bb is timed on the first samples cpurfs as they
+    are yielded, and that time is left out of the load.
+    """
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    pql = get_pql(arch, path, **kwargs)
+    latencies = []
+    start = time.perf_counter()
+    if pql.mode == 'plain':
+        pql.load_all()
+        n = len(pql.cpurfs)
+    else:
+        n = 0
+        for cpurf in pql.load_all():
+            n += 1
+            if pql.mode == 'generator' and len(latencies) < samples:
+                bb_start = time.perf_counter_ns()
+                pql.get_bb(cpurf)
+                latencies.append(time.perf_counter_ns() - bb_start)
+    elapsed = time.perf_counter() - start - sum(latencies) / 1e9
+    result = {'seconds': elapsed, 'cpurfs': n,
+              'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'baseline_rss_mb': baseline}
+    if pql.mode == 'plain' and n:
+        rng = random.Random(0)
+        cpurfs = [pql.cpurfs[rng.randrange(n)] for _ in range(samples)]
+        for cpurf in cpurfs:
+            start = time.perf_counter_ns()
+            pql.get_bb(cpurf)
+            latencies.append(time.perf_counter_ns() - start)
+    if latencies:
+        result['get_bb_ns'] = percentiles(latencies)
+    return result
+
+
+def bench_suite(scale):
+    for arch in [ARMEL, MIPSEL, MIPSEB]:
+        fd, path = tempfile.mkstemp(suffix='.trace')
+        os.close(fd)
+        try:
+            generate(arch, path, scale * 100, exceptions=0.01, retranslations=0.02)
+            with open(path, 'rb') as f:
+                lines = sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b''))
+            size = os.path.getsize(path)
+            print('{} ({:.1f}MB, {} lines)'.format(arch, size / 2 ** 20, lines))
+            for name, kwargs in SUITE:
+                # spawned, not forked, so that the peak RSS is not the one of this process
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    result = executor.submit(run_case, arch, path, kwargs).result()
+                result.update({'benchmark': 'suite', 'name': name, 'arch': arch, 'lines': lines, 'bytes': size,
+                               'lines_per_s': lines / result['seconds'], 'mb_per_s': size / 2 ** 20 / result['seconds']})
+                RESULTS.append(result)
+                extra = ' {:>10.0f} lines/s {:>7.1f}MB/s {:>7.1f}MB rss ({:+.1f}MB)'.format(
+                    result['lines_per_s'], result['mb_per_s'], result['peak_rss_mb'],
+                    result['peak_rss_mb'] - result['baseline_rss_mb'])
+                if 'get_bb_ns' in result:
+                    extra += '  get_bb p50/p99 {p50}/{p99}ns'.format(**result['get_bb_ns'])
+                print('{:<28} {:>10.4f}s'.format('  ' + name, result['seconds']) + extra)
+        finally:
+            os.unlink(path)
+
+
+BENCHMARKS = {
+    'unified': bench_unified,
+    'retranslation': bench_retranslation,
+    'memory': bench_memory,
+    'cache': bench_cache,
+    'parallel': bench_parallel,
+    'stream': bench_stream,
+    'compressed': bench_compressed,
+    'seek': bench_seek,
+    'fast': bench_fast,
+    'exceptions': bench_exceptions,
+    'export': bench_export,
+    'queries': bench_queries,
+    'delta': bench_delta,
+    'coverage': bench_coverage,
+    'intern': bench_intern,
+    'calls': bench_calls,
+    'stats': bench_stats,
+    'filter': bench_filter,
+    'diff': bench_diff,
+    'batch': bench_batch,
+    'suite': bench_suite,
+}
+CURRENT = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pyqemulog benchmarks')
+    parser.add_argument('names', nargs='*', metavar='name', help=', '.join(BENCHMARKS))
+    parser.add_argument('--scale', type=int, default=200, help='times to repeat the sample traces')
+    parser.add_argument('--json', metavar='PATH', help='write the results to PATH')
+    parser.add_argument('--generate', metavar='ARCH', help='write a synthetic trace of ARCH instead')
+    parser.add_argument('-o', '--output', help='the synthetic trace')
+    parser.add_argument('--cpurfs', type=int, default=100000)
+    parser.add_argument('--exceptions', type=float, default=0.001, help='chance of an exception per cpurf')
+    parser.add_argument('--retranslations', type=float, default=0.01, help='chance of a retranslation per block')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.generate:
+        if args.generate not in [ARMEL, MIPSEL, MIPSEB] or not args.output:
+            parser.error('--generate takes armel, mipsel or mipseb, and -o')
+        generate(args.generate, args.output, args.cpurfs, exceptions=args.exceptions,
+                 retranslations=args.retranslations, seed=args.seed)
+        return
+    global CURRENT
+    for name in args.names or list(BENCHMARKS):
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark {}'.format(name))
+        print('== {} =='.format(name))
+        CURRENT = name
+        BENCHMARKS[name](args.scale)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'scale': args.scale, 'results': RESULTS}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,37 @@
 import abc
+import argparse
+import asyncio
+import bisect
+import bz2
+import contextlib
+import glob
+import gzip
+import io
 import json
+import lzma
+import mmap
+import operator
+import os
+import itertools
+import pickle
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from array import array
+from collections import deque
+from collections.abc import Mapping, Sequence
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # You should import them for compatibility.
 ARM = 'arm'
@@ -10,95 +42,2851 @@ ARMEL = 'armel'
 MIPSEB = 'mipseb'
 MIPSEL = 'mipsel'
 
+# Bump it whenever the parsed structures change, to drop stale caches.
+CACHE_VERSION = 4
+# the end of a cache file, after its index, see save_cache()
+CACHE_MAGIC = b'PQLCACHE'
+
+# the phase of a PQLI without stats
+NO_PHASE = contextlib.nullcontext()
+
+# Tracefiles are read in large blocks, compressed ones are decompressed on the fly.
+BUFFER_SIZE = 1 << 20
+COMPRESSIONS = {'.gz': gzip.open, '.xz': lzma.open, '.bz2': bz2.open, '.zst': None}
+# the bytes of tracefile a worker turns into JSON lines at a time
+JSONL_CHUNK_SIZE = 1 << 24
+
+
+class Instruction(Mapping):
+    """
+    Read-only instruction of an interned basic block, looking like the
+    instruction dict. Its body (address, raw, opcode, operand) is shared
+    with the identical instructions of every retranslation.
+    """
+    __slots__ = ('ln', 'body')
+    fields = {'address': 0, 'raw': 1, 'opcode': 2, 'operand': 3}
+
+    def __init__(self, ln, body):
+        self.ln = ln
+        self.body = body
+
+    def __getitem__(self, key):
+        if key == 'ln':
+            return self.ln
+        return self.body[self.fields[key]]
+
+    def __iter__(self):
+        yield 'ln'
+        yield from self.fields
+
+    def __len__(self):
+        return 1 + len(self.fields)
+
+
+class Instructions(Sequence):
+    """
+    Instructions of an interned basic block: the interned bodies and the ln
+    of the first one, as the instructions of a block are on consecutive lines.
+    """
+    __slots__ = ('ln', 'bodies')
+
+    def __init__(self, ln, bodies):
+        self.ln = ln
+        self.bodies = bodies
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self.bodies)
+        if not 0 <= i < len(self.bodies):
+            raise IndexError('instruction index out of range')
+        return Instruction(self.ln + i, self.bodies[i])
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+
+class InAsmParser(object):
+    def __init__(self, ln=0, retain=True, intern=False, filter=None):
+        """
+        Line-fed state machine for basic blocks.
+
+        ----------------                                1
+        IN:                                             2
+        0x00000000:  e3a00000  mov      r0, #0          3
+        0x00000004:  e59f1004  ldr      r1, [pc, #4]    4
+        0x00000008:  e59f2004  ldr      r2, [pc, #4]    4
+        0x0000000c:  e59ff004  ldr      pc, [pc, #4]    4
+                                                        4 (end)
+
+        If retain=False, basic blocks are neither chained nor indexed, and
+        bbs only keeps the latest completed translation of every address.
+
+        If intern=True, the instructions of a completed basic block become
+        Instructions, whose bodies are interned along with their opcodes and
+        operands (as tuples), so that retranslations of a block share them.
+
+        If filter is a Filter, the basic blocks it rejects are skipped right
+        after their first address, without parsing their instructions.
+        """
+        self.ln = ln  # ln number
+        self.state = 0
+        self.bb = None
+        self.retain = retain
+        self.intern = intern
+        self.filter = filter
+        self.interned = {}
+        self.bbs = {}
+        # address -> [lns, bbs], the last ln and the bb of every translation
+        self.index = {}
+
+    def parse_in_asm(self, line):
+        things = line.strip().split()
+        address = things[0][2:-1]  # remove 0x and :
+        raw = things[1]
+        offset = self.ln + 1
+        if len(things) < 3:
+            # disassembler disagrees
+            return offset, address, raw, None, None
+        opcode = things[2]
+        operand = things[3:]
+        return offset, address, raw, opcode, operand
+
+    def feed(self, line):
+        """Consume one line and return the basic block it completes, if any."""
+        completed = None
+        if self.state == 0 and line.startswith('---'):
+            self.state = 1
+        if self.state == 5:
+            # a skipped basic block
+            if not len(line.strip()):
+                self.state = 0
+            self.ln += 1
+            return None
+        if self.state == 3 and self.filter is not None and \
+                not self.filter.match_bb(line.split(None, 1)[0][2:-1], self.ln + 1):
+            self.state = 5
+            self.ln += 1
+            return None
+        if self.state == 3:
+            offset, address, raw, opcode, operand = self.parse_in_asm(line)
+            self.add_bb({'ln': offset, 'address': address, 'raw': raw, 'opcode': opcode, 'operand': operand})
+        if self.state == 4 and len(line.strip()):
+            offset, address, raw, opcode, operand = self.parse_in_asm(line)
+            self.add_instruction({'ln': offset, 'address': address, 'raw': raw, 'opcode': opcode, 'operand': operand})
+        if self.state in [1, 2, 3]:
+            self.state += 1
+        if self.state == 4 and not len(line.strip()):
+            completed = self.complete_bb()
+            self.state = 0
+        self.ln += 1
+        return completed
+
+    def add_bb(self, instruction):
+        """Start a basic block with its first instruction and chain it."""
+        bbs = self.bbs
+        offset = instruction['ln']
+        bb_id = instruction['address']
+        new_bb = {'in': bb_id, 'chained': False, 'instructions': [instruction]}
+        if not self.retain:
+            pass
+        elif bb_id in bbs:
+            lns, chain = self.index[bb_id]
+            chained_bb = chain[-1]
+            chained_bb['chained'] = True
+            chained_bb['next'] = new_bb
+            lns.append(offset)
+            chain.append(new_bb)
+        else:
+            new_bb['chained'] = False
+            bbs[bb_id] = new_bb
+            self.index[bb_id] = [[offset], [new_bb]]
+        self.bb = new_bb
+
+    def add_instruction(self, instruction):
+        self.bb['instructions'].append(instruction)
+        if self.retain:
+            self.index[self.bb['in']][0][-1] = instruction['ln']
+
+    def complete_bb(self):
+        self.bb['size'] = len(self.bb['instructions'])
+        if self.intern:
+            self.bb['instructions'] = self.intern_instructions(self.bb['instructions'])
+        if not self.retain:
+            self.bbs[self.bb['in']] = self.bb
+        return self.bb
+
+    def intern_instructions(self, instructions):
+        interned = self.interned
+        bodies = []
+        for instruction in instructions:
+            opcode, operand = instruction['opcode'], instruction['operand']
+            if opcode is not None:
+                opcode = sys.intern(opcode)
+                operand = tuple(operand)
+                operand = interned.setdefault(operand, operand)
+            body = (instruction['address'], instruction['raw'], opcode, operand)
+            bodies.append(interned.setdefault(body, body))
+        bodies = tuple(bodies)
+        return Instructions(instructions[0]['ln'], interned.setdefault(bodies, bodies))
+
+
+class AArch32CpurfParser(object):
+    def __init__(self, exception_names, cpurfs, ln=0, cpurf_id=0):
+        """
+        Line-fed state machine for AArch32 cpu register files.
+
+        R00=00000055 R01=000e11b0 R02=000f21c4 R03=00000661    1 <- 0
+        R04=00000055 R05=00000001 R06=0000b9b0 R07=000e1170    2
+        R08=000000a0 R09=00000000 R10=000e11b4 R11=000e2178    3
+        R12=000e217c R13=000e215c R14=00008e24 R15=00008d80    4
+        PSR=200001d3 --C- A svc32                              5
+        AArch32 mode switch from irq to abt PC 0xc000af4c      6 -> 2 or 0 or 6
+        Exception return from AArch32 abt to svc PC 0xc0020a00 6 -> 2 or 0 or 6
+        Taking exception 4 [Data Abort]                        6 -> 2 or 0 or 6
+        ...from EL1 to EL1                                     7
+        ...with ESR 0x25/0x9600003f                            8
+        ...with DFSR 0x8 DFAR 0xf1012014                       9 -> 0
+        Taking exception 5 [IRQ]                               6 -> 2 or 0 or 6
+        ...from EL1 to EL1                                     7
+        ...with ESR 0x0/0x0                                    8 -> 0
+        Taking exception 3 [Prefetch Abort]                    6 -> 2 or 0 or 6
+        ...from EL0 to EL1                                     7
+        ...with ESR 0x20/0x8200003f                            8
+        ...with IFSR 0x17 IFAR 0x400009b0                      9
+        Taking exception 1 [Undefined Instruction]             6 -> 2 or 0 or 6
+        ...from EL1 to EL1                                     7
+        ...with ESR 0x0/0x2000000                              8 -> 0
+        Taking exception 11 [Hypervisor Call]                  6 -> 2 or 0 or 6
+        ...from EL1 to EL2                                     7
+        ...with ESR 0x12/0x4a000000                            8 -> 0
+        """
+        self.exception_names = exception_names
+        self.cpurfs = cpurfs
+        self.ln = ln
+        self.cpurf_id = cpurf_id
+        self.state = 0
+        self.exception_type = None
+
+    # the first line of a cpurf, see FilteredCpurfParser
+    prefix = 'R00'
+
+    def peek_pc(self, line):
+        if line.startswith('R12'):
+            return line.split()[3][4:]
+        return None
+
+    def peek_mode(self, line):
+        if line.startswith('PSR'):
+            return line.split()[-1]
+        return None
+
+    def parse_state(self, line):
+        # PSR=200001d3 --C- A svc32                              5
+        # PSR=400001d3 -Z-- A NS svc32
+        things = line.strip().split()
+        if len(things) == 4:
+            psr, flags, _, mode = things
+        elif len(things) == 5:
+            psr, flags, _, _, mode = things
+        psr_name, _, psr_value = psr.partition('=')
+        return psr_name, psr_value, flags, None, mode
+
+    def parse_rfs(self, line):
+        things = line.strip().split()
+        rfs = {}
+        for rf in things:
+            rf_name, _, rf_value = rf.partition('=')
+            rfs[rf_name] = rf_value
+        offset = self.ln + 1
+        return offset, rfs
+
+    def feed(self, line):
+        """Consume one line and return the cpurf it completes, if any."""
+        cpurfs = self.cpurfs
+        completed = None
+        if self.state == 0 and line.startswith('R00'):
+            self.state = 1
+            offset, rfs = self.parse_rfs(line)
+            cpurfs[self.cpurf_id] = {'id': self.cpurf_id, 'ln': offset, 'register_files': rfs}
+        if self.state in [2, 3, 4]:
+            _, rfs = self.parse_rfs(line)
+            for rf_name, rf_value in rfs.items():
+                cpurfs[self.cpurf_id]['register_files'][rf_name] = rf_value
+        if self.state == 5:
+            psr_name, psr_value, flags, _, mode = self.parse_state(line)
+            cpurfs[self.cpurf_id]['register_files'][psr_name] = psr_value
+            cpurfs[self.cpurf_id]['mode'] = mode
+        if self.state == 9:
+            dfr_name_value = line.strip().split()[1:]
+            for i in range(0, len(dfr_name_value), 2):
+                cpurfs[self.cpurf_id]['register_files'][dfr_name_value[i]] = dfr_name_value[i + 1]
+        if self.state == 6:
+            if line.startswith('R00'):
+                self.cpurf_id += 1
+                self.state = 1
+                offset, rfs = self.parse_rfs(line)
+                cpurfs[self.cpurf_id] = {'id': self.cpurf_id, 'ln': offset, 'register_files': rfs}
+            elif line.startswith('Taking exception'):
+                self.exception_type = int(line.strip().split()[2])
+                exception_name = self.exception_names[self.exception_type]
+                if 'exception' in cpurfs[self.cpurf_id]:
+                    cpurfs[self.cpurf_id]['exception']['type'] = exception_name
+                else:
+                    cpurfs[self.cpurf_id]['exception'] = {'type': exception_name}
+            elif line.startswith('Exception return'):
+                _, _, _, _, f, _, t, _, pc = line.strip().split()
+                cpurfs[self.cpurf_id]['exception'] = {'ret': True, 'from': f, 'to': t, 'pc': pc}
+                self.state = 5
+            elif line.find('mode switch') != -1:
+                _, _, _, _, f, _, t, _, pc = line.strip().split()
+                cpurfs[self.cpurf_id]['exception'] = {'switch': True, 'from': f, 'to': t, 'pc': pc}
+                self.state = 10
+            else:
+                self.state = 10
+        if self.state == 8:
+            if self.exception_type in [1, 2, 5, 11]:
+                self.state = 10
+        if self.state in [1, 2, 3, 4, 5, 6, 7, 8, 9]:
+            self.state += 1
+        if self.state == 10:
+            self.state = 0
+            completed = cpurfs[self.cpurf_id]
+            self.cpurf_id += 1
+        self.ln += 1
+        return completed
+
+
+class MIPS32CpurfParser(object):
+    def __init__(self, exception_names, cpurfs, ln=0, cpurf_id=0):
+        """
+        Line-fed state machine for MIPS32 cpu register files.
+
+        pc=0x80005d0c HI=0x00000000 LO=0x00000000 ds 0090 80005d0c 0        1 <- 0
+        GPR00: r0 00000000 at 1000001f v0 00000000 v1 00000000              2
+        GPR04: a0 00000000 a1 00000000 a2 00000000 a3 00000000              3
+        GPR08: t0 80005d0c t1 00000000 t2 00000000 t3 00000000              4
+        GPR12: t4 00000000 t5 00000000 t6 00000000 t7 00000000              5
+        GPR16: s0 00000000 s1 00000000 s2 00000000 s3 00000000              6
+        GPR20: s4 00000000 s5 00000000 s6 00000000 s7 00000000              7
+        GPR24: t8 00000000 t9 00000000 k0 00000000 k1 00000000              8
+        GPR28: gp 00000000 sp 00000000 s8 00000000 ra 00000000              9
+        CP0 Status  0x10400000 Cause   0x00000000 EPC    0x00000000         10
+            Config0 0x80000482 Config1 0x9e190c8f LLAddr 0x0000000000000000 11
+            Config2 0x80000000 Config3 0x00000c20                           12
+            Config4 0x00000000 Config5 0x00000000                           13
+        do_raise_exception_err: 28 0                                                            14
+        mips_cpu_do_interrupt enter: PC 801d0e9c EPC 00000000 data bus error exception          15
+        mips_cpu_do_interrupt: PC bfc00380 EPC 801d0e9c cause 7                                 16
+            S 10400002 C 0000001c A 00000000 D 00000000                                         17
+        do_raise_exception_err: 15 0                                                            14
+        mips_cpu_do_interrupt enter: PC bfc00380 EPC 801d0e9c instruction bus error exception   15
+        mips_cpu_do_interrupt: PC bfc00380 EPC 801d0e9c cause 6                                 16
+            S 10400002 C 00000018 A 00000000 D 00000000                                         17
+        do_raise_exception_err: 26 0                                                            14
+        mips_cpu_do_interrupt enter: PC 80008e20 EPC 00000000 TLB load exception                15
+        mips_cpu_do_interrupt: PC bfc00380 EPC 80008e20 cause 2                                 16
+            S 00400002 C 00000008 A 000000a0 D 00000000                                         17
+        do_raise_exception_err: 20 0                                                            14
+        mips_cpu_do_interrupt enter: PC 80448320 EPC 00000000 reserved instruction exception    15
+        mips_cpu_do_interrupt: PC bfc00380 EPC 80448320 cause 10                                16
+            S 00400006 C 00000028 A 00000000 D 00000000                                         17
+        """
+        self.exception_names = exception_names
+        self.cpurfs = cpurfs
+        self.ln = ln
+        self.cpurf_id = cpurf_id
+        self.state = 0
+
+    # the first line of a cpurf, see FilteredCpurfParser
+    prefix = 'pc='
+
+    def peek_pc(self, line):
+        if line.startswith('pc='):
+            return line.split()[0][5:]
+        return None
+
+    def peek_mode(self, line):
+        if line.startswith('CP0 Status'):
+            return self.parse_state(line)
+        return None
+
+    def parse_state(self, line):
+        """
+        SR: Soft-Reset, 20
+        NMI: Non-Maskable-Interrupt, 19
+        IM7-0: Interrupt-Mask, 15-8
+        KSU: Kernel-Supervise-User, 4-3
+        """
+        status = int(line.strip().split()[2], 16)
+        mode_value = status >> 3 & 0x3
+        if mode_value == 0:
+            mode = 'kernel'
+        elif mode_value == 1:
+            mode = 'supervisor'
+        elif mode_value == 2:
+            mode = 'user'
+        else:
+            raise ValueError('bad status register')
+        return mode
+
+    def parse_rfs(self, line, ref=4, off=1):
+        things = line.strip().split()
+        rfs = {}
+        for i in range(0, ref):
+            value = things[off + 1 + 2 * i]
+            if value.startswith('0x'):
+                value = value[2:]
+            rfs[things[off + 2 * i]] = value
+        offset = self.ln + 1
+        return offset, rfs
+
+    def feed(self, line):
+        """Consume one line and return the cpurf it completes, if any."""
+        cpurfs = self.cpurfs
+        completed = None
+        if self.state == 0 and line.startswith('pc='):
+            self.state = 1
+            offset, rfs = self.ln + 1, {'pc': line.strip().split()[0][5:]}
+            cpurfs[self.cpurf_id] = {'id': self.cpurf_id, 'ln': offset, 'register_files': rfs}
+        if self.state in [2, 3, 4, 5, 6, 7, 8, 9]:
+            _, rfs = self.parse_rfs(line, ref=4, off=1)
+            for rf_name, rf_value in rfs.items():
+                cpurfs[self.cpurf_id]['register_files'][rf_name] = rf_value
+        if self.state in [10]:
+            mode = self.parse_state(line)
+            _, rfs = self.parse_rfs(line, ref=3, off=1)
+            for rf_name, rf_value in rfs.items():
+                cpurfs[self.cpurf_id]['register_files'][rf_name] = rf_value
+            cpurfs[self.cpurf_id]['mode'] = mode
+        if self.state in [11]:
+            _, rfs = self.parse_rfs(line, ref=3, off=0)
+            for rf_name, rf_value in rfs.items():
+                cpurfs[self.cpurf_id]['register_files'][rf_name] = rf_value
+        if self.state in [12, 13]:
+            _, rfs = self.parse_rfs(line, ref=2, off=0)
+            for rf_name, rf_value in rfs.items():
+                cpurfs[self.cpurf_id]['register_files'][rf_name] = rf_value
+        if self.state == 14:
+            if line.startswith('pc='):
+                self.cpurf_id += 1
+                self.state = 1
+                offset, rfs = self.ln + 1, {'pc': line.strip().split()[0][5:]}
+                cpurfs[self.cpurf_id] = {'id': self.cpurf_id, 'ln': offset, 'register_files': rfs}
+            elif line.startswith('do_raise_exception_err'):
+                pass
+            elif line.startswith('---'):
+                self.state = 18
+            else:
+                self.state = 18
+        if self.state == 15:
+            if line.startswith('mips_cpu_do_interrupt'):
+                pass
+            else:
+                self.state = 18
+        if self.state == 16:
+            exception_type = int(line.strip().split()[-1])
+            exception_name = self.exception_names[exception_type]
+            if 'exception' in cpurfs[self.cpurf_id]:
+                # no need for exception chain
+                # cpurfs[self.cpurf_id]['exception']['type'] = exception_name
+                pass
+            else:
+                cpurfs[self.cpurf_id]['exception'] = {'type': exception_name}
+            epc = line.strip().split()[-3]
+            cpurfs[self.cpurf_id]['register_files']['EPC'] = epc
+        if self.state == 17:
+            self.state = 13
+        if self.state in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16]:
+            self.state += 1
+        if self.state == 18:
+            self.state = 0
+            completed = cpurfs[self.cpurf_id]
+            self.cpurf_id += 1
+        self.ln += 1
+        return completed
+
+
+class Filter(object):
+    def __init__(self, pcs=None, lns=None, modes=None):
+        """
+        Predicates on cpurfs that the parsers check before building them,
+        see get_pql(filter=...).
+
+        pcs and lns are lists of [start, end) ranges, modes a list of modes,
+        e.g. svc32 or kernel, and None matches anything. Basic blocks are
+        kept if their address is in pcs and they are translated before the
+        end of lns, so that get_bb() works on every kept cpurf.
+        """
+        self.pcs = pcs
+        self.lns = lns
+        self.modes = None if modes is None else set(modes)
+        self.last_ln = None if lns is None else max(end for _, end in lns)
+
+    def match_pc(self, pc):
+        if self.pcs is None:
+            return True
+        address = int(pc, 16)
+        return any(start <= address < end for start, end in self.pcs)
+
+    def match_ln(self, ln):
+        return self.lns is None or any(start <= ln < end for start, end in self.lns)
+
+    def match_mode(self, mode):
+        return self.modes is None or mode in self.modes
+
+    def match_bb(self, address, ln):
+        return (self.last_ln is None or ln < self.last_ln) and self.match_pc(address)
+
+
+class FilteredCpurfParser(object):
+    def __init__(self, parser, filter):
+        """
+        Feed a cpurf parser with the cpurfs the Filter accepts only.
+
+        The lines of a cpurf are held back until its pc and its mode are
+        known (its ln is known from the start), then either fed or counted,
+        so that cpurf ids and lns are those of an unfiltered parse.
+        """
+        self.parser = parser
+        self.filter = filter
+        # the id of the next cpurf
+        self.records = parser.cpurf_id
+        self.held = None
+        self.skipping = False
+        self.pc = None
+        self.mode = None
+
+    @property
+    def cpurf_id(self):
+        return self.parser.cpurf_id
+
+    @property
+    def state(self):
+        return self.parser.state
+
+    def feed(self, line):
+        """Consume one line and return the cpurf it completes, if any."""
+        parser = self.parser
+        if line.startswith(parser.prefix):
+            if self.held is not None:
+                # truncated, it is never complete
+                self.skip()
+            self.records += 1
+            self.skipping = False
+            if not self.filter.match_ln(parser.ln + 1):
+                self.held = []
+                self.skip()
+            else:
+                self.held, self.pc, self.mode = [], None, None
+        if self.held is not None:
+            self.held.append(line)
+            return self.decide(line)
+        if self.skipping:
+            parser.ln += 1
+            return None
+        return parser.feed(line)
+
+    def decide(self, line):
+        parser, f = self.parser, self.filter
+        if f.pcs is not None and self.pc is None:
+            self.pc = parser.peek_pc(line)
+            if self.pc is not None and not f.match_pc(self.pc):
+                return self.skip()
+        if f.modes is not None and self.mode is None:
+            self.mode = parser.peek_mode(line)
+            if self.mode is not None and not f.match_mode(self.mode):
+                return self.skip()
+        if (f.pcs is None or self.pc is not None) and (f.modes is None or self.mode is not None):
+            held, self.held = self.held, None
+            if parser.state == 0:
+                parser.cpurf_id = self.records - 1
+            completed = None
+            for line in held:
+                completed = parser.feed(line) or completed
+            return completed
+        return None
+
+    def skip(self):
+        parser = self.parser
+        # the previous cpurf ends here
+        parser.state = 0
+        parser.cpurf_id = self.records
+        parser.ln += len(self.held)
+        self.held = None
+        self.skipping = True
+        return None
+
+
+class RegisterFilesView(Mapping):
+    """Read-only register_files of a cpurf kept in a CpurfStore."""
+    __slots__ = ('store', 'id')
+
+    def __init__(self, store, cpurf_id):
+        self.store = store
+        self.id = cpurf_id
+
+    def __getitem__(self, name):
+        store = self.store
+        if self.id in store.loose:
+            return store.loose[self.id][name]
+        column = store.columns.get(name)
+        if column is not None:
+            return '%08x' % store.register(self.id, column)
+        column = store.wide_columns.get(name)
+        if column is not None:
+            return '%016x' % store.wide_register(self.id, column)
+        return store.extras[self.id][name]
+
+    def __iter__(self):
+        store = self.store
+        if self.id in store.loose:
+            yield from store.loose[self.id]
+            return
+        yield from store.schema
+        yield from store.wide_schema
+        if self.id in store.extras:
+            yield from store.extras[self.id]
+
+    def __len__(self):
+        store = self.store
+        if self.id in store.loose:
+            return len(store.loose[self.id])
+        return store.width + store.wide_width + len(store.extras.get(self.id, ()))
+
+
+class CpurfView(Mapping):
+    """Read-only cpurf kept in a CpurfStore, looking like the cpurf dict."""
+    __slots__ = ('store', 'id')
+
+    def __init__(self, store, cpurf_id):
+        self.store = store
+        self.id = cpurf_id
+
+    def __getitem__(self, key):
+        store = self.store
+        if key == 'id':
+            return self.id
+        if key == 'ln':
+            return store.lns[self.id]
+        if key == 'register_files':
+            return RegisterFilesView(store, self.id)
+        if key == 'mode' and store.modes[self.id]:
+            return store.mode_names[store.modes[self.id]]
+        if key == 'exception':
+            return store.exceptions[self.id]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield 'id'
+        yield 'ln'
+        yield 'register_files'
+        if self.store.modes[self.id]:
+            yield 'mode'
+        if self.id in self.store.exceptions:
+            yield 'exception'
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class CpurfStore(Mapping):
+    # the arrays a cache file keeps as they are, see PQLI.save_cache()
+    array_names = ['registers', 'wide_registers', 'lns', 'modes']
+
+    def __init__(self, schema, wide_schema=()):
+        """
+        Columnar storage of cpurfs with one fixed register schema per arch.
+
+        Registers in the schema are parsed once into a flat uint32 array of
+        shape (n_cpurfs, len(schema)), 64-bit ones (wide_schema) into a uint64
+        array. Other registers go into a sparse per-cpurf dict, and cpurfs
+        that miss a register of the schema are kept as they are. Items are
+        CpurfView objects that answer like the cpurf dicts.
+
+        The cpurf being parsed stays a plain dict until the next one starts
+        or seal() is called.
+        """
+        self.schema = list(schema)
+        self.columns = {name: i for i, name in enumerate(self.schema)}
+        self.width = len(self.schema)
+        self.registers = array('I')
+        self.wide_schema = list(wide_schema)
+        self.wide_columns = {name: i for i, name in enumerate(self.wide_schema)}
+        self.wide_width = len(self.wide_schema)
+        self.wide_registers = array('Q')
+        self.lns = array('Q')
+        self.modes = array('B')
+        self.mode_names = [None]
+        self.mode_codes = {}
+        self.exceptions = {}
+        self.extras = {}
+        self.loose = {}
+        self.pending = None
+
+    def __setitem__(self, cpurf_id, cpurf):
+        if cpurf_id != len(self.lns) + (self.pending is not None):
+            raise KeyError('cpurfs must be stored in order')
+        self.seal()
+        self.pending = cpurf
+
+    def seal(self):
+        """Move the pending cpurf dict into the columns."""
+        cpurf = self.pending
+        if cpurf is None:
+            return
+        self.pending = None
+        cpurf_id = len(self.lns)
+        rfs = cpurf['register_files']
+        if all(len(rfs.get(name, '')) == 8 for name in self.schema) and \
+                all(len(rfs.get(name, '')) == 16 for name in self.wide_schema):
+            self.append_registers([int(rfs[name], 16) for name in self.schema],
+                                  [int(rfs[name], 16) for name in self.wide_schema])
+            if len(rfs) > self.width + self.wide_width:
+                self.extras[cpurf_id] = {
+                    name: value for name, value in rfs.items()
+                    if name not in self.columns and name not in self.wide_columns}
+        else:
+            # incomplete or odd-sized, keep it as it is
+            self.append_registers(None, None)
+            self.loose[cpurf_id] = rfs
+        self.lns.append(cpurf['ln'])
+        self.modes.append(self.mode_code(cpurf.get('mode')))
+        if 'exception' in cpurf:
+            self.exceptions[cpurf_id] = cpurf['exception']
+
+    def append_registers(self, values, wide_values):
+        """Append the registers of the next cpurf, None for a loose one."""
+        self.registers.extend(values or [0] * self.width)
+        self.wide_registers.extend(wide_values or [0] * self.wide_width)
+
+    def extend_registers(self, other):
+        self.registers.extend(other.registers)
+        self.wide_registers.extend(other.wide_registers)
+
+    def register(self, cpurf_id, column):
+        return self.registers[cpurf_id * self.width + column]
+
+    def wide_register(self, cpurf_id, column):
+        return self.wide_registers[cpurf_id * self.wide_width + column]
+
+    def mode_code(self, mode):
+        if mode is None:
+            return 0
+        if mode not in self.mode_codes:
+            self.mode_codes[mode] = len(self.mode_names)
+            self.mode_names.append(mode)
+        return self.mode_codes[mode]
+
+    def fits(self, rfs):
+        """Whether rfs has exactly the registers of the schema."""
+        return len(rfs) == self.width + self.wide_width and \
+            all(name in rfs for name in self.schema) and all(name in rfs for name in self.wide_schema)
+
+    def append_row(self, ln, rfs, mode):
+        """
+        Append a cpurf without exception whose rfs fits() and has values of
+        the right width, as str or bytes.
+        """
+        self.seal()
+        self.append_registers([int(rfs[name], 16) for name in self.schema],
+                              [int(rfs[name], 16) for name in self.wide_schema])
+        self.lns.append(ln)
+        self.modes.append(self.mode_code(mode))
+
+    def extend(self, other):
+        """Append the sealed cpurfs of another store, renumbering their ids."""
+        offset = len(self)
+        self.extend_registers(other)
+        self.lns.extend(other.lns)
+        codes = [0]
+        for mode in other.mode_names[1:]:
+            if mode not in self.mode_codes:
+                self.mode_codes[mode] = len(self.mode_names)
+                self.mode_names.append(mode)
+            codes.append(self.mode_codes[mode])
+        self.modes.extend(codes[code] for code in other.modes)
+        for mine, theirs in [(self.exceptions, other.exceptions),
+                             (self.extras, other.extras), (self.loose, other.loose)]:
+            for cpurf_id, value in theirs.items():
+                mine[cpurf_id + offset] = value
+
+    def get_state(self):
+        """Get what a cache file keeps of the sealed store besides array_names, as JSON."""
+        return {'mode_names': self.mode_names, 'exceptions': self.exceptions,
+                'extras': self.extras, 'loose': self.loose}
+
+    def set_state(self, state, arrays):
+        """Restore the store from get_state() and the arrays of array_names."""
+        for name, values in arrays.items():
+            setattr(self, name, values)
+        self.mode_names = state['mode_names']
+        self.mode_codes = {mode: code for code, mode in enumerate(self.mode_names) if code}
+        # JSON keys are strings
+        for name in ['exceptions', 'extras', 'loose']:
+            setattr(self, name, {int(cpurf_id): value for cpurf_id, value in state[name].items()})
+
+    def __getitem__(self, cpurf_id):
+        try:
+            # e.g. the numpy integers of where()
+            cpurf_id = operator.index(cpurf_id)
+        except TypeError:
+            raise KeyError(cpurf_id)
+        if self.pending is not None and cpurf_id == len(self.lns):
+            return self.pending
+        if not 0 <= cpurf_id < len(self.lns):
+            raise KeyError(cpurf_id)
+        return CpurfView(self, cpurf_id)
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __len__(self):
+        return len(self.lns) + (self.pending is not None)
+
+
+class DeltaCpurfStore(CpurfStore):
+    array_names = CpurfStore.array_names + ['keyframe_offsets', 'counts', 'change_words', 'change_values']
+
+    def __init__(self, schema, wide_schema=(), keyframe=64):
+        """
+        CpurfStore keeping every keyframe-th cpurf in full and, for the
+        others, only the registers that changed since the previous cpurf.
+
+        Registers are handled as 32-bit words, two per wide register, so
+        that the upper half of a 64-bit register that does not change costs
+        nothing. Random access rebuilds a cpurf from its keyframe, in at
+        most keyframe steps, and access in id order in one step.
+        """
+        super().__init__(schema, wide_schema)
+        self.keyframe = keyframe
+        self.words = self.width + 2 * self.wide_width
+        # registers holds the words of the keyframes only
+        self.keyframe_offsets = array('Q')
+        self.counts = array('B')
+        self.change_words = array('B' if self.words <= 256 else 'H')
+        self.change_values = array('I')
+        self.tail = [0] * self.words
+        # (cpurf_id, words, end of its changes) of the last rebuilt cpurf
+        self.last = None
+
+    def append_registers(self, values, wide_values):
+        if values is None:
+            # loose, repeat the previous words
+            row = self.tail
+        else:
+            row = list(values)
+            for value in wide_values:
+                row.append(value & 0xffffffff)
+                row.append(value >> 32)
+        if len(self.counts) % self.keyframe == 0:
+            self.keyframe_offsets.append(len(self.change_words))
+            self.registers.extend(row)
+            self.counts.append(0)
+        else:
+            count = 0
+            for word, (old, new) in enumerate(zip(self.tail, row)):
+                if old != new:
+                    self.change_words.append(word)
+                    self.change_values.append(new)
+                    count += 1
+            self.counts.append(count)
+        self.tail = row
+
+    def extend_registers(self, other):
+        for cpurf_id in range(len(other.lns)):
+            values = other.row(cpurf_id)
+            self.append_registers(values[:self.width], [
+                values[i] | values[i + 1] << 32 for i in range(self.width, self.words, 2)])
+
+    def get_state(self):
+        state = super().get_state()
+        state['tail'] = self.tail
+        return state
+
+    def set_state(self, state, arrays):
+        super().set_state(state, arrays)
+        self.tail = state['tail']
+
+    def row(self, cpurf_id):
+        """Get the words of the cpurf."""
+        last = self.last
+        if last is not None and last[0] == cpurf_id:
+            return last[1]
+        if last is not None and last[0] == cpurf_id - 1 and cpurf_id % self.keyframe:
+            row, offset, start = list(last[1]), last[2], cpurf_id
+        else:
+            k = cpurf_id // self.keyframe
+            row = self.registers[k * self.words:(k + 1) * self.words].tolist()
+            offset, start = self.keyframe_offsets[k], k * self.keyframe + 1
+        for i in range(start, cpurf_id + 1):
+            end = offset + self.counts[i]
+            for j in range(offset, end):
+                row[self.change_words[j]] = self.change_values[j]
+            offset = end
+        self.last = (cpurf_id, row, offset)
+        return row
+
+    def register(self, cpurf_id, column):
+        return self.row(cpurf_id)[column]
+
+    def wide_register(self, cpurf_id, column):
+        row = self.row(cpurf_id)
+        word = self.width + 2 * column
+        return row[word] | row[word + 1] << 32
+
+    def changed(self, cpurf_id):
+        """
+        Get the names of the registers that changed since the previous
+        cpurf, or None if it is not known from the stored changes alone
+        (keyframes, loose cpurfs and registers out of the schema).
+        """
+        if cpurf_id % self.keyframe == 0 or cpurf_id >= len(self.lns):
+            return None
+        for i in [cpurf_id - 1, cpurf_id]:
+            if i in self.loose or i in self.extras:
+                return None
+        self.row(cpurf_id)
+        end = self.last[2]
+        names = []
+        for j in range(end - self.counts[cpurf_id], end):
+            word = self.change_words[j]
+            if word < self.width:
+                names.append(self.schema[word])
+            else:
+                name = self.wide_schema[(word - self.width) // 2]
+                if name not in names:
+                    names.append(name)
+        return names
+
+
+class CpurfWindow(Mapping):
+    def __init__(self, size):
+        """
+        The cpurfs around the current one in mode='stream', that is up to
+        size cpurfs before it and size cpurfs after it.
+        """
+        self.size = size
+        self.cpurfs = deque(maxlen=2 * size + 1)
+        self.done = False
+
+    def append(self, cpurf):
+        self.cpurfs.append(cpurf)
+
+    def lookup(self, cpurf_id):
+        """Get a cpurf in the window, None if it is not in the trace."""
+        if cpurf_id in self:
+            return self[cpurf_id]
+        if cpurf_id < 0 or self.done and (not self.cpurfs or cpurf_id > self.cpurfs[-1]['id']):
+            return None
+        raise ValueError('cpurf {} is out of the streaming window'.format(cpurf_id))
+
+    def __getitem__(self, cpurf_id):
+        if not self.cpurfs:
+            raise KeyError(cpurf_id)
+        i = cpurf_id - self.cpurfs[0]['id']
+        if not 0 <= i < len(self.cpurfs):
+            raise KeyError(cpurf_id)
+        return self.cpurfs[i]
+
+    def __iter__(self):
+        return (cpurf['id'] for cpurf in self.cpurfs)
+
+    def __len__(self):
+        return len(self.cpurfs)
+
+
+class SeekIndex(object):
+    array_names = ['cpurf_offsets', 'cpurf_lns', 'bb_offsets', 'bb_lns']
+
+    def __init__(self):
+        """
+        Byte offsets and lns of the first line of every cpurf and of every
+        basic block (its ---------------- separator).
+        """
+        self.cpurf_offsets = array('Q')
+        self.cpurf_lns = array('Q')
+        self.bb_offsets = array('Q')
+        self.bb_lns = array('Q')
+
+
+class TraceFollower(object):
+    def __init__(self, pql):
+        """
+        Incremental parser of a tracefile that is still being written.
+
+        It keeps the file position, the partial last line and both state
+        machines between polls, so nothing is parsed twice.
+        """
+        if pql.is_compressed():
+            raise NotImplementedError('Unsupported follow of compressed {}'.format(pql.tracefile))
+        self.pql = pql
+        self.f = open(pql.tracefile, 'rb')
+        self.partial = b''
+        self.scratch = {}
+        self.cpurf_parser = pql.new_cpurf_parser(self.scratch)
+        self.in_asm_parser = pql.new_in_asm_parser()
+        pql.bbs = self.in_asm_parser.bbs
+        pql.bb_index = self.in_asm_parser.index
+
+    def poll(self, size=None):
+        """
+        Parse up to size bytes (BUFFER_SIZE by default) of what has been
+        appended and return the new ('bb', bb) and ('cpurf', cpurf), None if
+        nothing has been appended.
+        """
+        data = self.f.read(BUFFER_SIZE if size is None else size)
+        if not data:
+            return None
+        lines = (self.partial + data).split(b'\n')
+        # wait for the rest of the last line
+        self.partial = lines.pop()
+        return self.feed(lines)
+
+    def flush(self):
+        """
+        Parse what is left as if the tracefile ended here and return the
+        last ('cpurf', cpurf), which poll() holds back until the next one.
+        """
+        found = []
+        for chunk in iter(self.poll, None):
+            found.extend(chunk)
+        lines = [self.partial] if self.partial else []
+        self.partial = b''
+        found.extend(self.feed(lines))
+        found.extend(('cpurf', self.scratch.pop(cpurf_id)) for cpurf_id in list(self.scratch))
+        return found
+
+    def feed(self, lines):
+        found = []
+        scratch = self.scratch
+        for line in lines:
+            line = line.decode() + '\n'
+            bb = self.in_asm_parser.feed(line)
+            if bb is not None:
+                found.append(('bb', bb))
+            self.cpurf_parser.feed(line)
+            # a cpurf is complete once the next one starts or it is finalized
+            while scratch and next(iter(scratch)) < self.cpurf_parser.cpurf_id:
+                found.append(('cpurf', scratch.pop(next(iter(scratch)))))
+        return found
+
+    def close(self):
+        self.f.close()
+
+
+class ExceptionIndex(object):
+    def __init__(self, exceptions):
+        """
+        Index of the exceptions of a trace, from (cpurf id, exception) in
+        the order of the ids.
+
+        entries holds the ids of the cpurfs taking an exception and types
+        the same per exception type. returns holds the ids of the cpurfs
+        returning from one. Entries and returns are paired with a stack,
+        so nested exceptions get their own return. parents keeps the entry
+        an entry is nested in.
+        """
+        self.entries = array('Q')
+        self.types = {}
+        self.returns = array('Q')
+        self.rets = {}
+        self.parents = {}
+        stack = []
+        for cpurf_id, exception in exceptions:
+            # an exception return may come before the next exception
+            if exception.get('ret'):
+                self.returns.append(cpurf_id)
+                if stack:
+                    self.rets[stack.pop()] = cpurf_id
+            if 'type' in exception:
+                self.entries.append(cpurf_id)
+                self.types.setdefault(exception['type'], array('Q')).append(cpurf_id)
+                if stack:
+                    self.parents[cpurf_id] = stack[-1]
+                stack.append(cpurf_id)
+
+    def entries_of(self, type=None):
+        if type is None:
+            return self.entries
+        return self.types.get(type, ())
+
+    def next_return(self, cpurf_id):
+        """Get the first exception return at or after the cpurf."""
+        i = bisect.bisect_left(self.returns, cpurf_id)
+        return self.returns[i] if i < len(self.returns) else None
+
+    def span(self, cpurf_id):
+        i = bisect.bisect_right(self.entries, cpurf_id) - 1
+        if i < 0:
+            return None
+        entry = self.entries[i]
+        # climb out of the exceptions that returned before the cpurf
+        while entry is not None and self.rets.get(entry, cpurf_id) < cpurf_id:
+            entry = self.parents.get(entry)
+        if entry is None:
+            return None
+        return entry, self.rets.get(entry)
+
+
+class Coverage(object):
+    def __init__(self):
+        """
+        Incremental execution counters: hits of every basic block, a bitmap
+        of the executed instructions among the translated ones, and hits of
+        every edge between the pcs of two consecutive cpurfs.
+
+        Addresses get a slot the first time they are seen, and counters are
+        arrays indexed by slot, so a pass over millions of cpurfs only grows
+        them with the code that runs.
+        """
+        # pc -> slot, and back
+        self.blocks = {}
+        self.pcs = []
+        self.hits = array('Q')
+        # instruction address -> slot, and back
+        self.instructions = {}
+        self.addresses = []
+        # a bit per slot, set once the instruction is executed
+        self.bitmap = bytearray()
+        # first ln of the translations whose instructions are marked
+        self.marked = set()
+        # (pc slot, pc slot) -> slot
+        self.edges = {}
+        self.edge_hits = array('Q')
+        self.last = None
+
+    def hit(self, pc, bb):
+        """Count the execution of the basic block bb at pc."""
+        slot = self.blocks.get(pc)
+        if slot is None:
+            slot = self.blocks[pc] = len(self.pcs)
+            self.pcs.append(pc)
+            self.hits.append(0)
+        self.hits[slot] += 1
+        if bb['instructions'][0]['ln'] not in self.marked:
+            self.marked.add(bb['instructions'][0]['ln'])
+            for instruction in bb['instructions']:
+                bit = self.slot(instruction['address'])
+                self.bitmap[bit >> 3] |= 1 << (bit & 7)
+        if self.last is not None:
+            edge = self.edges.get((self.last, slot))
+            if edge is None:
+                edge = self.edges[(self.last, slot)] = len(self.edge_hits)
+                self.edge_hits.append(0)
+            self.edge_hits[edge] += 1
+        self.last = slot
+
+    def slot(self, address):
+        slot = self.instructions.get(address)
+        if slot is None:
+            slot = self.instructions[address] = len(self.addresses)
+            self.addresses.append(address)
+            if slot >> 3 == len(self.bitmap):
+                self.bitmap.append(0)
+        return slot
+
+    def translate(self, bb):
+        """Count the instructions of the basic block bb as translated, executed or not."""
+        for instruction in bb['instructions']:
+            self.slot(instruction['address'])
+
+    def is_covered(self, address):
+        """Whether the instruction at address was executed."""
+        slot = self.instructions.get(address)
+        return slot is not None and bool(self.bitmap[slot >> 3] & 1 << (slot & 7))
+
+    def executed(self):
+        """Get how many distinct instructions were executed."""
+        return sum(bin(byte).count('1') for byte in self.bitmap)
+
+    def covered(self):
+        """Get the addresses of the executed instructions, sorted."""
+        return sorted(address for address in self.addresses if self.is_covered(address))
+
+    def uncovered(self):
+        """Get the addresses of the translated instructions never executed, sorted."""
+        return sorted(address for address in self.addresses if not self.is_covered(address))
+
+    def block_hits(self):
+        """Get the hits of every basic block, by pc."""
+        return dict(zip(self.pcs, self.hits))
+
+    def hot_blocks(self, n=10):
+        """Get the n most executed (pc, hits)."""
+        slots = sorted(range(len(self.pcs)), key=lambda slot: -self.hits[slot])[:n]
+        return [(self.pcs[slot], self.hits[slot]) for slot in slots]
+
+    def edge_counts(self):
+        """Get the hits of every edge, by (from pc, to pc)."""
+        return {(self.pcs[a], self.pcs[b]): self.edge_hits[edge] for (a, b), edge in self.edges.items()}
+
+
+class CallStack(object):
+    def __init__(self, pql, max_depth=1024):
+        """
+        Shadow call stack fed with the cpurfs of pql in order.
+
+        feed() classifies the transition from the previous cpurf:
+        - 'exception' if the previous cpurf takes an exception,
+        - 'return' if it returns from an exception, or if the pc is the
+          return address of a frame on the stack, popped up to that frame,
+        - 'call' if the link register points right after the basic block
+          of the previous cpurf and the pc is elsewhere,
+        - 'jump' otherwise.
+
+        A function is named after the pc it is entered at. Only max_depth
+        frames are kept, dropping the outermost ones, and the counters grow
+        with the functions and call paths, not with the tracefile.
+        """
+        self.pql = pql
+        self.max_depth = max_depth
+        # [function, return address, kind, call tree node]
+        self.stack = deque()
+        # return address -> frames on the stack returning there
+        self.returns = {}
+        self.last = None
+        self.transitions = {'call': 0, 'return': 0, 'exception': 0, 'jump': 0}
+        # function -> cpurfs in it
+        self.functions = {}
+        # (caller, callee) -> calls and exceptions
+        self.graph = {}
+        # (parent node, function) -> node of the call tree
+        self.paths = {}
+        self.node_parents = array('q')
+        self.node_functions = []
+        self.node_cpurfs = array('Q')
+        self.node_calls = array('Q')
+
+    def push(self, function, return_address, kind):
+        if self.stack:
+            caller = self.stack[-1]
+            parent = caller[3]
+            edge = (caller[0], function)
+            self.graph[edge] = self.graph.get(edge, 0) + 1
+        else:
+            parent = -1
+        node = self.paths.get((parent, function))
+        if node is None:
+            node = self.paths[(parent, function)] = len(self.node_functions)
+            self.node_parents.append(parent)
+            self.node_functions.append(function)
+            self.node_cpurfs.append(0)
+            self.node_calls.append(0)
+        self.node_calls[node] += 1
+        if len(self.stack) == self.max_depth:
+            self.forget(self.stack.popleft())
+        self.stack.append([function, return_address, kind, node])
+        if return_address is not None:
+            self.returns[return_address] = self.returns.get(return_address, 0) + 1
+
+    def forget(self, frame):
+        if frame[1] is not None:
+            self.returns[frame[1]] -= 1
+            if not self.returns[frame[1]]:
+                del self.returns[frame[1]]
+
+    def pop_to(self, match):
+        """Pop the frames up to the innermost one matching, if any."""
+        if not any(match(frame) for frame in self.stack):
+            return False
+        while True:
+            frame = self.stack.pop()
+            self.forget(frame)
+            if match(frame):
+                return True
+
+    def feed(self, cpurf):
+        """Account the cpurf and get the kind of the transition to it, None for the first."""
+        pql = self.pql
+        pc = pql.get_pc(cpurf)
+        address = int(pc, 16)
+        kind = None
+        if self.last is None:
+            self.push(pc, None, 'root')
+        else:
+            end, exception, exception_pc = self.last
+            if exception is not None and 'type' in exception:
+                if exception.get('ret'):
+                    self.pop_to(lambda frame: frame[2] == 'exception')
+                kind = 'exception'
+                self.push(pc, exception_pc, 'exception')
+            elif exception is not None and exception.get('ret'):
+                kind = 'return'
+                self.pop_to(lambda frame: frame[2] == 'exception')
+                if address in self.returns:
+                    # and from the function it interrupted
+                    self.pop_to(lambda frame: frame[1] == address)
+            elif address in self.returns:
+                kind = 'return'
+                self.pop_to(lambda frame: frame[1] == address)
+            elif end is not None and end != address and int(pql.get_ra(cpurf), 16) & ~1 == end:
+                # bit 0 of the link register is set by calls from Thumb
+                kind = 'call'
+                self.push(pc, end, 'call')
+            else:
+                kind = 'jump'
+            self.transitions[kind] += 1
+        if not self.stack:
+            # returned past the outermost frame kept
+            self.push(pc, None, 'root')
+        frame = self.stack[-1]
+        self.functions[frame[0]] = self.functions.get(frame[0], 0) + 1
+        self.node_cpurfs[frame[3]] += 1
+
+        end = None
+        if pql.bb_index is not None and pc in pql.bb_index:
+            last = pql.get_bb(cpurf)['instructions'][-1]
+            end = int(last['address'], 16) + pql.get_instruction_size(last)
+        exception = cpurf.get('exception')
+        exception_pc = pql.get_exception_pc(cpurf) if exception is not None else None
+        self.last = (end, exception, None if exception_pc is None else int(exception_pc, 16))
+        return kind
+
+    def call_tree(self):
+        """
+        Get the call tree as nested dicts with the function, the cpurfs in
+        it, how many times it was entered from its parent, and its callees.
+        """
+        nodes = [{'function': function, 'cpurfs': cpurfs, 'calls': calls, 'callees': []}
+                 for function, cpurfs, calls in zip(self.node_functions, self.node_cpurfs, self.node_calls)]
+        roots = []
+        for node, parent in zip(nodes, self.node_parents):
+            (roots if parent < 0 else nodes[parent]['callees']).append(node)
+        return roots
+
+
+class TraceDiff(object):
+    def __init__(self, left, right, registers=None, run=256, window=256, anchor=4):
+        """
+        Diff of two traces of the same firmware, aligned on their pcs.
+
+        Iterating it reads both traces in lockstep, see iter_executed_cpurfs(),
+        and yields:
+        - {'kind': 'registers', 'left': id, 'right': id, 'pc': pc,
+           'registers': {name: (left value, right value)}} for aligned
+          cpurfs whose registers differ (only the given registers, all if
+          registers is None, none if it is empty),
+        - {'kind': 'path', 'left': [(id, bb)], 'right': [(id, bb)]} for the
+          cpurfs and their basic blocks (see get_bb()) between a divergence
+          and the next anchor pcs both traces execute,
+        - {'kind': 'end', 'left': id, 'right': id} where the diff stops,
+          i.e. one trace ends or no anchor is found in window cpurfs. The id
+          of an exhausted trace is None.
+
+        Runs of run pcs are compared at once, and registers run by run, so
+        that matching regions are skipped quickly. Cpurfs or basic blocks
+        that are not loaded in mode='plain' are loaded first. Only run + window
+        cpurfs of each trace are held at a time.
+        """
+        self.left = left
+        self.right = right
+        self.registers = registers
+        self.run = run
+        self.window = window
+        self.anchor = anchor
+        # the first path or end
+        self.first = None
+        # aligned cpurfs, with the same pc
+        self.aligned = 0
+        self.mismatches = 0
+        self.divergences = 0
+
+    def fill(self, buffer, cpurfs, pcs, pql):
+        while len(buffer) < self.run + self.window:
+            cpurf = next(cpurfs, None)
+            if cpurf is None:
+                return
+            buffer.append(cpurf)
+            pcs.append(pql.get_pc(cpurf))
+
+    def compare(self, left, right):
+        """Yield the register mismatches of aligned cpurfs."""
+        if self.registers == []:
+            return
+        for a, b in zip(left, right):
+            a_rfs, b_rfs = a['register_files'], b['register_files']
+            names = self.registers
+            if names is None:
+                if a_rfs == b_rfs:
+                    continue
+                names = list(a_rfs) + [name for name in b_rfs if name not in a_rfs]
+            mismatches = {name: (a_rfs.get(name), b_rfs.get(name)) for name in names
+                          if a_rfs.get(name) != b_rfs.get(name)}
+            if mismatches:
+                self.mismatches += 1
+                yield {'kind': 'registers', 'left': a['id'], 'right': b['id'],
+                       'pc': self.left.get_pc(a), 'registers': mismatches}
+
+    def realign(self, left_pcs, right_pcs):
+        """Get the nearest (i, j) where anchor pcs of both traces are the same, None if there is none."""
+        k = min(self.anchor, len(left_pcs), len(right_pcs))
+        grams = {}
+        for i in range(len(left_pcs) - k + 1):
+            grams.setdefault(tuple(itertools.islice(left_pcs, i, i + k)), i)
+        best = None
+        for j in range(len(right_pcs) - k + 1):
+            if best is not None and j >= best[0] + best[1]:
+                break
+            i = grams.get(tuple(itertools.islice(right_pcs, j, j + k)))
+            if i is not None and (best is None or i + j < best[0] + best[1]):
+                best = (i, j)
+        return best
+
+    def path(self, buffer, pcs, n, pql):
+        path = []
+        for _ in range(n):
+            cpurf = buffer.popleft()
+            pc = pcs.popleft()
+            path.append((cpurf['id'], pql.get_bb(cpurf) if pc in pql.bb_index else None))
+        return path
+
+    def diverged(self, event):
+        if self.first is None:
+            self.first = event
+        return event
+
+    def __iter__(self):
+        left_cpurfs = iter(self.left.iter_executed_cpurfs())
+        right_cpurfs = iter(self.right.iter_executed_cpurfs())
+        left, right = deque(), deque()
+        left_pcs, right_pcs = deque(), deque()
+        while True:
+            self.fill(left, left_cpurfs, left_pcs, self.left)
+            self.fill(right, right_cpurfs, right_pcs, self.right)
+            if not left or not right:
+                if left or right:
+                    yield self.diverged({'kind': 'end', 'left': left[0]['id'] if left else None,
+                                         'right': right[0]['id'] if right else None})
+                return
+            n = min(len(left), len(right), self.run)
+            a = tuple(itertools.islice(left_pcs, n))
+            b = tuple(itertools.islice(right_pcs, n))
+            if a == b:
+                matched = n
+            else:
+                matched = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), n)
+            if matched:
+                yield from self.compare(itertools.islice(left, matched), itertools.islice(right, matched))
+            for _ in range(matched):
+                left.popleft()
+                right.popleft()
+                left_pcs.popleft()
+                right_pcs.popleft()
+            self.aligned += matched
+            if matched == n:
+                continue
+            self.divergences += 1
+            self.fill(left, left_cpurfs, left_pcs, self.left)
+            self.fill(right, right_cpurfs, right_pcs, self.right)
+            anchor = self.realign(left_pcs, right_pcs)
+            if anchor is None:
+                yield self.diverged({'kind': 'end', 'left': left[0]['id'], 'right': right[0]['id']})
+                return
+            i, j = anchor
+            yield self.diverged({'kind': 'path', 'left': self.path(left, left_pcs, i, self.left),
+                                 'right': self.path(right, right_pcs, j, self.right)})
+
+
+def import_numpy():
+    """Import NumPy, which is heavy, once a register query needs it."""
+    try:
+        import numpy
+    except ImportError:
+        raise NotImplementedError('Unsupported register queries without numpy installed')
+    return numpy
+
+
+class RegisterTable(object):
+    def __init__(self, cpurfs, schema, wide_schema=()):
+        """
+        Registers of the loaded cpurfs as NumPy columns, one row per cpurf
+        in id order, for vectorized queries.
+
+        The uint32/uint64 arrays of a CpurfStore are viewed without a copy,
+        the columns of a DeltaCpurfStore are rebuilt from its keyframes and
+        changes at once.
+        Cpurf dicts are parsed into integers once per register, the first
+        time the register is asked for. Registers a cpurf lacks read as 0.
+        """
+        numpy = import_numpy()
+        self.cpurfs = cpurfs
+        self.schema = list(schema)
+        self.wide_schema = list(wide_schema)
+        self.columns = {}
+        if isinstance(cpurfs, DeltaCpurfStore):
+            self.ids = numpy.arange(len(cpurfs.lns))
+        elif isinstance(cpurfs, CpurfStore):
+            n = len(cpurfs.lns)
+            self.ids = numpy.arange(n)
+            self.registers = numpy.frombuffer(cpurfs.registers, dtype=numpy.uint32).reshape(n, cpurfs.width)
+            self.wide_registers = numpy.frombuffer(
+                cpurfs.wide_registers, dtype=numpy.uint64).reshape(n, cpurfs.wide_width)
+        else:
+            self.ids = numpy.array(sorted(cpurfs), dtype=numpy.int64)
+
+    def parse(self, rfs, name):
+        value = rfs.get(name)
+        return int(value, 16) if value else 0
+
+    def delta_words(self, word):
+        """Get a word of every cpurf of a DeltaCpurfStore."""
+        numpy = import_numpy()
+        store = self.cpurfs
+        n = len(store.lns)
+        counts = numpy.frombuffer(store.counts, dtype=numpy.uint8)
+        changed = numpy.frombuffer(store.change_words, dtype=store.change_words.typecode) == word
+        ids = numpy.repeat(self.ids, counts)[changed]
+        keyframes = numpy.arange(0, n, store.keyframe)
+        values = numpy.zeros(n, dtype=numpy.uint32)
+        values[keyframes] = numpy.frombuffer(store.registers, dtype=numpy.uint32).reshape(-1, store.words)[:, word]
+        values[ids] = numpy.frombuffer(store.change_values, dtype=numpy.uint32)[changed]
+        # every cpurf takes the value of the last keyframe or change before it
+        last = numpy.zeros(n, dtype=numpy.int64)
+        last[keyframes] = keyframes
+        last[ids] = ids
+        numpy.maximum.accumulate(last, out=last)
+        return values[last]
+
+    def column(self, name):
+        """Get the values of the register in every cpurf."""
+        if name in self.columns:
+            return self.columns[name]
+        numpy = import_numpy()
+        dtype = numpy.uint32 if name in self.schema else numpy.uint64
+        cpurfs = self.cpurfs
+        if not isinstance(cpurfs, CpurfStore):
+            column = numpy.fromiter((self.parse(cpurfs[cpurf_id]['register_files'], name) for cpurf_id in self.ids),
+                                    dtype=dtype, count=len(self.ids))
+        else:
+            if isinstance(cpurfs, DeltaCpurfStore) and name in cpurfs.columns:
+                column = self.delta_words(cpurfs.columns[name])
+            elif isinstance(cpurfs, DeltaCpurfStore) and name in cpurfs.wide_columns:
+                word = cpurfs.width + 2 * cpurfs.wide_columns[name]
+                column = self.delta_words(word).astype(numpy.uint64) | \
+                    self.delta_words(word + 1).astype(numpy.uint64) << numpy.uint64(32)
+            elif name in cpurfs.columns:
+                column = self.registers[:, cpurfs.columns[name]]
+            elif name in cpurfs.wide_columns:
+                column = self.wide_registers[:, cpurfs.wide_columns[name]]
+            else:
+                column = numpy.zeros(len(self.ids), dtype=dtype)
+                for cpurf_id, extras in cpurfs.extras.items():
+                    column[cpurf_id] = self.parse(extras, name)
+            if cpurfs.loose:
+                # loose cpurfs have zeros in the arrays
+                column = column.copy()
+                for cpurf_id, rfs in cpurfs.loose.items():
+                    column[cpurf_id] = self.parse(rfs, name)
+        self.columns[name] = column
+        return column
+
+
+class NpzExporter(object):
+    def __init__(self, path, schema):
+        """
+        Write columns to a NumPy .npz file batch by batch, without NumPy.
+
+        Columns are spooled to temporary files and zipped as .npy members
+        on close(), when their length and the width of strings are known.
+        Kinds are 'u4', 'u8', 'str' and 'strs' (joined with spaces).
+        """
+        self.path = path
+        self.schema = schema
+        self.spools = {name: tempfile.TemporaryFile() for name, _ in schema}
+        self.widths = {name: 1 for name, _ in schema}
+        self.length = 0
+
+    def write_batch(self, batch):
+        for name, kind in self.schema:
+            spool = self.spools[name]
+            if kind in ['u4', 'u8']:
+                array('I' if kind == 'u4' else 'Q', batch[name]).tofile(spool)
+                continue
+            for value in batch[name]:
+                if value is None:
+                    value = ''
+                elif kind == 'strs':
+                    value = ' '.join(value)
+                self.widths[name] = max(self.widths[name], len(value))
+                spool.write(json.dumps(value).encode() + b'\n')
+        self.length += len(batch[self.schema[0][0]])
+
+    def header(self, descr):
+        header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(descr, self.length)
+        # magic, version 1.0, header size, header aligned to 64 bytes
+        header += ' ' * (-(10 + len(header) + 1) % 64) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+    def close(self):
+        order = '<' if sys.byteorder == 'little' else '>'
+        with zipfile.ZipFile(self.path, 'w', allowZip64=True) as zf:
+            for name, kind in self.schema:
+                spool = self.spools[name]
+                spool.seek(0)
+                with zf.open(name + '.npy', 'w', force_zip64=True) as member:
+                    if kind in ['u4', 'u8']:
+                        member.write(self.header(order + kind))
+                        shutil.copyfileobj(spool, member)
+                    else:
+                        width = self.widths[name]
+                        member.write(self.header('<U{}'.format(width)))
+                        for line in spool:
+                            value = json.loads(line)
+                            member.write(value.encode('utf-32-le') + b'\0' * 4 * (width - len(value)))
+                spool.close()
+
+
+class ArrowExporter(object):
+    def __init__(self, path, schema, format):
+        """Write columns to a Parquet or an Arrow IPC file batch by batch."""
+        # imported here, it is heavy and only exports need it
+        try:
+            import pyarrow
+        except ImportError:
+            raise NotImplementedError('Unsupported {} without pyarrow installed'.format(format))
+        self.table = pyarrow.Table
+        types = {'u4': pyarrow.uint32(), 'u8': pyarrow.uint64(),
+                 'str': pyarrow.string(), 'strs': pyarrow.list_(pyarrow.string())}
+        self.schema = pyarrow.schema([(name, types[kind]) for name, kind in schema])
+        if format == 'parquet':
+            from pyarrow import parquet
+            self.writer = parquet.ParquetWriter(path, self.schema)
+        else:
+            from pyarrow import ipc
+            self.writer = ipc.new_file(path, self.schema)
+
+    def write_batch(self, batch):
+        self.writer.write_table(self.table.from_pydict(batch, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def get_exporter(path, schema, format=None):
+    """Get the exporter of the format, or of the extension of path."""
+    if format is None:
+        format = os.path.splitext(path)[1][1:]
+    if format == 'npz':
+        return NpzExporter(path, schema)
+    elif format in ['parquet', 'arrow', 'feather']:
+        return ArrowExporter(path, schema, format)
+    else:
+        raise NotImplementedError('Unsupported export format {}'.format(format))
+
+
+class Stats(object):
+    def __init__(self, allocations=False, chains=10):
+        """
+        Instrumentation of a PQLI, see PQLI(stats=...).
+
+        phases: phase -> [calls, seconds, peak bytes allocated]
+        states: (parser, state) -> [lines, seconds] of the serial parsers
+        records: 'cpurf', 'bb', 'translation' and 'exception:<type>' -> count
+        chains: the longest retranslation chains as (address, length)
+
+        If allocations=True, tracemalloc is run during phases to record
+        their peak and their top allocation sites (in sites).
+        """
+        self.allocations = allocations
+        self.n_chains = chains
+        self.phases = {}
+        self.states = {}
+        self.records = {}
+        self.chains = []
+        self.sites = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        tracing = self.allocations and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.allocations:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            phase = self.phases.setdefault(name, [0, 0.0, None])
+            phase[0] += 1
+            phase[1] += elapsed
+            if self.allocations:
+                peak = tracemalloc.get_traced_memory()[1]
+                phase[2] = max(phase[2] or 0, peak)
+                statistics = tracemalloc.take_snapshot().statistics('lineno')
+                self.sites[name] = [str(statistic) for statistic in statistics[:5]]
+            if tracing:
+                tracemalloc.stop()
+
+    def loaded(self, pql, *sections):
+        """Count the records loaded by pql."""
+        if 'cpurfs' in sections:
+            self.records['cpurf'] = len(pql.cpurfs)
+            for kind in [kind for kind in self.records if kind.startswith('exception:')]:
+                del self.records[kind]
+            for type, entries in pql.exception_index.types.items():
+                self.records['exception:{}'.format(type)] = len(entries)
+            self.records['exception:ret'] = len(pql.exception_index.returns)
+        if 'bbs' in sections:
+            self.records['bb'] = len(pql.bb_index)
+            self.records['translation'] = sum(len(lns) for lns, _ in pql.bb_index.values())
+            chains = sorted(((address, len(lns)) for address, (lns, _) in pql.bb_index.items()),
+                            key=lambda chain: -chain[1])
+            self.chains = chains[:self.n_chains]
+
+    def report(self):
+        """Get the stats as lines of text."""
+        lines = []
+        for name, (calls, seconds, peak) in sorted(self.phases.items()):
+            line = '{:<24} {:>6} calls {:>10.4f}s'.format(name, calls, seconds)
+            if peak is not None:
+                line += ' {:>10.1f}MB peak'.format(peak / 2 ** 20)
+            lines.append(line)
+        for (parser, state), (n, seconds) in sorted(self.states.items()):
+            lines.append('{:<24} {:>6} lines {:>10.4f}s'.format('{} state {}'.format(parser, state), n, seconds))
+        for kind, n in sorted(self.records.items()):
+            lines.append('{:<24} {:>6}'.format(kind, n))
+        for address, n in self.chains:
+            lines.append('{:<24} {:>6} translations'.format(address, n))
+        return '\n'.join(lines)
+
+
+class InstrumentedParser(object):
+    def __init__(self, parser, stats, name):
+        """Time and count every line fed to a parser by the state it is in."""
+        self.parser = parser
+        self.stats = stats
+        self.name = name
+
+    def feed(self, line):
+        key = (self.name, self.parser.state)
+        start = time.perf_counter()
+        completed = self.parser.feed(line)
+        elapsed = time.perf_counter() - start
+        state = self.stats.states.get(key)
+        if state is None:
+            state = self.stats.states[key] = [0, 0.0]
+        state[0] += 1
+        state[1] += elapsed
+        return completed
+
+    def __getattr__(self, name):
+        return getattr(self.parser, name)
+
+
+class PQLI(object):
+    # registers every cpurf has, see CpurfStore
+    register_schema = []
+    wide_register_schema = []
+    # the register get_pc() reads
+    pc_register = None
+    # the first line of a cpurf
+    cpurf_prefix = None
+    # a cpurf without exception in bytes, see load_cpurf_fast()
+    fast_cpurf_pattern = None
+
+    def __init__(self, endian, tracefile, mode='plain', storage='dict', cache=False, jobs=1,
+                 window=64, fast=False, keyframe=64, intern=False, stats=None, filter=None):
+        """
+        PQL interfaces should be extended by any specific PQL classes.
+
+        If mode='stream', self.cpurfs is a CpurfWindow holding only the
+        window cpurfs before and after the current one, so memory does not
+        grow with the tracefile.
+
+        If storage='columnar', cpurfs are kept in a CpurfStore instead of
+        one dict per cpurf, which takes far less memory on large traces.
+        storage='delta' goes further with a DeltaCpurfStore, which keeps a
+        full cpurf every keyframe cpurfs and only the changed registers of
+        the others.
+
+        If intern=True, basic blocks are parsed with InAsmParser(intern=True),
+        so the instructions of retranslated blocks are stored only once. Their
+        operands are tuples then.
+
+        If cache=True, parsed cpurfs and basic blocks are saved next to the
+        tracefile (tracefile.pqlcache) and loaded from there as long as the
+        tracefile and the options shaping them do not change. Each section
+        is read on its own, the arrays of columnar and delta storage as they
+        are. With storage='dict', cpurfs are only cached with
+        cache='pickle', which pickles them: a pickled cache file runs code
+        when it is loaded, so only use it where nobody else can write next
+        to the tracefile.
+
+        If fast=True, mode='plain' loads parse an mmap of the tracefile with
+        load_cpurf_fast() and load_in_asm_fast(). The result is the same.
+
+        If jobs is more than 1 (or None for all cores), mode='plain' loads
+        split the tracefile into chunks and parse them in a process pool.
+        The result is identical to the serial parse. Compressed tracefiles
+        cannot be split and are always parsed serially.
+
+        Tracefiles ending with .gz, .xz, .bz2 or .zst (with zstandard
+        installed) are decompressed while they are read.
+
+        If stats is a Stats, the loads are timed, the serial parsers count
+        and time the lines of every state, and get_bb() is timed. Without
+        it, nothing is instrumented at all.
+
+        If filter is a Filter, the loads skip the cpurfs and basic blocks it
+        rejects before parsing them, see FilteredCpurfParser. The kept ones
+        have the ids and lns of an unfiltered load, so self.cpurfs has gaps.
+        This needs storage='dict' and a mode other than 'stream'.
+        """
+        self.endian = endian
+        self.cpurfs = None
+        self.bbs = None
+        self.bb_index = None
+        self.seek_index = None
+        self.exception_index = None
+        self.register_table = None
+        self.tracefile = tracefile
+        self.mode = mode
+        if storage not in ['dict', 'columnar', 'delta']:
+            raise NotImplementedError('Unsupported storage {}'.format(storage))
+        if cache not in [False, True, 'pickle']:
+            raise NotImplementedError('Unsupported cache {}'.format(cache))
+        self.storage = storage
+        if filter is not None and storage != 'dict':
+            raise NotImplementedError('Unsupported storage {} with a filter'.format(storage))
+        if filter is not None and mode == 'stream':
+            raise NotImplementedError('Unsupported mode {} with a filter'.format(mode))
+        self.filter = filter
+        self.cache = cache
+        self.jobs = jobs or os.cpu_count()
+        self.window = window
+        self.fast = fast
+        self.keyframe = keyframe
+        self.intern = intern
+        self.stats = stats
+        if stats is not None:
+            # only instrumented instances pay for it
+            self.get_bb = self.timed_get_bb
+
+    def phase(self, name):
+        if self.stats is None:
+            return NO_PHASE
+        return self.stats.phase(name)
+
+    def instrument(self, parser, name):
+        if self.stats is None:
+            return parser
+        return InstrumentedParser(parser, self.stats, name)
+
+    def timed_get_bb(self, cpurf):
+        start = time.perf_counter()
+        bb = PQLI.get_bb(self, cpurf)
+        phase = self.stats.phases.setdefault('get_bb', [0, 0.0, None])
+        phase[0] += 1
+        phase[1] += time.perf_counter() - start
+        return bb
+
+    def new_cpurfs(self):
+        if self.storage == 'columnar':
+            return CpurfStore(self.register_schema, self.wide_register_schema)
+        if self.storage == 'delta':
+            return DeltaCpurfStore(self.register_schema, self.wide_register_schema, keyframe=self.keyframe)
+        return {}
+
+    def seal_cpurfs(self, cpurfs):
+        if self.storage != 'dict':
+            cpurfs.seal()
+        self.cpurfs = cpurfs
+
+    def new_in_asm_parser(self, ln=0):
+        return self.instrument(InAsmParser(ln=ln, intern=self.intern, filter=self.filter), 'in_asm')
+
+    def new_filtered_cpurf_parser(self, cpurfs, ln=0, cpurf_id=0):
+        parser = self.new_cpurf_parser(cpurfs, ln=ln, cpurf_id=cpurf_id)
+        if self.filter is not None:
+            parser = FilteredCpurfParser(parser, self.filter)
+        return parser
+
+    @abc.abstractmethod
+    def new_cpurf_parser(self, cpurfs, ln=0, cpurf_id=0):
+        """Create the line-fed cpurf state machine of this arch."""
+        pass
+
+    def load_cpurf(self):
+        """
+        Load cpu register files from the tracefile.
+
+        If mode='generator', this function become a generator.
+        In this mode, you can use get_cpurf() directly to load cpurf implicitly.
+
+        If mode='plain', this function will process the whole tracefile without any stop.
+        In this mode, this function has to be called before get_cpurf().
+
+        If mode='stream', this function becomes a generator of every cpurf,
+        see CpurfWindow.
+        """
+        if self.mode == 'generator':
+            return self.load_cpurf_generator()
+        if self.mode == 'stream':
+            return self.load_cpurf_stream()
+        with self.phase('load_cpurf'):
+            if not self.load_cache('cpurfs'):
+                if self.jobs > 1 and not self.is_compressed():
+                    self.load_parallel('cpurfs')
+                elif self.fast and not self.is_compressed():
+                    self.load_cpurf_fast()
+                else:
+                    for i in self.load_cpurf_generator():
+                        pass
+                self.save_cache('cpurfs')
+            self.build_exception_index()
+        if self.stats is not None:
+            self.stats.loaded(self, 'cpurfs')
+
+    def load_cpurf_generator(self):
+        cpurfs = self.new_cpurfs()
+        parser = self.instrument(self.new_filtered_cpurf_parser(cpurfs), 'cpurf')
+        with self.open_tracefile() as f:
+            for line in f:
+                cpurf = parser.feed(line)
+                if cpurf is not None and self.mode == 'generator':
+                    yield cpurf
+        self.seal_cpurfs(cpurfs)
+
+    def iter_cpurfs(self, in_asm_parser=None):
+        """
+        Yield every cpurf once it is complete and keep none of them.
+
+        If in_asm_parser is given, it is fed with the same lines.
+        """
+        with self.open_tracefile() as f:
+            yield from self.iter_cpurfs_from(f, in_asm_parser=in_asm_parser)
+
+    def iter_cpurfs_from(self, lines, ln=0, cpurf_id=0, in_asm_parser=None, filtered=True):
+        scratch = {}
+        if filtered:
+            parser = self.new_filtered_cpurf_parser(scratch, ln=ln, cpurf_id=cpurf_id)
+        else:
+            parser = self.new_cpurf_parser(scratch, ln=ln, cpurf_id=cpurf_id)
+        return self.iter_completed(lines, self.instrument(parser, 'cpurf'), scratch, in_asm_parser=in_asm_parser)
+
+    def iter_completed(self, lines, parser, scratch, in_asm_parser=None):
+        """Feed parser, whose cpurfs go into scratch, and yield every cpurf once it is complete."""
+        for line in lines:
+            if in_asm_parser is not None:
+                in_asm_parser.feed(line)
+            parser.feed(line)
+            # the parser only touches the cpurf of parser.cpurf_id
+            while scratch and next(iter(scratch)) < parser.cpurf_id:
+                yield scratch.pop(next(iter(scratch)))
+        yield from scratch.values()
+
+    def load_cpurf_stream(self, in_asm_parser=None):
+        window = CpurfWindow(self.window)
+        self.cpurfs = window
+        current = 0
+        for cpurf in self.iter_cpurfs(in_asm_parser=in_asm_parser):
+            window.append(cpurf)
+            if cpurf['id'] - current >= self.window:
+                yield window[current]
+                current += 1
+        window.done = True
+        while current in window:
+            yield window[current]
+            current += 1
+
+    def map_tracefile(self):
+        """Map the tracefile into memory as bytes, None if it is empty."""
+        with open(self.tracefile, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def load_cpurf_fast(self):
+        """
+        Load cpu register files from an mmap of the tracefile.
+
+        The bytes from one cpurf_prefix line to the next are matched against
+        fast_cpurf_pattern, and only the register values are decoded, or even
+        parsed straight into a CpurfStore. Any other layout, e.g. a cpurf
+        with an exception, goes through the state machine instead.
+        """
+        cpurfs = self.new_cpurfs()
+        m = self.map_tracefile()
+        if m is None:
+            self.seal_cpurfs(cpurfs)
+            return
+        columnar = self.storage != 'dict'
+        prefix = re.compile(rb'^' + re.escape(self.cpurf_prefix.encode()), re.M)
+        separator = b'----------------\n'
+        with m:
+            ln, start, cpurf_id = 1, None, 0
+            ends = itertools.chain((match.start() for match in prefix.finditer(m)), [len(m)])
+            for end in ends:
+                if start is not None and self.filter is not None and not self.filter.match_ln(ln):
+                    # skipped before it is even matched
+                    cpurf_id += 1
+                elif start is not None:
+                    match = self.fast_cpurf_pattern.match(m, start, end)
+                    if match is not None and (match.end() == end or
+                                              m[match.end():match.end() + len(separator)] == separator):
+                        rfs, mode = self.fast_cpurf(match)
+                        if self.filter is not None and not (
+                                self.filter.match_pc(rfs[self.pc_register].decode()) and
+                                self.filter.match_mode(mode)):
+                            pass
+                        elif columnar and cpurfs.fits(rfs):
+                            cpurfs.append_row(ln, rfs, mode)
+                        else:
+                            cpurfs[cpurf_id] = {
+                                'id': cpurf_id, 'ln': ln,
+                                'register_files': {name: value.decode() for name, value in rfs.items()},
+                                'mode': mode}
+                    else:
+                        lines = io.StringIO(m[start:end].decode(), newline=None)
+                        for cpurf in self.iter_cpurfs_from(lines, ln=ln - 1, cpurf_id=cpurf_id):
+                            cpurfs[cpurf_id] = cpurf
+                    cpurf_id += 1
+                ln += m[start or 0:end].count(b'\n')
+                start = end
+        self.seal_cpurfs(cpurfs)
+
+    @abc.abstractmethod
+    def fast_cpurf(self, match):
+        """Get the register files (name to bytes value) and the mode of a fast_cpurf_pattern match."""
+        pass
+
+    def load_in_asm_fast(self):
+        """
+        Load basic blocks from an mmap of the tracefile.
+
+        Like InAsmParser, a basic block starts two lines after a line
+        starting with --- and ends before the first blank line.
+        """
+        parser = self.new_in_asm_parser()
+        self.bbs = parser.bbs
+        self.bb_index = parser.index
+        m = self.map_tracefile()
+        if m is None:
+            return self.bbs
+        separator = re.compile(rb'^---', re.M)
+        blank = re.compile(rb'^[ \t\r\f\v]*$', re.M)
+        with m:
+            ln, pos = 1, 0
+            while True:
+                match = separator.search(m, pos)
+                if match is None:
+                    break
+                # skip the separator and the IN: line
+                ln += m[pos:match.start()].count(b'\n') + 2
+                start = m.find(b'\n', m.find(b'\n', match.start()) + 1) + 1
+                if start == 0:
+                    break
+                match = blank.search(m, start)
+                end = len(m) if match is None else match.start()
+                if self.filter is not None and not self.filter.match_bb(
+                        m[start + 2:m.find(b':', start, end)].decode(), ln):
+                    # skipped before it is decoded
+                    if match is None:
+                        break
+                    ln += m[start:end].count(b'\n') + 1
+                    pos = m.find(b'\n', end) + 1
+                    if pos == 0:
+                        break
+                    continue
+                # one decode for the whole basic block
+                for i, line in enumerate(m[start:end].decode().splitlines()):
+                    things = line.split()
+                    if len(things) < 3:
+                        # disassembler disagrees
+                        opcode, operand = None, None
+                    else:
+                        opcode, operand = things[2], things[3:]
+                    instruction = {'ln': ln + i, 'address': things[0][2:-1], 'raw': things[1],
+                                   'opcode': opcode, 'operand': operand}
+                    if i == 0:
+                        parser.add_bb(instruction)
+                    else:
+                        parser.add_instruction(instruction)
+                if match is None:
+                    break
+                parser.complete_bb()
+                ln += m[start:end].count(b'\n') + 1
+                pos = m.find(b'\n', end) + 1
+                if pos == 0:
+                    break
+        return self.bbs
 
-class PQLI(object):
-    def __init__(self, endian, tracefile, mode='plain'):
+    def load_in_asm(self):
         """
-        PQL interfaces should be extended by any specific PQL classes.
+        Load basic blocks from the trace file.
         """
-        self.endian = endian
-        self.cpurfs = None
-        self.bbs = None
-        self.tracefile = tracefile
-        self.mode = mode
+        with self.phase('load_in_asm'):
+            if not self.load_cache('bbs'):
+                if self.jobs > 1 and not self.is_compressed():
+                    self.load_parallel('bbs')
+                elif self.fast and not self.is_compressed():
+                    self.load_in_asm_fast()
+                else:
+                    parser = self.new_in_asm_parser()
+                    with self.open_tracefile() as f:
+                        for line in f:
+                            parser.feed(line)
+                    self.bbs = parser.bbs
+                    self.bb_index = parser.index
+                self.save_cache('bbs')
+        if self.stats is not None:
+            self.stats.loaded(self, 'bbs')
+        return self.bbs
 
-    def load_cpurf(self):
+    def load_all(self):
         """
-        Load cpu register files from the tracefile.
+        Load cpu register files and basic blocks in a single pass.
 
-        If mode='generator', this function become a generator.
-        In this mode, you can use get_cpurf() directly to load cpurf implicitly.
+        This is equivalent to load_cpurf() followed by load_in_asm(), but
+        the tracefile is read only once.
 
-        If mode='plain', this function will process the whole tracefile without any stop.
-        In this mode, this function has to be called before get_cpurf().
+        If mode='generator', this function become a generator of cpurfs,
+        and self.bbs grows while the cpurfs are yielded. A cpurf's basic
+        block is always translated before it, so get_bb() is usable on
+        every yielded cpurf.
+
+        If mode='stream', this function becomes a generator of every cpurf,
+        see CpurfWindow.
         """
         if self.mode == 'generator':
-            return self.load_cpurf_generator()
-        for i in self.load_cpurf_generator():
-            pass
+            return self.load_all_generator()
+        if self.mode == 'stream':
+            in_asm_parser = self.new_in_asm_parser()
+            self.bbs = in_asm_parser.bbs
+            self.bb_index = in_asm_parser.index
+            return self.load_cpurf_stream(in_asm_parser=in_asm_parser)
+        with self.phase('load_all'):
+            if not self.load_cache('cpurfs', 'bbs'):
+                if self.jobs > 1 and not self.is_compressed():
+                    self.load_parallel('cpurfs', 'bbs')
+                elif self.fast and not self.is_compressed():
+                    self.load_cpurf_fast()
+                    self.load_in_asm_fast()
+                else:
+                    for i in self.load_all_generator():
+                        pass
+                self.save_cache('cpurfs', 'bbs')
+            self.build_exception_index()
+        if self.stats is not None:
+            self.stats.loaded(self, 'cpurfs', 'bbs')
 
-    @abc.abstractmethod
-    def load_cpurf_generator():
-        pass
+    def load_all_generator(self):
+        cpurfs = self.new_cpurfs()
+        cpurf_parser = self.instrument(self.new_filtered_cpurf_parser(cpurfs), 'cpurf')
+        in_asm_parser = self.new_in_asm_parser()
+        self.bbs = in_asm_parser.bbs
+        self.bb_index = in_asm_parser.index
+        with self.open_tracefile() as f:
+            for line in f:
+                in_asm_parser.feed(line)
+                cpurf = cpurf_parser.feed(line)
+                if cpurf is not None and self.mode == 'generator':
+                    yield cpurf
+        self.seal_cpurfs(cpurfs)
 
-    def load_in_asm(self):
+    def is_compressed(self):
+        return os.path.splitext(self.tracefile)[1] in COMPRESSIONS
+
+    def open_tracefile(self):
+        """Open the tracefile for reading text, decompressing it if needed."""
+        ext = os.path.splitext(self.tracefile)[1]
+        if ext not in COMPRESSIONS:
+            return open(self.tracefile, buffering=BUFFER_SIZE)
+        if ext == '.zst':
+            if zstandard is None:
+                raise NotImplementedError('Unsupported {} without zstandard installed'.format(ext))
+            raw = zstandard.ZstdDecompressor().stream_reader(open(self.tracefile, 'rb'))
+        else:
+            raw = COMPRESSIONS[ext](self.tracefile, 'rb')
+        return io.TextIOWrapper(io.BufferedReader(raw, BUFFER_SIZE))
+
+    def split(self, n):
         """
-        Load basic blocks from the trace file.
+        Split the tracefile into at most n chunks of (start, end, ln).
 
-        ----------------                                1
-        IN:                                             2
-        0x00000000:  e3a00000  mov      r0, #0          3
-        0x00000004:  e59f1004  ldr      r1, [pc, #4]    4
-        0x00000008:  e59f2004  ldr      r2, [pc, #4]    4
-        0x0000000c:  e59ff004  ldr      pc, [pc, #4]    4
-                                                        4 (end)
+        A chunk starts at a ---------------- separator or at the first line
+        of a cpurf, where both state machines are idle, and ln is the number
+        of lines before it.
         """
-        ln = 0  # ln number
-        bbs = {}  # to be returned
-
-        def parse_in_asm(line):
-            things = line.strip().split()
-            address = things[0][2:-1]  # remove 0x and :
-            raw = things[1]
-            offset = ln + 1
-            if len(things) < 3:
-                # disassembler disagrees
-                return offset, address, raw, None, None
-            opcode = things[2]
-            operand = things[3:]
-            return offset, address, raw, opcode, operand
-
-        state = 0
-        with open(self.tracefile) as f:
+        size = os.path.getsize(self.tracefile)
+        prefixes = (b'----------------', self.cpurf_prefix.encode())
+        starts = [0]
+        with open(self.tracefile, 'rb') as f:
+            for i in range(1, n):
+                f.seek(max(size * i // n, starts[-1]))
+                f.readline()  # skip the partial line
+                while True:
+                    offset = f.tell()
+                    line = f.readline()
+                    if not line or line.startswith(prefixes):
+                        break
+                if offset >= size:
+                    break
+                if offset > starts[-1]:
+                    starts.append(offset)
+            chunks, ln = [], 0
+            for start, end in zip(starts, starts[1:] + [size]):
+                chunks.append((start, end, ln))
+                f.seek(start)
+                remaining = end - start
+                while remaining:
+                    block = f.read(min(remaining, 1 << 24))
+                    ln += block.count(b'\n')
+                    remaining -= len(block)
+        return chunks
+
+    def read_chunk(self, start, end):
+        """Yield the lines in bytes [start, end) of the tracefile."""
+        offset = start
+        with open(self.tracefile, 'rb') as f:
+            f.seek(start)
             for line in f:
-                if state == 0 and line.startswith('---'):
-                    state = 1
-                if state == 3:
-                    offset, address, raw, opcode, operand = parse_in_asm(line)
-                    bb_id = address
-                    new_bb = {'in': address, 'chained': False, 'instructions': [
-                        {'ln': offset, 'address': address, 'raw': raw, 'opcode': opcode, 'operand': operand}]}
-                    if bb_id in bbs:
-                        chained_bb = bbs[bb_id]
-                        while chained_bb['chained'] and 'next' in chained_bb:
-                            chained_bb = chained_bb['next']
-                        chained_bb['chained'] = True
-                        chained_bb['next'] = new_bb
+                if offset >= end:
+                    break
+                offset += len(line)
+                yield line.decode()
+
+    def parse_chunk(self, start, end, ln, sections):
+        """Parse bytes [start, end) of the tracefile, starting at line ln."""
+        cpurfs = self.new_cpurfs()
+        cpurf_parser = self.new_filtered_cpurf_parser(cpurfs, ln=ln)
+        in_asm_parser = self.new_in_asm_parser(ln=ln)
+        parsers = []
+        if 'cpurfs' in sections:
+            parsers.append(cpurf_parser)
+        if 'bbs' in sections:
+            parsers.append(in_asm_parser)
+        for line in self.read_chunk(start, end):
+            for parser in parsers:
+                parser.feed(line)
+        self.seal_cpurfs(cpurfs)
+        self.bb_index = in_asm_parser.index
+        # cpurfs may have gaps with a filter
+        records = cpurf_parser.records if self.filter is not None else len(cpurfs)
+        return cpurfs, records, self.pack_bbs()
+
+    def load_parallel(self, *sections):
+        """Load the sections (cpurfs and/or bbs) with a pool of self.jobs processes."""
+        # a fresh instance, so that nothing loaded is shipped to the workers
+        worker = type(self)(self.endian, self.tracefile, storage=self.storage, keyframe=self.keyframe,
+                            intern=self.intern, filter=self.filter)
+        chunks = self.split(self.jobs)
+        cpurfs = self.new_cpurfs()
+        if 'bbs' in sections:
+            self.bbs, self.bb_index = {}, {}
+        with ProcessPoolExecutor(max_workers=min(self.jobs, len(chunks))) as executor:
+            futures = [executor.submit(worker.parse_chunk, start, end, ln, sections)
+                       for start, end, ln in chunks]
+            offset = 0
+            for future in futures:
+                chunk_cpurfs, records, chunk_bbs = future.result()
+                if 'cpurfs' in sections:
+                    if self.storage != 'dict':
+                        cpurfs.extend(chunk_cpurfs)
+                    else:
+                        for cpurf in chunk_cpurfs.values():
+                            cpurf['id'] += offset
+                            cpurfs[cpurf['id']] = cpurf
+                    offset += records
+                if 'bbs' in sections:
+                    self.merge_bbs(chunk_bbs)
+        if 'cpurfs' in sections:
+            self.cpurfs = cpurfs
+
+    def build_seek_index(self):
+        """
+        Pre-scan the tracefile for the byte offset and the ln of every cpurf
+        and every basic block, for get_cpurf_at() and get_bb_at().
+        """
+        if self.seek_index is not None or self.load_cache('seek_index'):
+            return self.seek_index
+        if self.is_compressed():
+            raise NotImplementedError('Unsupported seek in compressed {}'.format(self.tracefile))
+        seek_index = SeekIndex()
+        pattern = re.compile(rb'^(?:' + re.escape(self.cpurf_prefix.encode()) + rb'|(-{16}\nIN:))', re.M)
+        with open(self.tracefile, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self.seek_index = seek_index
+                return seek_index
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                ln, last = 1, 0
+                for match in pattern.finditer(m):
+                    offset = match.start()
+                    ln += m[last:offset].count(b'\n')
+                    last = offset
+                    if match.group(1):
+                        seek_index.bb_offsets.append(offset)
+                        seek_index.bb_lns.append(ln)
                     else:
-                        new_bb['chained'] = False
-                        bbs[bb_id] = new_bb
-                if state == 4 and len(line.strip()):
-                    offset, address, raw, opcode, operand = parse_in_asm(line)
-                    new_bb['instructions'].append(
-                        {'ln': offset, 'address': address, 'raw': raw, 'opcode': opcode, 'operand': operand})
-                if state in [1, 2, 3]:
-                    state += 1
-                if state == 4 and not len(line.strip()):
-                    new_bb['size'] = len(new_bb['instructions'])
-                    state = 0
-                ln += 1
-        self.bbs = bbs
-        return bbs
+                        seek_index.cpurf_offsets.append(offset)
+                        seek_index.cpurf_lns.append(ln)
+        self.seek_index = seek_index
+        self.save_cache('seek_index')
+        return seek_index
+
+    def read_at(self, offset):
+        f = io.TextIOWrapper(open(self.tracefile, 'rb', buffering=BUFFER_SIZE))
+        f.buffer.seek(offset)
+        return f
+
+    def get_cpurf_at(self, i):
+        """Parse only the i-th cpurf, see build_seek_index()."""
+        seek_index = self.build_seek_index()
+        if not 0 <= i < len(seek_index.cpurf_offsets):
+            raise IndexError('cpurf {} is out of the trace'.format(i))
+        with self.read_at(seek_index.cpurf_offsets[i]) as f:
+            for cpurf in self.iter_cpurfs_from(f, ln=seek_index.cpurf_lns[i] - 1, cpurf_id=i, filtered=False):
+                return cpurf
+
+    def get_bb_at(self, ln):
+        """Parse only the basic block translated at or right before the line ln."""
+        seek_index = self.build_seek_index()
+        i = bisect.bisect_right(seek_index.bb_lns, ln) - 1
+        if i < 0:
+            raise IndexError('no basic block before line {}'.format(ln))
+        parser = self.new_in_asm_parser(ln=seek_index.bb_lns[i] - 1)
+        with self.read_at(seek_index.bb_offsets[i]) as f:
+            for line in f:
+                bb = parser.feed(line)
+                if bb is not None:
+                    return bb
+        # the tracefile ends in the middle of the basic block
+        return parser.bb
+
+    def follow(self, interval=0.5, idle_timeout=None):
+        """
+        Yield ('bb', bb) and ('cpurf', cpurf) as they are appended to the
+        tracefile by a running QEMU, checking every interval seconds.
+
+        A cpurf is yielded once the next one starts, and a basic block once
+        its blank line is written. What is already written is read
+        BUFFER_SIZE bytes at a time. It stops after idle_timeout seconds
+        without new data, or never if idle_timeout is None, yielding the
+        last cpurf then. self.bbs grows meanwhile, so get_bb() works on the
+        yielded cpurfs.
+        """
+        follower = TraceFollower(self)
+        try:
+            idle = 0
+            while idle_timeout is None or idle < idle_timeout:
+                found = follower.poll()
+                if found is not None:
+                    idle = 0
+                    yield from found
+                else:
+                    time.sleep(interval)
+                    idle += interval
+            yield from follower.flush()
+        finally:
+            follower.close()
+
+    async def afollow(self, interval=0.5, idle_timeout=None):
+        """The asyncio variant of follow()."""
+        follower = TraceFollower(self)
+        try:
+            idle = 0
+            while idle_timeout is None or idle < idle_timeout:
+                found = follower.poll()
+                if found is not None:
+                    idle = 0
+                    for item in found:
+                        yield item
+                    # let the other tasks run between chunks
+                    await asyncio.sleep(0)
+                else:
+                    await asyncio.sleep(interval)
+                    idle += interval
+            for item in follower.flush():
+                yield item
+        finally:
+            follower.close()
+
+    def registers(self, name):
+        """
+        Get the values of the register in every loaded cpurf as a NumPy
+        array, indexed like where() masks, see RegisterTable.
+        """
+        if self.mode != 'plain':
+            raise NotImplementedError('Unsupported register queries in {} mode'.format(self.mode))
+        if self.register_table is None or self.register_table.cpurfs is not self.cpurfs:
+            self.register_table = RegisterTable(self.cpurfs, self.register_schema, self.wide_register_schema)
+        return self.register_table.column(name)
+
+    def where(self, mask):
+        """
+        Get the ids of the cpurfs selected by a boolean mask over registers(),
+        e.g. pql.where(pql.registers('R13') < 0x8000).
+        """
+        return self.register_table.ids[mask]
+
+    def pc_histogram(self):
+        """Get the distinct pcs and how many cpurfs have each, as two arrays."""
+        return import_numpy().unique(self.registers(self.pc_register), return_counts=True)
+
+    def register_deltas(self, name):
+        """
+        Get how the register changes between consecutive cpurfs, as signed
+        integers. The i-th delta is from the i-th cpurf to the next one.
+        """
+        numpy = import_numpy()
+        column = self.registers(name)
+        if column.dtype == numpy.uint64:
+            # wraps around like the register does
+            return numpy.diff(column.view(numpy.int64))
+        return numpy.diff(column.astype(numpy.int64))
+
+    def iter_executed_cpurfs(self):
+        if self.mode == 'generator':
+            # load_all() and get_cpurf() do not yield the last cpurf here
+            if self.bb_index is not None:
+                return self.iter_cpurfs()
+            in_asm_parser = self.new_in_asm_parser()
+            self.bbs = in_asm_parser.bbs
+            self.bb_index = in_asm_parser.index
+            return self.iter_cpurfs(in_asm_parser=in_asm_parser)
+        if self.bb_index is None and self.mode == 'stream':
+            # basic blocks and cpurfs in a single pass
+            return self.load_all()
+        if self.mode == 'plain':
+            # load what is not loaded yet
+            if self.cpurfs is None:
+                self.load_cpurf()
+            if self.bb_index is None:
+                self.load_in_asm()
+        return (cpurf for _, cpurf in self.get_cpurf())
+
+    def flatten(self, coverage=None):
+        """
+        Yield (cpurf id, bb, instruction) for every executed instruction,
+        taking the basic block of every cpurf (see get_bb()) as run to its
+        end. Cpurfs at a pc that was never translated are skipped.
+
+        If coverage (a Coverage) is given, it counts every cpurf on the way.
+        Nothing is kept but the loaded structures, and in mode='stream' or
+        'generator' the tracefile is read once, loading basic blocks too.
+        """
+        for cpurf in self.iter_executed_cpurfs():
+            pc = self.get_pc(cpurf)
+            if pc not in self.bb_index:
+                continue
+            bb = self.get_bb(cpurf)
+            if coverage is not None:
+                coverage.hit(pc, bb)
+            for instruction in bb['instructions']:
+                yield cpurf['id'], bb, instruction
+
+    def transitions(self, call_stack=None):
+        """
+        Yield (cpurf, kind) for every cpurf and the kind of the transition
+        to it, see CallStack. If call_stack is not given, a new one is used.
+        In mode='stream' or 'generator' the tracefile is read once.
+        """
+        if call_stack is None:
+            call_stack = CallStack(self)
+        for cpurf in self.iter_executed_cpurfs():
+            yield cpurf, call_stack.feed(cpurf)
+
+    def call_stack(self, max_depth=1024):
+        """Get the CallStack of the whole trace, for its call tree and call graph."""
+        call_stack = CallStack(self, max_depth=max_depth)
+        for cpurf in self.iter_executed_cpurfs():
+            call_stack.feed(cpurf)
+        return call_stack
+
+    def diff(self, other, registers=None, run=256, window=256, anchor=4):
+        """
+        Get the TraceDiff of this trace against other, to be iterated, e.g.
+        next(iter(pql.diff(other))) for the first difference.
+        """
+        return TraceDiff(self, other, registers=registers, run=run, window=window, anchor=anchor)
+
+    def coverage(self):
+        """
+        Get the Coverage of the whole trace, counted like flatten() does,
+        with the instructions that are translated but never executed.
+        """
+        coverage = Coverage()
+        for cpurf in self.iter_executed_cpurfs():
+            pc = self.get_pc(cpurf)
+            if pc in self.bb_index:
+                coverage.hit(pc, self.get_bb(cpurf))
+        for _, chain in self.bb_index.values():
+            for bb in chain:
+                coverage.translate(bb)
+        return coverage
+
+    def export_cpurfs(self, path, format=None, batch_size=65536):
+        """
+        Export every cpurf to a columnar file (.npz, .parquet or .arrow).
+
+        Columns are id, ln, mode, exception (as JSON), one uint32 column per
+        register of register_schema (uint64 for wide_register_schema), and
+        extras (as JSON) for the other registers. The tracefile is streamed
+        and written in batches of batch_size cpurfs.
+        """
+        columns = self.register_schema + self.wide_register_schema
+        widths = dict([(name, 8) for name in self.register_schema] +
+                      [(name, 16) for name in self.wide_register_schema])
+        schema = [('id', 'u8'), ('ln', 'u8'), ('mode', 'str'), ('exception', 'str')] + \
+                 [(name, 'u4') for name in self.register_schema] + \
+                 [(name, 'u8') for name in self.wide_register_schema] + [('extras', 'str')]
+        exporter = get_exporter(path, schema, format=format)
+        batch = {name: [] for name, _ in schema}
+        for cpurf in self.iter_cpurfs():
+            batch['id'].append(cpurf['id'])
+            batch['ln'].append(cpurf['ln'])
+            batch['mode'].append(cpurf.get('mode'))
+            batch['exception'].append(json.dumps(cpurf['exception']) if 'exception' in cpurf else None)
+            rfs = cpurf['register_files']
+            for name in columns:
+                value = rfs.get(name, '')
+                batch[name].append(int(value, 16) if len(value) == widths[name] else 0)
+            extras = {name: value for name, value in rfs.items()
+                      if len(value) != widths.get(name)}
+            batch['extras'].append(json.dumps(extras) if extras else None)
+            if len(batch['id']) == batch_size:
+                exporter.write_batch(batch)
+                batch = {name: [] for name, _ in schema}
+        exporter.write_batch(batch)
+        exporter.close()
+
+    def export_instructions(self, path, format=None, batch_size=65536):
+        """
+        Export every translated instruction to a columnar file (.npz,
+        .parquet or .arrow), with the columns bb, ln, address, raw, opcode
+        and operand. The tracefile is streamed and written in batches of
+        batch_size instructions.
+        """
+        schema = [('bb', 'str'), ('ln', 'u8'), ('address', 'str'), ('raw', 'str'),
+                  ('opcode', 'str'), ('operand', 'strs')]
+        exporter = get_exporter(path, schema, format=format)
+        batch = {name: [] for name, _ in schema}
+        parser = InAsmParser(retain=False)
+        with self.open_tracefile() as f:
+            for line in f:
+                bb = parser.feed(line)
+                if bb is None:
+                    continue
+                for instruction in bb['instructions']:
+                    batch['bb'].append(bb['in'])
+                    for name in ['ln', 'address', 'raw', 'opcode', 'operand']:
+                        batch[name].append(instruction[name])
+                if len(batch['bb']) >= batch_size:
+                    exporter.write_batch(batch)
+                    batch = {name: [] for name, _ in schema}
+        if parser.state == 4:
+            # the tracefile ends in the middle of a basic block
+            for instruction in parser.bb['instructions']:
+                batch['bb'].append(parser.bb['in'])
+                for name in ['ln', 'address', 'raw', 'opcode', 'operand']:
+                    batch[name].append(instruction[name])
+        exporter.write_batch(batch)
+        exporter.close()
+
+    def encode_cpurf(self, cpurf):
+        """Get the JSON of cpurf without its id and braces."""
+        return json.dumps({key: value for key, value in cpurf.items() if key != 'id'})[1:-1]
+
+    def jsonl_line(self, cpurf_id, body, bb):
+        return '{{"id": {}, {}, "bb": {}}}'.format(cpurf_id, body, bb)
+
+    def encode_bb(self, bb, encoded):
+        """Get the JSON of bb, reusing the one in encoded if bb is the same translation."""
+        if bb is None:
+            return 'null'
+        cached = encoded.get(bb['in'])
+        if cached is None or cached[0] is not bb:
+            # next and chained link the translations of an address, not part of the block
+            cached = encoded[bb['in']] = (bb, json.dumps({key: value for key, value in bb.items()
+                                                          if key not in ('next', 'chained')}))
+        return cached[1]
+
+    def iter_jsonl(self):
+        """
+        Yield a JSON line (without the newline) for every cpurf, that is the
+        cpurf with its basic block as 'bb', null if the pc was not translated
+        before it.
+
+        Only the latest translation of every pc is kept, so memory does not
+        grow with the tracefile. If jobs is more than 1, chunks of the
+        tracefile are converted in a process pool, a few at a time.
+        """
+        if self.jobs > 1 and not self.is_compressed():
+            yield from self.iter_jsonl_parallel()
+            return
+        parser = InAsmParser(retain=False, filter=self.filter)
+        encoded = {}
+        for cpurf in self.iter_cpurfs(in_asm_parser=parser):
+            pc = self.get_pc(cpurf)
+            yield self.jsonl_line(cpurf['id'], self.encode_cpurf(cpurf), self.encode_bb(parser.bbs.get(pc), encoded))
+
+    def jsonl_chunk(self, start, end, ln):
+        """
+        Convert bytes [start, end) of the tracefile, see iter_jsonl(). Get
+        the number of cpurfs, (id, pc, cpurf, bb) in the chunk where bb is
+        None if the pc was not translated in the chunk, and the JSON of the
+        latest translation of every pc in the chunk.
+        """
+        parser = InAsmParser(ln=ln, retain=False, filter=self.filter)
+        encoded = {}
+        records = []
+        scratch = {}
+        cpurf_parser = self.new_filtered_cpurf_parser(scratch, ln=ln)
+        for cpurf in self.iter_completed(self.read_chunk(start, end), cpurf_parser, scratch, in_asm_parser=parser):
+            pc = self.get_pc(cpurf)
+            bb = parser.bbs.get(pc)
+            records.append((cpurf['id'], pc, self.encode_cpurf(cpurf), None if bb is None else self.encode_bb(bb, encoded)))
+        # skipped cpurfs take ids too
+        n = cpurf_parser.records if self.filter is not None else len(records)
+        return n, records, {pc: self.encode_bb(bb, encoded) for pc, bb in parser.bbs.items()}
+
+    def iter_jsonl_parallel(self):
+        size = os.path.getsize(self.tracefile)
+        chunks = self.split(max(self.jobs, size // JSONL_CHUNK_SIZE))
+        worker = type(self)(self.endian, self.tracefile, filter=self.filter)
+        latest, offset = {}, 0
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            pending = deque()
+            for chunk in chunks + [None]:
+                if chunk is not None:
+                    pending.append(executor.submit(worker.jsonl_chunk, *chunk))
+                    if len(pending) <= 2 * self.jobs:
+                        continue
+                while pending and (chunk is None or len(pending) > 2 * self.jobs):
+                    n, records, bbs = pending.popleft().result()
+                    for cpurf_id, pc, body, bb in records:
+                        yield self.jsonl_line(cpurf_id + offset, body, latest.get(pc, 'null') if bb is None else bb)
+                    latest.update(bbs)
+                    offset += n
+
+    def cache_key(self):
+        """Get what the cached sections depend on, as JSON."""
+        st = os.stat(self.tracefile)
+        f = self.filter
+        if f is not None:
+            f = [f.pcs, f.lns, None if f.modes is None else sorted(f.modes)]
+        return json.dumps([os.path.abspath(self.tracefile), st.st_size, st.st_mtime_ns,
+                           CACHE_VERSION, sys.byteorder, type(self).__name__, self.endian, self.storage,
+                           self.keyframe, self.intern, f])
+
+    def read_cache_index(self, f):
+        """
+        Get the {section: entry} of an open cache file, see
+        write_cache_parts(), None if it is stale or broken.
+        """
+        try:
+            f.seek(-16, os.SEEK_END)
+            trailer = f.read(16)
+            if trailer[8:] != CACHE_MAGIC:
+                return None
+            length = int.from_bytes(trailer[:8], 'little')
+            f.seek(-16 - length, os.SEEK_END)
+            index = json.loads(f.read(length))
+        except (OSError, ValueError):
+            return None
+        if index['key'] != self.cache_key():
+            return None
+        return index['sections']
+
+    def load_cache(self, *sections):
+        """Load the sections (cpurfs, bbs, seek_index) from the cache if all are there."""
+        if not self.cache:
+            return False
+        loaded = {}
+        try:
+            with open(self.tracefile + '.pqlcache', 'rb') as f:
+                index = self.read_cache_index(f)
+                if index is None or not all(section in index for section in sections):
+                    return False
+                for section in sections:
+                    loaded[section] = self.read_cache_section(f, index[section])
+        except Exception:
+            # missing or broken, parse the tracefile again
+            return False
+        if 'cpurfs' in sections:
+            state, arrays = loaded['cpurfs']
+            if self.storage == 'dict':
+                self.cpurfs = state
+            else:
+                self.cpurfs = self.new_cpurfs()
+                self.cpurfs.set_state(state, arrays)
+        if 'bbs' in sections:
+            self.decode_bbs(loaded['bbs'][0])
+        if 'seek_index' in sections:
+            self.seek_index = SeekIndex()
+            for name, values in loaded['seek_index'][1].items():
+                setattr(self.seek_index, name, values)
+        return True
+
+    def read_cache_section(self, f, entry):
+        """
+        Read a section of an open cache file as (JSON state, {name: array}).
+        Only dict cpurfs are pickled, and only unpickled with cache='pickle'.
+        """
+        if 'pickle' in entry:
+            if self.cache != 'pickle':
+                raise ValueError('pickled section without cache=pickle')
+            offset, length = entry['pickle']
+            f.seek(offset)
+            return pickle.loads(f.read(length)), {}
+        state = None
+        if 'json' in entry:
+            offset, length = entry['json']
+            f.seek(offset)
+            state = json.loads(f.read(length))
+        arrays = {}
+        for name, (offset, length, typecode, itemsize) in entry.get('arrays', {}).items():
+            values = array(typecode)
+            if values.itemsize != itemsize:
+                raise ValueError('{} of {} bytes'.format(typecode, itemsize))
+            f.seek(offset)
+            values.fromfile(f, length // itemsize)
+            arrays[name] = values
+        return state, arrays
+
+    def read_cache_parts(self, f, entry):
+        """Read the parts of a section of an open cache file as they are, see write_cache_parts()."""
+        parts = []
+        for kind, value in entry.items():
+            for name, (offset, length, *extra) in value.items() if kind == 'arrays' else [(None, value)]:
+                f.seek(offset)
+                parts.append((kind, name, f.read(length), extra))
+        return parts
+
+    def write_cache_parts(self, out, parts):
+        """Write the (kind, name, data, extra) parts of a section and get its index entry."""
+        entry = {}
+        for kind, name, data, extra in parts:
+            # aligned, so that the arrays can be mapped
+            out.write(bytes(-out.tell() % 8))
+            length = memoryview(data).nbytes
+            if kind == 'arrays':
+                entry.setdefault('arrays', {})[name] = [out.tell(), length] + extra
+            else:
+                entry[kind] = [out.tell(), length]
+            out.write(data)
+        return entry
+
+    def save_cache(self, *sections):
+        """
+        Save the sections to the cache. Every section is written as raw
+        arrays (registers, lns, offsets...) and JSON (the rest), then comes
+        the index of the sections as JSON with the cache_key(), its length
+        in 8 bytes and CACHE_MAGIC. The other sections of a cache with the
+        same key are copied as bytes.
+
+        Dict cpurfs are only saved with cache='pickle', pickled.
+        """
+        if not self.cache:
+            return
+        parts = {}
+        if 'cpurfs' in sections and self.storage != 'dict':
+            store = self.cpurfs
+            parts['cpurfs'] = [('json', None, json.dumps(store.get_state()).encode(), [])] + \
+                [('arrays', name, getattr(store, name), [getattr(store, name).typecode, getattr(store, name).itemsize])
+                 for name in store.array_names]
+        elif 'cpurfs' in sections and self.cache == 'pickle':
+            parts['cpurfs'] = [('pickle', None, pickle.dumps(self.cpurfs, protocol=pickle.HIGHEST_PROTOCOL), [])]
+        if 'bbs' in sections:
+            parts['bbs'] = [('json', None, json.dumps(self.encode_bbs()).encode(), [])]
+        if 'seek_index' in sections:
+            seek_index = self.seek_index
+            parts['seek_index'] = [('arrays', name, getattr(seek_index, name),
+                                    [getattr(seek_index, name).typecode, getattr(seek_index, name).itemsize])
+                                   for name in seek_index.array_names]
+        path = self.tracefile + '.pqlcache'
+        try:
+            with open(path + '.tmp', 'wb') as out:
+                index = {}
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        for section, entry in (self.read_cache_index(f) or {}).items():
+                            if section not in parts:
+                                index[section] = self.write_cache_parts(out, self.read_cache_parts(f, entry))
+                for section, section_parts in parts.items():
+                    index[section] = self.write_cache_parts(out, section_parts)
+                header = json.dumps({'key': self.cache_key(), 'sections': index}).encode()
+                out.write(header)
+                out.write(len(header).to_bytes(8, 'little'))
+                out.write(CACHE_MAGIC)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            # the cache is optional, e.g. the directory is read-only
+            pass
+
+    def pack_bbs(self):
+        # drop the next links, a long chain is too deep to pickle
+        return {address: (lns, [{k: v for k, v in bb.items() if k != 'next'} for bb in chain])
+                for address, (lns, chain) in self.bb_index.items()}
+
+    def encode_bbs(self):
+        """
+        Get the basic blocks as JSON: every distinct instruction body once,
+        and every basic block as its first ln, whether it is chained and
+        complete, and the bodies of its instructions, which are on
+        consecutive lines.
+        """
+        bodies, ids, encoded = [], {}, {}
+        for address, (lns, chain) in self.bb_index.items():
+            blocks = []
+            for bb in chain:
+                refs = []
+                for instruction in bb['instructions']:
+                    operand = instruction['operand']
+                    body = (instruction['address'], instruction['raw'], instruction['opcode'],
+                            None if operand is None else tuple(operand))
+                    ref = ids.get(body)
+                    if ref is None:
+                        ref = ids[body] = len(bodies)
+                        bodies.append(body)
+                    refs.append(ref)
+                blocks.append([bb['instructions'][0]['ln'], bb['chained'], 'size' in bb, refs])
+            encoded[address] = [lns, blocks]
+        return {'bodies': bodies, 'bbs': encoded}
+
+    def decode_bbs(self, encoded):
+        """Set self.bbs and self.bb_index from encode_bbs()."""
+        # interns like the parser does
+        parser = InAsmParser(intern=self.intern)
+        bodies = encoded['bodies']
+        packed = {}
+        for address, (lns, blocks) in encoded['bbs'].items():
+            chain = []
+            for ln, chained, complete, refs in blocks:
+                instructions = [{'ln': ln + i, 'address': body[0], 'raw': body[1], 'opcode': body[2], 'operand': body[3]}
+                                for i, body in enumerate(bodies[ref] for ref in refs)]
+                bb = {'in': address, 'chained': chained, 'instructions': instructions}
+                if complete:
+                    bb['size'] = len(instructions)
+                    if self.intern:
+                        bb['instructions'] = parser.intern_instructions(instructions)
+                chain.append(bb)
+            packed[address] = (lns, chain)
+        self.bbs, self.bb_index = {}, {}
+        self.merge_bbs(packed)
+
+    def merge_bbs(self, packed):
+        """Chain packed bbs after the ones in self.bbs."""
+        for address, (lns, chain) in packed.items():
+            for bb, next_bb in zip(chain, chain[1:]):
+                bb['next'] = next_bb
+            if address in self.bb_index:
+                tail = self.bb_index[address][1][-1]
+                tail['chained'] = True
+                tail['next'] = chain[0]
+                self.bb_index[address][0].extend(lns)
+                self.bb_index[address][1].extend(chain)
+            else:
+                self.bbs[address] = chain[0]
+                self.bb_index[address] = [list(lns), list(chain)]
 
     @abc.abstractmethod
     def get_ra(self, cpurf):
@@ -110,25 +2898,28 @@ class PQLI(object):
         """Get pc in the cpurf."""
         pass
 
+    def get_instruction_size(self, instruction):
+        """Get the size in bytes of the instruction."""
+        return len(instruction['raw']) // 2
+
     def get_bb(self, cpurf):
-        """Get the basic block associated to the cpurf."""
-        bb_id = self.get_pc(cpurf)
-        target_bb = self.bbs[bb_id]
-        max_ln = cpurf['ln']
-        while target_bb['instructions'][-1]['ln'] < max_ln:
-            if not target_bb['chained']:
-                break
-            next_bb = target_bb['next']
-            if next_bb['instructions'][-1]['ln'] > max_ln:
-                break
-            else:
-                target_bb = next_bb
-        return target_bb
+        """
+        Get the basic block associated to the cpurf.
+
+        This is the latest translation of the pc that ends before the cpurf,
+        or the first translation if there is none.
+        """
+        lns, chain = self.bb_index[self.get_pc(cpurf)]
+        i = bisect.bisect_right(lns, cpurf['ln']) - 1
+        return chain[max(i, 0)]
 
     def get_cpurf(self):
         if self.mode == 'generator':
             for index, cpurf in enumerate(self.load_cpurf()):
                 yield index, cpurf
+        elif self.mode == 'stream':
+            for cpurf in self.load_cpurf():
+                yield cpurf['id'], cpurf
         else:
             for index, cpurf in self.cpurfs.items():
                 yield index, cpurf
@@ -137,6 +2928,8 @@ class PQLI(object):
         if self.mode == 'generator':
             raise ValueError(
                 'cannot support get_next_cpurf in the generator mode')
+        if self.mode == 'stream':
+            return self.cpurfs.lookup(cpurf['id'] + 1)
         try:
             return self.cpurfs[cpurf['id'] + 1]
         except KeyError:
@@ -149,6 +2942,8 @@ class PQLI(object):
         if self.mode == 'generator':
             raise ValueError(
                 'cannot support get_last_cpurf in the generator mode')
+        if self.mode == 'stream':
+            return self.cpurfs.lookup(cpurf['id'] - 1)
         try:
             return self.cpurfs[cpurf['id'] - 1]
         except KeyError:
@@ -157,7 +2952,55 @@ class PQLI(object):
     def get_last_bb(self, cpurf):
         return self.get_bb(self.get_last_cpurf(cpurf))
 
+    def changed_registers(self, cpurf):
+        """
+        Get the registers (name to value) of the cpurf that are new or differ
+        from the previous cpurf, all of them for the first one. With
+        storage='delta', they are read from the stored changes.
+        """
+        rfs = cpurf['register_files']
+        if self.mode == 'plain' and isinstance(self.cpurfs, DeltaCpurfStore):
+            names = self.cpurfs.changed(cpurf['id'])
+            if names is not None:
+                return {name: rfs[name] for name in names}
+        last = self.get_last_cpurf(cpurf)
+        if last is None:
+            return dict(rfs)
+        last = last['register_files']
+        return {name: value for name, value in rfs.items() if last.get(name) != value}
+
+    def build_exception_index(self):
+        """Index the exceptions of the loaded cpurfs, see ExceptionIndex."""
+        if isinstance(self.cpurfs, CpurfStore):
+            # only the sparse exceptions, not every cpurf
+            exceptions = sorted(self.cpurfs.exceptions.items())
+        else:
+            exceptions = ((cpurf['id'], cpurf['exception'])
+                          for cpurf in self.cpurfs.values() if 'exception' in cpurf)
+        self.exception_index = ExceptionIndex(exceptions)
+        return self.exception_index
+
+    def exceptions(self, type=None):
+        """Yield the cpurfs taking an exception, of the type if it is given."""
+        for cpurf_id in self.exception_index.entries_of(type):
+            yield self.cpurfs[cpurf_id]
+
+    def exception_span(self, cpurf):
+        """
+        Get (entry, ret) of the innermost exception the cpurf is in, or of the
+        exception it takes. ret is None if the exception does not return in
+        the trace, and the whole is None if the cpurf is in no exception.
+        """
+        span = self.exception_index.span(cpurf['id'])
+        if span is None:
+            return None
+        entry, ret = span
+        return self.cpurfs[entry], None if ret is None else self.cpurfs[ret]
+
     def get_exception_return_cpurf(self, cpurf):
+        if cpurf and self.exception_index is not None and self.mode == 'plain':
+            ret = self.exception_index.next_return(cpurf['id'])
+            return None if ret is None else self.cpurfs[ret]
         while cpurf:
             if 'exception' in cpurf and \
                     'ret' in cpurf['exception'] and cpurf['exception']['ret']:
@@ -168,10 +3011,21 @@ class PQLI(object):
     def get_exception_return_bb(self, cpurf):
         return self.get_bb(self.get_exception_return_cpurf(cpurf))
 
+    def get_exception_pc(self, cpurf):
+        """Get the pc an exception taken by the cpurf returns to, if it is logged."""
+        return None
+
 
 class PQL_AARCH32(PQLI):
-    def __init__(self, endian, tracefile, mode='plain'):
-        super().__init__(endian, tracefile, mode=mode)
+    register_schema = ['R{:02d}'.format(i) for i in range(16)] + ['PSR']
+    pc_register = 'R15'
+    cpurf_prefix = 'R00'
+    fast_cpurf_pattern = re.compile(
+        b''.join(b' '.join(b'R%02d=([0-9a-f]{8})' % (row + i) for i in range(4)) + b'\n' for row in range(0, 16, 4)) +
+        rb'PSR=([0-9a-f]{8}) +\S+ +\S+ +(?:\S+ +)?(\S+) *\n')
+
+    def __init__(self, endian, tracefile, mode='plain', **kwargs):
+        super().__init__(endian, tracefile, mode=mode, **kwargs)
         self.exception_names = [
             'unknown', 'ui', 'svc', 'pabt', 'dabt', 'irq',
             #   0       1      2       3       4      5
@@ -185,116 +3039,43 @@ class PQL_AARCH32(PQLI):
     def get_pc(self, cpurf):
         return cpurf['register_files']['R15']
 
-    def load_cpurf_generator(self):
-        """
-        R00=00000055 R01=000e11b0 R02=000f21c4 R03=00000661    1 <- 0
-        R04=00000055 R05=00000001 R06=0000b9b0 R07=000e1170    2
-        R08=000000a0 R09=00000000 R10=000e11b4 R11=000e2178    3
-        R12=000e217c R13=000e215c R14=00008e24 R15=00008d80    4
-        PSR=200001d3 --C- A svc32                              5
-        AArch32 mode switch from irq to abt PC 0xc000af4c      6 -> 2 or 0 or 6
-        Exception return from AArch32 abt to svc PC 0xc0020a00 6 -> 2 or 0 or 6
-        Taking exception 4 [Data Abort]                        6 -> 2 or 0 or 6
-        ...from EL1 to EL1                                     7
-        ...with ESR 0x25/0x9600003f                            8
-        ...with DFSR 0x8 DFAR 0xf1012014                       9 -> 0
-        Taking exception 5 [IRQ]                               6 -> 2 or 0 or 6
-        ...from EL1 to EL1                                     7
-        ...with ESR 0x0/0x0                                    8 -> 0
-        Taking exception 3 [Prefetch Abort]                    6 -> 2 or 0 or 6
-        ...from EL0 to EL1                                     7
-        ...with ESR 0x20/0x8200003f                            8
-        ...with IFSR 0x17 IFAR 0x400009b0                      9
-        Taking exception 1 [Undefined Instruction]             6 -> 2 or 0 or 6
-        ...from EL1 to EL1                                     7
-        ...with ESR 0x0/0x2000000                              8 -> 0
-        Taking exception 11 [Hypervisor Call]                  6 -> 2 or 0 or 6
-        ...from EL1 to EL2                                     7
-        ...with ESR 0x12/0x4a000000                            8 -> 0
-        """
-        ln = 0
-        cpurfs = {}
-
-        def parse_state(line):
-            # PSR=200001d3 --C- A svc32                              5
-            # PSR=400001d3 -Z-- A NS svc32
-            things = line.strip().split()
-            if len(things) == 4:
-                psr, flags, _, mode = things
-            elif len(things) == 5:
-                psr, flags, _, _, mode = things
-            psr_name, _, psr_value = psr.partition('=')
-            return psr_name, psr_value, flags, None, mode
-
-        def parse_rfs(line):
-            things = line.strip().split()
-            rfs = {}
-            for rf in things:
-                rf_name, _, rf_value = rf.partition('=')
-                rfs[rf_name] = rf_value
-            offset = ln + 1
-            return offset, rfs
-
-        cpurf_id = 0
-        state = 0
-        with open(self.tracefile) as f:
-            for line in f:
-                if state == 0 and line.startswith('R00'):
-                    state = 1
-                    offset, rfs = parse_rfs(line)
-                    cpurfs[cpurf_id] = {'id': cpurf_id, 'ln': offset, 'register_files': rfs}
-                if state in [2, 3, 4]:
-                    _, rfs = parse_rfs(line)
-                    for rf_name, rf_value in rfs.items():
-                        cpurfs[cpurf_id]['register_files'][rf_name] = rf_value
-                if state == 5:
-                    psr_name, psr_value, flags, _, mode = parse_state(line)
-                    cpurfs[cpurf_id]['register_files'][psr_name] = psr_value
-                    cpurfs[cpurf_id]['mode'] = mode
-                if state == 9:
-                    dfr_name_value = line.strip().split()[1:]
-                    for i in range(0, len(dfr_name_value), 2):
-                        cpurfs[cpurf_id]['register_files'][dfr_name_value[i]] = dfr_name_value[i + 1]
-                if state == 6:
-                    if line.startswith('R00'):
-                        cpurf_id += 1
-                        state = 1
-                        offset, rfs = parse_rfs(line)
-                        cpurfs[cpurf_id] = {'id': cpurf_id, 'ln': offset, 'register_files': rfs}
-                    elif line.startswith('Taking exception'):
-                        exception_type = int(line.strip().split()[2])
-                        exception_name = self.exception_names[exception_type]
-                        if 'exception' in cpurfs[cpurf_id]:
-                            cpurfs[cpurf_id]['exception']['type'] = exception_name
-                        else:
-                            cpurfs[cpurf_id]['exception'] = {'type': exception_name}
-                    elif line.startswith('Exception return'):
-                        _, _, _, _, f, _, t, _, pc = line.strip().split()
-                        cpurfs[cpurf_id]['exception'] = {'ret': True, 'from': f, 'to': t, 'pc': pc}
-                        state = 5
-                    elif line.find('mode switch') != -1:
-                        _, _, _, _, f, _, t, _, pc = line.strip().split()
-                        cpurfs[cpurf_id]['exception'] = {'switch': True, 'from': f, 'to': t, 'pc': pc}
-                        state = 10
-                    else:
-                        state = 10
-                if state == 8:
-                    if exception_type in [1, 2, 5, 11]:
-                        state = 10
-                if state in [1, 2, 3, 4, 5, 6, 7, 8, 9]:
-                    state += 1
-                if state == 10:
-                    state = 0
-                    if self.mode == 'generator':
-                        yield cpurfs[cpurf_id]
-                    cpurf_id += 1
-                ln += 1
-        self.cpurfs = cpurfs
+    def get_instruction_size(self, instruction):
+        raw = instruction['raw']
+        if len(raw) == 4 and int(raw, 16) >> 11 in [0b11101, 0b11110, 0b11111]:
+            # the first halfword of a 32-bit Thumb instruction, logged apart
+            return 4
+        return len(raw) // 2
+
+    def new_cpurf_parser(self, cpurfs, ln=0, cpurf_id=0):
+        return AArch32CpurfParser(self.exception_names, cpurfs, ln=ln, cpurf_id=cpurf_id)
+
+    def fast_cpurf(self, match):
+        values = match.groups()
+        return dict(zip(self.register_schema, values)), values[-1].decode()
 
 
 class PQL_MIPS32(PQLI):
-    def __init__(self, endian, tracefile, mode='plain'):
-        super().__init__(endian, tracefile, mode=mode)
+    register_schema = [
+        'pc',
+        'r0', 'at', 'v0', 'v1', 'a0', 'a1', 'a2', 'a3',
+        't0', 't1', 't2', 't3', 't4', 't5', 't6', 't7',
+        's0', 's1', 's2', 's3', 's4', 's5', 's6', 's7',
+        't8', 't9', 'k0', 'k1', 'gp', 'sp', 's8', 'ra',
+        'Status', 'Cause', 'EPC',
+        'Config0', 'Config1', 'Config2', 'Config3', 'Config4', 'Config5'
+    ]
+    wide_register_schema = ['LLAddr']
+    pc_register = 'pc'
+    cpurf_prefix = 'pc='
+    fast_cpurf_pattern = re.compile(
+        rb'pc=0x([0-9a-f]{8}) [^\n]*\n' +
+        rb'GPR\d\d: +(\w+) +([0-9a-f]{8}) +(\w+) +([0-9a-f]{8}) +(\w+) +([0-9a-f]{8}) +(\w+) +([0-9a-f]{8}) *\n' * 8 +
+        rb'CP0 +(\w+) +0x([0-9a-f]{8}) +(\w+) +0x([0-9a-f]{8}) +(\w+) +0x([0-9a-f]{8}) *\n' +
+        rb' +(\w+) +0x([0-9a-f]{8}) +(\w+) +0x([0-9a-f]{8}) +(\w+) +0x([0-9a-f]{16}) *\n' +
+        rb' +(\w+) +0x([0-9a-f]{8}) +(\w+) +0x([0-9a-f]{8}) *\n' * 2)
+
+    def __init__(self, endian, tracefile, mode='plain', **kwargs):
+        super().__init__(endian, tracefile, mode=mode, **kwargs)
         self.exception_names = [
             'int', 'mod', 'tlbl', 'tlbs', 'adel',
             'ades', 'ibe', 'dbe', 'syscall', 'bp',
@@ -305,173 +3086,274 @@ class PQL_MIPS32(PQLI):
             'cacheerr', 'reserved'
         ]
 
-    def load_cpurf_generator(self):
-        """
-        pc=0x80005d0c HI=0x00000000 LO=0x00000000 ds 0090 80005d0c 0        1 <- 0
-        GPR00: r0 00000000 at 1000001f v0 00000000 v1 00000000              2
-        GPR04: a0 00000000 a1 00000000 a2 00000000 a3 00000000              3
-        GPR08: t0 80005d0c t1 00000000 t2 00000000 t3 00000000              4
-        GPR12: t4 00000000 t5 00000000 t6 00000000 t7 00000000              5
-        GPR16: s0 00000000 s1 00000000 s2 00000000 s3 00000000              6
-        GPR20: s4 00000000 s5 00000000 s6 00000000 s7 00000000              7
-        GPR24: t8 00000000 t9 00000000 k0 00000000 k1 00000000              8
-        GPR28: gp 00000000 sp 00000000 s8 00000000 ra 00000000              9
-        CP0 Status  0x10400000 Cause   0x00000000 EPC    0x00000000         10
-            Config0 0x80000482 Config1 0x9e190c8f LLAddr 0x0000000000000000 11
-            Config2 0x80000000 Config3 0x00000c20                           12
-            Config4 0x00000000 Config5 0x00000000                           13
-        do_raise_exception_err: 28 0                                                            14
-        mips_cpu_do_interrupt enter: PC 801d0e9c EPC 00000000 data bus error exception          15
-        mips_cpu_do_interrupt: PC bfc00380 EPC 801d0e9c cause 7                                 16
-            S 10400002 C 0000001c A 00000000 D 00000000                                         17
-        do_raise_exception_err: 15 0                                                            14
-        mips_cpu_do_interrupt enter: PC bfc00380 EPC 801d0e9c instruction bus error exception   15
-        mips_cpu_do_interrupt: PC bfc00380 EPC 801d0e9c cause 6                                 16
-            S 10400002 C 00000018 A 00000000 D 00000000                                         17
-        do_raise_exception_err: 26 0                                                            14
-        mips_cpu_do_interrupt enter: PC 80008e20 EPC 00000000 TLB load exception                15
-        mips_cpu_do_interrupt: PC bfc00380 EPC 80008e20 cause 2                                 16
-            S 00400002 C 00000008 A 000000a0 D 00000000                                         17
-        do_raise_exception_err: 20 0                                                            14
-        mips_cpu_do_interrupt enter: PC 80448320 EPC 00000000 reserved instruction exception    15
-        mips_cpu_do_interrupt: PC bfc00380 EPC 80448320 cause 10                                16
-            S 00400006 C 00000028 A 00000000 D 00000000                                         17
-        """
-        ln = 0
-        cpurfs = {}
-
-        def parse_state(line):
-            """
-            SR: Soft-Reset, 20
-            NMI: Non-Maskable-Interrupt, 19
-            IM7-0: Interrupt-Mask, 15-8
-            KSU: Kernel-Supervise-User, 4-3
-            """
-            status = int(line.strip().split()[2], 16)
-            mode_value = status >> 3 & 0x3
-            if mode_value == 0:
-                mode = 'kernel'
-            elif mode_value == 1:
-                mode = 'supervisor'
-            elif mode_value == 2:
-                mode = 'user'
-            else:
-                raise ValueError('bad status register')
-            return mode
-
-        def parse_rfs(line, ref=4, off=1):
-            things = line.strip().split()
-            rfs = {}
-            for i in range(0, ref):
-                value = things[off + 1 + 2 * i]
-                if value.startswith('0x'):
-                    value = value[2:]
-                rfs[things[off + 2 * i]] = value
-            offset = ln + 1
-            return offset, rfs
-
-        cpurf_id = 0
-        with open(self.tracefile) as f:
-            state = 0
-            for line in f:
-                if state == 0 and line.startswith('pc='):
-                    state = 1
-                    offset, rfs = ln + 1, {'pc': line.strip().split()[0][5:]}
-                    cpurfs[cpurf_id] = {'id': cpurf_id, 'ln': offset, 'register_files': rfs}
-                if state in [2, 3, 4, 5, 6, 7, 8, 9]:
-                    _, rfs = parse_rfs(line, ref=4, off=1)
-                    for rf_name, rf_value in rfs.items():
-                        cpurfs[cpurf_id]['register_files'][rf_name] = rf_value
-                if state in [10]:
-                    mode = parse_state(line)
-                    _, rfs = parse_rfs(line, ref=3, off=1)
-                    for rf_name, rf_value in rfs.items():
-                        cpurfs[cpurf_id]['register_files'][rf_name] = rf_value
-                    cpurfs[cpurf_id]['mode'] = mode
-                if state in [11]:
-                    _, rfs = parse_rfs(line, ref=3, off=0)
-                    for rf_name, rf_value in rfs.items():
-                        cpurfs[cpurf_id]['register_files'][rf_name] = rf_value
-                if state in [12, 13]:
-                    _, rfs = parse_rfs(line, ref=2, off=0)
-                    for rf_name, rf_value in rfs.items():
-                        cpurfs[cpurf_id]['register_files'][rf_name] = rf_value
-                if state == 14:
-                    if line.startswith('pc='):
-                        cpurf_id += 1
-                        state = 1
-                        offset, rfs = ln + 1, {'pc': line.strip().split()[0][5:]}
-                        cpurfs[cpurf_id] = {'id': cpurf_id, 'ln': offset, 'register_files': rfs}
-                    elif line.startswith('do_raise_exception_err'):
-                        pass
-                    elif line.startswith('---'):
-                        state = 18
-                    else:
-                        state = 18
-                if state == 15:
-                    if line.startswith('mips_cpu_do_interrupt'):
-                        pass
-                    else:
-                        state = 18
-                if state == 16:
-                    exception_type = int(line.strip().split()[-1])
-                    exception_name = self.exception_names[exception_type]
-                    if 'exception' in cpurfs[cpurf_id]:
-                        # no need for exception chain
-                        # cpurfs[cpurf_id]['exception']['type'] = exception_name
-                        pass
-                    else:
-                        cpurfs[cpurf_id]['exception'] = {'type': exception_name}
-                    epc = line.strip().split()[-3]
-                    cpurfs[cpurf_id]['register_files']['EPC'] = epc
-                if state == 17:
-                    state = 13
-                if state in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16]:
-                    state += 1
-                if state == 18:
-                    state = 0
-                    if self.mode == 'generator':
-                        yield cpurfs[cpurf_id]
-                    cpurf_id += 1
-                ln += 1
-        self.cpurfs = cpurfs
+    def new_cpurf_parser(self, cpurfs, ln=0, cpurf_id=0):
+        return MIPS32CpurfParser(self.exception_names, cpurfs, ln=ln, cpurf_id=cpurf_id)
+
+    def fast_cpurf(self, match):
+        groups = match.groups()
+        rfs = {'pc': groups[0]}
+        for i in range(1, len(groups), 2):
+            rfs[groups[i].decode()] = groups[i + 1]
+        # KSU of the status register, see MIPS32CpurfParser.parse_state()
+        mode = ['kernel', 'supervisor', 'user', None][int(rfs['Status'], 16) >> 3 & 0x3]
+        if mode is None:
+            raise ValueError('bad status register')
+        return rfs, mode
 
     def get_ra(self, cpurf):
         return cpurf['register_files']['ra']
 
+    def get_exception_pc(self, cpurf):
+        # see MIPS32CpurfParser, the EPC of the exception
+        return cpurf['register_files'].get('EPC')
+
     def get_pc(self, cpurf):
         return cpurf['register_files']['pc']
 
 
-def __get_pql_compacted(arch_e_endian, tracefile, mode='plain'):
+def __get_pql_compacted(arch_e_endian, tracefile, **kwargs):
     if arch_e_endian == ARMEL:
-        return PQL_AARCH32('l', tracefile, mode=mode)
+        return PQL_AARCH32('l', tracefile, **kwargs)
     elif arch_e_endian == MIPSEL:
-        return PQL_MIPS32('l', tracefile, mode=mode)
+        return PQL_MIPS32('l', tracefile, **kwargs)
     elif arch_e_endian == MIPSEB:
-        return PQL_MIPS32('b', tracefile, mode=mode)
+        return PQL_MIPS32('b', tracefile, **kwargs)
     else:
         raise NotImplementedError('Unsupported arch/endian {}'.format(arch_e_endian))
 
 
-def __get_pql_separated(arch, endian, tracefile, mode='plain'):
+def __get_pql_separated(arch, endian, tracefile, **kwargs):
     if arch == ARM:
-        return PQL_AARCH32('l', tracefile, mode=mode)
+        return PQL_AARCH32('l', tracefile, **kwargs)
     elif arch == MIPS:
         if endian == LITTLE:
-            return PQL_MIPS32('l', tracefile, mode=mode)
+            return PQL_MIPS32('l', tracefile, **kwargs)
         elif endian == BIG:
-            return PQL_MIPS32('b', tracefile, mode=mode)
+            return PQL_MIPS32('b', tracefile, **kwargs)
         else:
             raise NotImplementedError('Unsupported endian {}'.format(endian))
     else:
         raise NotImplementedError('Unsupported arch {}'.format(arch))
 
 
-def get_pql(*args, mode='plain'):
+def get_pql(*args, **kwargs):
     if args[0] in [ARMEL, MIPSEL, MIPSEB]:
-        return __get_pql_compacted(args[0], args[1], mode=mode)
+        return __get_pql_compacted(args[0], args[1], **kwargs)
     elif args[0] in [ARM, MIPS]:
-        return __get_pql_separated(args[0], args[1], args[2], mode=mode)
+        return __get_pql_separated(args[0], args[1], args[2], **kwargs)
     else:
         raise NotImplementedError('Unsupported input arguments {}'.format(args))
+
+
+def summarize(arch, tracefile, reducers=None):
+    """
+    Get the summary of a tracefile, read once in mode='stream':
+
+    {'tracefile': tracefile, 'arch': arch, 'cpurfs': n,
+     'blocks': {pc: hits}, 'instructions': executed instructions,
+     'exceptions': {type: n, 'ret': n}, 'modes': {mode: n},
+     'reduced': {name: value}, 'error': None}
+
+    reducers maps a name to (function, initial), where function(value,
+    cpurf, pql) gets the next value for every cpurf, e.g. the deepest stack.
+    """
+    reducers = reducers or {}
+    pql = get_pql(arch, tracefile, mode='stream')
+    coverage = Coverage()
+    exceptions, modes = {}, {}
+    reduced = {name: initial for name, (_, initial) in reducers.items()}
+    n = 0
+    for cpurf in pql.load_all():
+        n += 1
+        pc = pql.get_pc(cpurf)
+        if pc in pql.bb_index:
+            coverage.hit(pc, pql.get_bb(cpurf))
+        mode = cpurf.get('mode')
+        modes[mode] = modes.get(mode, 0) + 1
+        exception = cpurf.get('exception')
+        if exception is not None:
+            if 'type' in exception:
+                exceptions[exception['type']] = exceptions.get(exception['type'], 0) + 1
+            if exception.get('ret'):
+                exceptions['ret'] = exceptions.get('ret', 0) + 1
+        for name, (function, _) in reducers.items():
+            reduced[name] = function(reduced[name], cpurf, pql)
+    return {'tracefile': tracefile, 'arch': arch, 'cpurfs': n, 'blocks': coverage.block_hits(),
+            'instructions': coverage.executed(), 'exceptions': exceptions, 'modes': modes,
+            'reduced': reduced, 'error': None}
+
+
+def safe_summarize(arch, tracefile, reducers=None):
+    try:
+        return summarize(arch, tracefile, reducers=reducers)
+    except Exception as e:
+        return failed_summary(arch, tracefile, '{}: {}'.format(type(e).__name__, e))
+
+
+def failed_summary(arch, tracefile, error):
+    return {'tracefile': tracefile, 'arch': arch, 'error': error}
+
+
+def glob_traces(arch, *patterns):
+    """Get (arch, tracefile) for every tracefile matching the patterns, in order."""
+    traces = []
+    for pattern in patterns:
+        paths = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        traces.extend((arch, path) for path in paths)
+    return traces
+
+
+class Batch(object):
+    def __init__(self, traces, jobs=None, in_flight=None, reducers=None, reduce=None):
+        """
+        Summaries of many tracefiles, see summarize(), parsed in a pool of
+        jobs processes (None for all cores) with at most in_flight
+        tracefiles submitted at a time (2 * jobs by default).
+
+        traces is an iterable of (arch, tracefile), e.g. glob_traces().
+        Iterating yields the summary of every tracefile as it is done, and
+        meanwhile sums cpurfs, block hits, exceptions and modes over the
+        good ones. If reduce is (function, initial), reduced is
+        function(reduced, summary) of every good summary too.
+
+        A tracefile that fails to parse gets a summary with only its error,
+        and so does one that crashes its worker: the pool is restarted and
+        the tracefiles in flight are retried one process each.
+
+        reducers are sent to the workers, so their functions must be
+        picklable, i.e. defined at module level; reduce runs here.
+        """
+        self.traces = traces
+        self.jobs = jobs or os.cpu_count()
+        self.in_flight = in_flight or 2 * self.jobs
+        self.reducers = reducers
+        self.reduce = reduce
+        self.reduced = None if reduce is None else reduce[1]
+        self.done = 0
+        self.errors = []
+        self.cpurfs = 0
+        self.blocks = {}
+        self.exceptions = {}
+        self.modes = {}
+
+    def add(self, summary):
+        self.done += 1
+        if summary['error'] is not None:
+            self.errors.append((summary['tracefile'], summary['error']))
+            return summary
+        self.cpurfs += summary['cpurfs']
+        for total, counts in [(self.blocks, summary['blocks']), (self.exceptions, summary['exceptions']),
+                              (self.modes, summary['modes'])]:
+            for key, n in counts.items():
+                total[key] = total.get(key, 0) + n
+        if self.reduce is not None:
+            self.reduced = self.reduce[0](self.reduced, summary)
+        return summary
+
+    def isolated(self, arch, tracefile):
+        """Summarize a tracefile in a process of its own."""
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                return executor.submit(safe_summarize, arch, tracefile, self.reducers).result()
+            except BrokenProcessPool:
+                return failed_summary(arch, tracefile, 'worker crashed')
+            except Exception as e:
+                return failed_summary(arch, tracefile, '{}: {}'.format(type(e).__name__, e))
+
+    def __iter__(self):
+        traces = iter(self.traces)
+        executor = ProcessPoolExecutor(max_workers=self.jobs)
+        pending = {}
+        try:
+            while True:
+                for arch, tracefile in itertools.islice(traces, self.in_flight - len(pending)):
+                    pending[executor.submit(safe_summarize, arch, tracefile, self.reducers)] = (arch, tracefile)
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                crashed = []
+                for future in done:
+                    trace = pending.pop(future)
+                    try:
+                        summary = future.result()
+                    except BrokenProcessPool:
+                        crashed.append(trace)
+                        continue
+                    except Exception as e:
+                        # e.g. reducers that cannot be pickled
+                        summary = failed_summary(trace[0], trace[1], '{}: {}'.format(type(e).__name__, e))
+                    yield self.add(summary)
+                if crashed:
+                    # the whole pool is gone, and which tracefile did it is unknown
+                    crashed.extend(pending.values())
+                    pending = {}
+                    executor.shutdown(wait=True)
+                    for arch, tracefile in crashed:
+                        yield self.add(self.isolated(arch, tracefile))
+                    executor = ProcessPoolExecutor(max_workers=self.jobs)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def totals(self):
+        """Get the sums over the good summaries, as a dict."""
+        return {'traces': self.done, 'errors': len(self.errors), 'cpurfs': self.cpurfs,
+                'blocks': len(self.blocks), 'exceptions': self.exceptions, 'modes': self.modes}
+
+
+def parse_range(text):
+    """START-END (hexadecimal) to (start, end), or ADDRESS to (address, address + 1)."""
+    start, _, end = text.partition('-')
+    start = int(start, 16)
+    return start, int(end, 16) if end else start + 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='pyqemulog', description='Convert a tracefile of QEMU -d cpu,in_asm to JSON lines, '
+                                      'one cpurf with its basic block per line, or summarize '
+                                      'tracefiles, one per line and the totals last.')
+    parser.add_argument('tracefiles', nargs='+', metavar='tracefile', help='or a glob with --format summary')
+    parser.add_argument('--arch', required=True, choices=[ARMEL, MIPSEL, MIPSEB])
+    parser.add_argument('--format', default='jsonl', choices=['jsonl', 'summary'])
+    parser.add_argument('--jobs', type=int, default=1, help='processes, 0 for all cores')
+    parser.add_argument('--in-flight', type=int, help='tracefiles submitted at a time with --format summary')
+    parser.add_argument('--filter', action='append', metavar='START-END',
+                        help='only cpurfs with START <= pc < END in hexadecimal, can be repeated')
+    parser.add_argument('-o', '--output', help='the output file instead of stdout')
+    args = parser.parse_args(argv)
+    try:
+        ranges = None if args.filter is None else [parse_range(text) for text in args.filter]
+    except ValueError:
+        parser.error('bad --filter {}'.format(args.filter))
+    if args.format == 'summary':
+        if ranges is not None:
+            parser.error('--filter does not apply to --format summary')
+        batch = Batch(glob_traces(args.arch, *args.tracefiles), jobs=args.jobs or None, in_flight=args.in_flight)
+        lines = itertools.chain((json.dumps(summary) for summary in batch),
+                                # after the summaries, once they are summed
+                                (json.dumps({'totals': batch.totals()}) for _ in [None]))
+    elif len(args.tracefiles) > 1:
+        parser.error('--format jsonl takes one tracefile')
+    else:
+        pql = get_pql(args.arch, args.tracefiles[0], jobs=args.jobs or None,
+                      filter=None if ranges is None else Filter(pcs=ranges))
+        lines = pql.iter_jsonl()
+    if args.output is None:
+        out = open(sys.stdout.fileno(), 'w', buffering=BUFFER_SIZE, closefd=False)
+    else:
+        out = open(args.output, 'w', buffering=BUFFER_SIZE)
+    try:
+        with out:
+            for line in lines:
+                out.write(line)
+                out.write('\n')
+    except BrokenPipeError:
+        # the reader is gone, e.g. head, which is fine
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,5 +8,6 @@ setup(
     license='MIT',
     author='cyruscyliu',
     author_email='cyruscyliu@gmail.com',
-    description='QEMU log parsing utility.'
+    description='QEMU log parsing utility.',
+    entry_points={'console_scripts': ['pyqemulog=pyqemulog:main']}
 )
@@ -1,11 +1,81 @@
-from unittest import TestCase
-from pyqemulog import get_pql
+import ast
+import asyncio
+import bz2
+import gzip
+import json
+import lzma
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+from array import array
+from unittest import TestCase, mock, skipIf
+from bench import generate
+from pyqemulog import get_pql, glob_traces, main, Batch, Coverage, ExceptionIndex, Filter, Stats, TraceFollower
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from pyqemulog import ARM, MIPS, LITTLE, BIG, ARMEL, MIPSEL, MIPSEB
+from pyqemulog import PQL_AARCH32, PQL_MIPS32
 
 
 ARMEL_TRACE = 'tests/armel.trace'
 MIPSEL_TRACE = 'tests/mipsel.trace'
 MIPSEB_TRACE = 'tests/mipseb.trace'
+ARMEL_EXCEPTION_TRACE = 'tests/armel-exception.trace'
+
+
+def deepest_stack(value, cpurf, pql):
+    return min(value, int(cpurf['register_files']['R13'], 16))
+
+
+def crash_on_exception(value, cpurf, pql):
+    if 'exception' in cpurf:
+        os._exit(1)
+    return value
+
+
+def write_retranslated_trace(n):
+    """Write an ARMEL trace where one pc is retranslated n times."""
+    fd, path = tempfile.mkstemp(suffix='.trace')
+    with os.fdopen(fd, 'w') as f:
+        for i in range(n):
+            f.write('----------------\nIN: \n')
+            f.write('0x00008000:  e3a00{:03x}  mov      r0, #{}\n'.format(i % 0x1000, i % 0x1000))
+            f.write('0x00008004:  eafffffd  b        #0x8000\n\n')
+            f.write('R00={:08x} R01=00000000 R02=00000000 R03=00000000\n'.format(i))
+            f.write('R04=00000000 R05=00000000 R06=00000000 R07=00000000\n')
+            f.write('R08=00000000 R09=00000000 R10=00000000 R11=00000000\n')
+            f.write('R12=00000000 R13=00000000 R14=00000000 R15=00008000\n')
+            f.write('PSR=400001d3 -Z-- A svc32\n')
+    return path
+
+
+def read_npz(path):
+    """Read the columns of an .npz file of NpzExporter without NumPy."""
+    columns = {}
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            data = zf.read(name)
+            size = int.from_bytes(data[8:10], 'little')
+            header = ast.literal_eval(data[10:10 + size].decode('latin1'))
+            body = data[10 + size:]
+            if header['descr'][1] == 'U':
+                width = int(header['descr'][2:]) * 4
+                column = [body[i:i + width].decode('utf-32-le').rstrip('\0') for i in range(0, len(body), width)]
+            else:
+                column = array('I' if header['descr'][1:] == 'u4' else 'Q', body).tolist()
+            assert len(column) == header['shape'][0]
+            columns[name[:-4]] = column
+    return columns
 
 
 class TestCommon(TestCase):
@@ -99,3 +169,807 @@ class TestCommon(TestCase):
             bb = pql.get_bb(cpurf)
             self.assertIsNotNone(cpurf)
             self.assertIsNotNone(bb)
+
+    def test_unified_mode(self):
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE), (MIPSEB, MIPSEB_TRACE)]:
+            pql = get_pql(arch, trace)
+            pql.load_cpurf()
+            pql.load_in_asm()
+            unified = get_pql(arch, trace)
+            unified.load_all()
+            self.assertEqual(pql.cpurfs, unified.cpurfs)
+            self.assertEqual(pql.bbs, unified.bbs)
+
+            unified = get_pql(arch, trace, mode='generator')
+            for cpurf in unified.load_all():
+                self.assertIsNotNone(unified.get_bb(cpurf))
+            self.assertEqual(pql.cpurfs, unified.cpurfs)
+
+    def test_retranslated_bb(self):
+        path = write_retranslated_trace(3000)
+        try:
+            pql = get_pql(ARMEL, path)
+            pql.load_all()
+            self.assertEqual(len(pql.bb_index['00008000'][1]), 3000)
+            for cpurf in pql.cpurfs.values():
+                bb = pql.get_bb(cpurf)
+                # every snapshot runs the translation right before it
+                self.assertEqual(bb['instructions'][0]['ln'], cpurf['ln'] - 3)
+            bb, n = pql.bbs['00008000'], 1
+            while bb['chained']:
+                bb, n = bb['next'], n + 1
+            self.assertEqual(n, 3000)
+        finally:
+            os.unlink(path)
+
+    def test_interned_bbs(self):
+        def normalized(bb):
+            return [dict(instruction, operand=None if instruction['operand'] is None else list(instruction['operand']))
+                    for instruction in bb['instructions']]
+
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE), (MIPSEB, MIPSEB_TRACE)]:
+            pql = get_pql(arch, trace)
+            pql.load_all()
+            for interned in [get_pql(arch, trace, intern=True), get_pql(arch, trace, intern=True, fast=True)]:
+                interned.load_all()
+                self.assertEqual(pql.bb_index.keys(), interned.bb_index.keys())
+                for address, (lns, chain) in pql.bb_index.items():
+                    self.assertEqual(lns, interned.bb_index[address][0])
+                    for bb, other in zip(chain, interned.bb_index[address][1]):
+                        self.assertEqual(normalized(bb), normalized(other))
+                for k, cpurf in interned.get_cpurf():
+                    self.assertEqual(normalized(pql.get_bb(pql.cpurfs[k])), normalized(interned.get_bb(cpurf)))
+
+        path = write_retranslated_trace(5000)
+        try:
+            pql = get_pql(ARMEL, path, intern=True)
+            pql.load_in_asm()
+            chain = pql.bb_index['00008000'][1]
+            self.assertIs(chain[0]['instructions'].bodies, chain[4096]['instructions'].bodies)
+            self.assertEqual(chain[4096]['instructions'][0]['ln'], 4096 * 10 + 3)
+            self.assertEqual(chain[4096]['instructions'][-1]['operand'], ('#0x8000',))
+            self.assertIs(chain[1]['instructions'][1].body, chain[2]['instructions'][1].body)
+            instructions = chain[1]['instructions']
+            self.assertEqual(instructions[-len(instructions)], instructions[0])
+            self.assertRaises(IndexError, instructions.__getitem__, -len(instructions) - 1)
+            self.assertRaises(IndexError, instructions.__getitem__, len(instructions))
+        finally:
+            os.unlink(path)
+
+    def test_columnar_storage(self):
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE),
+                            (MIPSEB, MIPSEB_TRACE), (ARMEL, ARMEL_EXCEPTION_TRACE)]:
+            pql = get_pql(arch, trace)
+            pql.load_all()
+            columnar = get_pql(arch, trace, storage='columnar')
+            columnar.load_all()
+            self.assertEqual(len(pql.cpurfs), len(columnar.cpurfs))
+            self.assertEqual(list(pql.cpurfs.values()), list(columnar.cpurfs.values()))
+            for k, cpurf in columnar.get_cpurf():
+                self.assertEqual(pql.cpurfs[k], cpurf)
+                self.assertEqual(pql.get_pc(pql.cpurfs[k]), columnar.get_pc(cpurf))
+                self.assertEqual(pql.get_ra(pql.cpurfs[k]), columnar.get_ra(cpurf))
+                self.assertEqual(pql.get_bb(pql.cpurfs[k]), columnar.get_bb(cpurf))
+
+        pql = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE, storage='columnar')
+        pql.load_cpurf()
+        self.assertEqual(pql.cpurfs[3]['register_files']['DFAR'], '0xf1012014')
+        self.assertEqual(pql.cpurfs[3]['exception'], {'type': 'dabt'})
+        self.assertNotIn('exception', pql.cpurfs[0])
+        self.assertRaises(KeyError, lambda: pql.cpurfs[len(pql.cpurfs)])
+
+    def test_delta_storage(self):
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE),
+                            (MIPSEB, MIPSEB_TRACE), (ARMEL, ARMEL_EXCEPTION_TRACE)]:
+            pql = get_pql(arch, trace)
+            pql.load_all()
+            delta = get_pql(arch, trace, storage='delta', keyframe=4)
+            delta.load_all()
+            self.assertEqual(list(pql.cpurfs.values()), list(delta.cpurfs.values()))
+            # random access, backwards
+            for k in reversed(range(len(pql.cpurfs))):
+                self.assertEqual(pql.cpurfs[k], delta.cpurfs[k])
+                self.assertEqual(pql.changed_registers(pql.cpurfs[k]), delta.changed_registers(delta.cpurfs[k]))
+                self.assertEqual(pql.get_bb(pql.cpurfs[k]), delta.get_bb(delta.cpurfs[k]))
+
+        pql = get_pql(MIPSEL, MIPSEL_TRACE, storage='delta')
+        pql.load_cpurf()
+        self.assertEqual(len(pql.changed_registers(pql.cpurfs[0])), 43)
+        self.assertEqual(sorted(pql.cpurfs.changed(1)), sorted(pql.changed_registers(pql.cpurfs[1])))
+        self.assertNotIn('Config0', pql.changed_registers(pql.cpurfs[1]))
+        self.assertIn('pc', pql.changed_registers(pql.cpurfs[1]))
+        # the configuration registers are never stored again
+        self.assertLess(len(pql.cpurfs.change_values), len(pql.cpurfs) * 44 // 4)
+
+    def test_cache(self):
+        fd, path = tempfile.mkstemp(suffix='.trace')
+        os.close(fd)
+        try:
+            for arch, trace in [(ARMEL, ARMEL_EXCEPTION_TRACE), (MIPSEL, MIPSEL_TRACE)]:
+                shutil.copyfile(trace, path)
+                for storage, cache, intern in [('dict', 'pickle', False), ('columnar', True, False),
+                                               ('delta', True, True)]:
+                    pql = get_pql(arch, path, storage=storage, cache=cache, intern=intern)
+                    pql.load_cpurf()
+                    pql.load_in_asm()
+                    self.assertTrue(os.path.exists(path + '.pqlcache'))
+
+                    pql.build_seek_index()
+
+                    cached = get_pql(arch, path, storage=storage, cache=cache, intern=intern)
+                    self.assertTrue(cached.load_cache('cpurfs', 'bbs', 'seek_index'))
+                    self.assertEqual(pql.seek_index.cpurf_offsets, cached.seek_index.cpurf_offsets)
+                    cached.load_all()
+                    self.assertEqual(pql.cpurfs, cached.cpurfs)
+                    self.assertEqual(pql.bbs, cached.bbs)
+                    self.assertEqual(pql.bb_index, cached.bb_index)
+                    for k, cpurf in cached.get_cpurf():
+                        self.assertEqual(pql.get_bb(pql.cpurfs[k]), cached.get_bb(cpurf))
+                    if intern:
+                        chain = cached.bb_index[cached.get_pc(cached.cpurfs[0])][1]
+                        self.assertIsInstance(chain[0]['instructions'][0]['operand'], tuple)
+                os.unlink(path + '.pqlcache')
+
+            shutil.copyfile(ARMEL_EXCEPTION_TRACE, path)
+            with mock.patch('pyqemulog.pickle.loads', wraps=pickle.loads) as loads:
+                # stores are raw arrays and JSON, nothing is unpickled
+                pql = get_pql(ARMEL, path, storage='delta', cache=True)
+                pql.load_all()
+                self.assertTrue(get_pql(ARMEL, path, storage='delta', cache=True).load_cache('cpurfs', 'bbs'))
+                # dict cpurfs are only cached with cache='pickle'
+                pql = get_pql(ARMEL, path, cache=True)
+                pql.load_all()
+                self.assertFalse(get_pql(ARMEL, path, cache=True).load_cache('cpurfs'))
+                self.assertTrue(get_pql(ARMEL, path, cache=True).load_cache('bbs'))
+                get_pql(ARMEL, path, cache='pickle').load_cpurf()
+                self.assertFalse(get_pql(ARMEL, path, cache=True).load_cache('cpurfs'))
+                self.assertEqual(loads.call_count, 0)
+                self.assertTrue(get_pql(ARMEL, path, cache='pickle').load_cache('cpurfs'))
+                self.assertEqual(loads.call_count, 1)
+            # a delta store depends on its keyframe interval
+            self.assertFalse(get_pql(ARMEL, path, storage='delta', keyframe=2, cache=True).load_cache('cpurfs'))
+
+            # the trace changes, the cache must not be used
+            with open(path, 'a') as f, open(ARMEL_TRACE) as sample:
+                f.write(sample.read())
+            pql = get_pql(ARMEL, path, storage='columnar', cache=True)
+            self.assertFalse(pql.load_cache('cpurfs'))
+            pql.load_cpurf()
+            self.assertEqual(len(pql.cpurfs), 6 + 79)
+        finally:
+            os.unlink(path)
+            if os.path.exists(path + '.pqlcache'):
+                os.unlink(path + '.pqlcache')
+
+    def test_parallel_mode(self):
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE),
+                            (MIPSEB, MIPSEB_TRACE), (ARMEL, ARMEL_EXCEPTION_TRACE)]:
+            for storage in ['dict', 'columnar', 'delta']:
+                pql = get_pql(arch, trace, storage=storage)
+                pql.load_all()
+                parallel = get_pql(arch, trace, storage=storage, jobs=3)
+                self.assertEqual(len(parallel.split(3)), 3 if arch != MIPSEB else 2)
+                parallel.load_cpurf()
+                parallel.load_in_asm()
+                self.assertEqual(pql.cpurfs, parallel.cpurfs)
+                self.assertEqual(pql.bbs, parallel.bbs)
+                for k, cpurf in parallel.get_cpurf():
+                    self.assertEqual(pql.get_bb(pql.cpurfs[k]), parallel.get_bb(cpurf))
+
+    def test_stream_mode(self):
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE),
+                            (MIPSEB, MIPSEB_TRACE), (ARMEL, ARMEL_EXCEPTION_TRACE)]:
+            pql = get_pql(arch, trace)
+            pql.load_all()
+            stream = get_pql(arch, trace, mode='stream', window=4)
+            stream.load_in_asm()
+            n = 0
+            for k, cpurf in stream.get_cpurf():
+                self.assertEqual(pql.cpurfs[k], cpurf)
+                self.assertLessEqual(len(stream.cpurfs), 9)
+                self.assertEqual(pql.get_next_cpurf(pql.cpurfs[k]), stream.get_next_cpurf(cpurf))
+                self.assertEqual(pql.get_last_cpurf(pql.cpurfs[k]), stream.get_last_cpurf(cpurf))
+                self.assertEqual(pql.get_bb(pql.cpurfs[k]), stream.get_bb(cpurf))
+                n += 1
+            self.assertEqual(n, len(pql.cpurfs))
+
+        stream = get_pql(ARMEL, ARMEL_TRACE, mode='stream', window=4)
+        for k, cpurf in stream.get_cpurf():
+            # armel.trace has no exception return to look for
+            self.assertRaises(ValueError, stream.get_exception_return_cpurf, cpurf)
+            break
+
+        pql = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE)
+        pql.load_all()
+        stream = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE, mode='stream', window=2)
+        for cpurf in stream.load_all():
+            self.assertEqual(pql.get_exception_return_cpurf(pql.cpurfs[cpurf['id']]),
+                             stream.get_exception_return_cpurf(cpurf))
+            self.assertEqual(pql.get_bb(pql.cpurfs[cpurf['id']]), stream.get_bb(cpurf))
+
+    def test_compressed_trace(self):
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE)]:
+            pql = get_pql(arch, trace)
+            pql.load_all()
+            with open(trace, 'rb') as f:
+                data = f.read()
+            for ext, compress in [('.gz', gzip.compress), ('.xz', lzma.compress), ('.bz2', bz2.compress)]:
+                fd, path = tempfile.mkstemp(suffix='.trace' + ext)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(compress(data))
+                try:
+                    compressed = get_pql(arch, path, jobs=2)
+                    compressed.load_cpurf()
+                    compressed.load_in_asm()
+                    self.assertEqual(pql.cpurfs, compressed.cpurfs)
+                    self.assertEqual(pql.bbs, compressed.bbs)
+                finally:
+                    os.unlink(path)
+
+    def test_seek_index(self):
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE),
+                            (MIPSEB, MIPSEB_TRACE), (ARMEL, ARMEL_EXCEPTION_TRACE)]:
+            pql = get_pql(arch, trace)
+            pql.load_all()
+            indexed = get_pql(arch, trace)
+            seek_index = indexed.build_seek_index()
+            self.assertEqual(len(seek_index.cpurf_offsets), len(pql.cpurfs))
+            for i in reversed(range(len(pql.cpurfs))):
+                self.assertEqual(pql.cpurfs[i], indexed.get_cpurf_at(i))
+            for cpurf in pql.cpurfs.values():
+                bb = pql.get_bb(cpurf)
+                seeked = indexed.get_bb_at(bb['instructions'][-1]['ln'])
+                self.assertEqual(bb['instructions'], seeked['instructions'])
+                self.assertEqual(bb['size'], seeked['size'])
+            self.assertRaises(IndexError, indexed.get_cpurf_at, len(pql.cpurfs))
+            self.assertRaises(IndexError, indexed.get_bb_at, 0)
+
+    def test_fast_parser(self):
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE),
+                            (MIPSEB, MIPSEB_TRACE), (ARMEL, ARMEL_EXCEPTION_TRACE)]:
+            for storage in ['dict', 'columnar', 'delta']:
+                pql = get_pql(arch, trace, storage=storage)
+                pql.load_all()
+                fast = get_pql(arch, trace, storage=storage, fast=True)
+                fast.load_cpurf()
+                fast.load_in_asm()
+                self.assertEqual(pql.cpurfs, fast.cpurfs)
+                self.assertEqual(pql.bbs, fast.bbs)
+                self.assertEqual(pql.bb_index, fast.bb_index)
+
+    def test_flatten(self):
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE), (ARMEL, ARMEL_EXCEPTION_TRACE)]:
+            pql = get_pql(arch, trace)
+            pql.load_all()
+            expected, hits, edges, last = [], {}, {}, None
+            for k, cpurf in pql.get_cpurf():
+                pc = pql.get_pc(cpurf)
+                if pc not in pql.bb_index:
+                    continue
+                for instruction in pql.get_bb(cpurf)['instructions']:
+                    expected.append((k, instruction['ln']))
+                hits[pc] = hits.get(pc, 0) + 1
+                if last is not None:
+                    edges[(last, pc)] = edges.get((last, pc), 0) + 1
+                last = pc
+            coverage = Coverage()
+            self.assertEqual([(k, instruction['ln']) for k, _, instruction in pql.flatten(coverage)], expected)
+            self.assertEqual(coverage.block_hits(), hits)
+            self.assertEqual(coverage.edge_counts(), edges)
+            self.assertEqual(pql.coverage().edge_counts(), edges)
+            self.assertEqual(coverage.hot_blocks(1)[0][1], max(hits.values()))
+
+            stream = get_pql(arch, trace, mode='stream', window=4)
+            flat = [(k, instruction['ln']) for k, _, instruction in stream.flatten()]
+            self.assertEqual(flat, expected)
+
+            generator = get_pql(arch, trace, mode='generator')
+            flat = [(k, instruction['ln']) for k, _, instruction in generator.flatten()]
+            self.assertEqual(flat, expected)
+            self.assertEqual(get_pql(arch, trace, mode='generator').coverage().block_hits(), hits)
+
+        coverage = pql.coverage()
+        self.assertTrue(coverage.is_covered('00008000'))
+        self.assertFalse(coverage.is_covered('00000004'))
+        self.assertIn('ffff0018', coverage.covered())
+        self.assertEqual(len(coverage.covered()), len(set(instruction['address'] for _, _, instruction in pql.flatten())))
+        self.assertEqual(coverage.executed(), len(coverage.covered()))
+
+        # a basic block that is translated but never executed
+        fd, path = tempfile.mkstemp(suffix='.trace')
+        with os.fdopen(fd, 'w') as f, open(ARMEL_EXCEPTION_TRACE) as sample:
+            f.write(sample.read())
+            f.write('----------------\nIN: \n0x00009000:  e3a00000  mov      r0, #0\n\n')
+        try:
+            pql = get_pql(ARMEL, path)
+            pql.load_all()
+            translated = pql.coverage()
+            self.assertEqual(translated.covered(), coverage.covered())
+            self.assertEqual(translated.uncovered(), ['00009000'])
+            self.assertFalse(translated.is_covered('00009000'))
+            self.assertEqual(translated.executed(), coverage.executed())
+        finally:
+            os.unlink(path)
+
+    def test_call_stack(self):
+        pql = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE)
+        pql.load_all()
+        self.assertEqual([kind for _, kind in pql.transitions()],
+                         [None, 'call', 'exception', 'return', 'exception', 'return'])
+        call_stack = pql.call_stack()
+        self.assertEqual(call_stack.functions, {'00008000': 3, '00008100': 1, 'ffff0018': 1, 'ffff0010': 1})
+        self.assertEqual(call_stack.graph, {('00008000', '00008100'): 1, ('00008100', 'ffff0018'): 1,
+                                            ('00008000', 'ffff0010'): 1})
+        tree = call_stack.call_tree()
+        self.assertEqual(len(tree), 1)
+        self.assertEqual(tree[0]['function'], '00008000')
+        self.assertEqual([callee['function'] for callee in tree[0]['callees']], ['00008100', 'ffff0010'])
+        self.assertEqual(tree[0]['callees'][0]['callees'][0]['function'], 'ffff0018')
+        self.assertEqual(tree[0]['cpurfs'], 3)
+
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE)]:
+            pql = get_pql(arch, trace)
+            pql.load_all()
+            call_stack = pql.call_stack()
+            self.assertEqual(sum(call_stack.functions.values()), len(pql.cpurfs))
+            self.assertEqual(sum(call_stack.transitions.values()), len(pql.cpurfs) - 1)
+            self.assertGreater(call_stack.transitions['call'], 0)
+            self.assertGreater(call_stack.transitions['return'], 0)
+            stream = get_pql(arch, trace, mode='stream', window=4)
+            self.assertEqual([kind for _, kind in stream.transitions()], [kind for _, kind in pql.transitions()])
+            shallow = pql.call_stack(max_depth=2)
+            self.assertLessEqual(len(shallow.stack), 2)
+            self.assertEqual(sum(shallow.functions.values()), len(pql.cpurfs))
+
+        # a 32-bit Thumb bl, logged as two halfwords, sets bit 0 of lr
+        blocks = [(['0x00008000:  2000      movs     r0, #0', '0x00008002:  f000 f87d  bl       #0x8100'],
+                   '00000000', '00008000'),
+                  (['0x00008100:  4770      bx       lr'], '00008007', '00008100'),
+                  (['0x00008006:  e7fe      b        #0x8006'], '00008007', '00008006')]
+        fd, path = tempfile.mkstemp(suffix='.trace')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                for instructions, lr, pc in blocks:
+                    f.write('----------------\nIN: \n' + '\n'.join(instructions) + '\n\n')
+                    f.write('R00=00000000 R01=00000000 R02=00000000 R03=00000000\n')
+                    f.write('R04=00000000 R05=00000000 R06=00000000 R07=00000000\n')
+                    f.write('R08=00000000 R09=00000000 R10=00000000 R11=00000000\n')
+                    f.write('R12=00000000 R13=00009000 R14={} R15={}\n'.format(lr, pc))
+                    f.write('PSR=400001f3 -Z-- T svc32\n')
+            pql = get_pql(ARMEL, path)
+            pql.load_all()
+            self.assertEqual([kind for _, kind in pql.transitions()], [None, 'call', 'return'])
+        finally:
+            os.remove(path)
+
+    def test_synthetic_trace(self):
+        fd, path = tempfile.mkstemp(suffix='.trace')
+        os.close(fd)
+        try:
+            for arch in [ARMEL, MIPSEL, MIPSEB]:
+                generate(arch, path, 2000, exceptions=0.05, retranslations=0.1, seed=1)
+                with open(path) as f:
+                    text = f.read()
+                generate(arch, path, 2000, exceptions=0.05, retranslations=0.1, seed=1)
+                with open(path) as f:
+                    self.assertEqual(f.read(), text)
+                pql = get_pql(arch, path)
+                pql.load_all()
+                self.assertGreaterEqual(len(pql.cpurfs), 2000)
+                self.assertGreater(len(list(pql.exceptions())), 50)
+                self.assertGreater(max(len(chain) for _, chain in pql.bb_index.values()), 1)
+                for _, cpurf in pql.get_cpurf():
+                    pql.get_bb(cpurf)
+                fast = get_pql(arch, path, fast=True)
+                fast.load_all()
+                self.assertEqual(pql.cpurfs, fast.cpurfs)
+                self.assertEqual(pql.bbs, fast.bbs)
+        finally:
+            os.unlink(path)
+
+    def test_stats(self):
+        stats = Stats(allocations=True)
+        pql = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE, stats=stats)
+        pql.load_cpurf()
+        pql.load_in_asm()
+        for _, cpurf in pql.get_cpurf():
+            pql.get_bb(cpurf)
+        with open(ARMEL_EXCEPTION_TRACE) as f:
+            lines = len(f.readlines())
+        self.assertEqual(sum(n for (parser, _), (n, _) in stats.states.items() if parser == 'cpurf'), lines)
+        self.assertEqual(sum(n for (parser, _), (n, _) in stats.states.items() if parser == 'in_asm'), lines)
+        self.assertEqual(stats.records, {'cpurf': 6, 'exception:irq': 1, 'exception:dabt': 1, 'exception:ret': 2,
+                                         'bb': 5, 'translation': 5})
+        self.assertEqual(stats.phases['get_bb'][0], 6)
+        self.assertEqual(stats.phases['load_cpurf'][0], 1)
+        self.assertGreater(stats.phases['load_in_asm'][2], 0)
+        self.assertTrue(stats.sites['load_cpurf'])
+        self.assertIn('exception:irq', stats.report())
+
+        path = write_retranslated_trace(10)
+        try:
+            stats = Stats(chains=1)
+            pql = get_pql(ARMEL, path, stats=stats, fast=True)
+            pql.load_all()
+            self.assertEqual(stats.chains, [('00008000', 10)])
+            self.assertEqual(stats.states, {})
+        finally:
+            os.unlink(path)
+
+        # nothing is instrumented without stats
+        pql = get_pql(ARMEL, ARMEL_TRACE)
+        self.assertNotIn('get_bb', vars(pql))
+        self.assertIs(pql.instrument(pql, 'cpurf'), pql)
+
+    def test_jsonl(self):
+        path = write_retranslated_trace(50)
+        fd, output = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        try:
+            for arch, trace in [(ARMEL, ARMEL_EXCEPTION_TRACE), (MIPSEL, MIPSEL_TRACE), (ARMEL, path)]:
+                pql = get_pql(arch, trace)
+                pql.load_all()
+                expected = []
+                for cpurf_id, cpurf in pql.get_cpurf():
+                    bb = pql.get_bb(cpurf)
+                    if bb is not None:
+                        bb = {key: value for key, value in bb.items() if key not in ('next', 'chained')}
+                    expected.append(dict(cpurf, bb=bb))
+                for args in [[], ['--jobs', '3']]:
+                    main([trace, '--arch', arch, '-o', output] + args)
+                    with open(output) as f:
+                        self.assertEqual([json.loads(line) for line in f], expected)
+                pc = pql.get_pc(expected[-1])
+                main([trace, '--arch', arch, '-o', output, '--filter', pc, '--filter', '0-1'])
+                with open(output) as f:
+                    self.assertEqual([json.loads(line) for line in f],
+                                     [cpurf for cpurf in expected if pql.get_pc(cpurf) == pc])
+        finally:
+            os.unlink(path)
+            os.unlink(output)
+
+    def test_filter(self):
+        path = write_retranslated_trace(50)
+        try:
+            for arch, trace, f in [
+                    (ARMEL, ARMEL_EXCEPTION_TRACE, Filter(modes=['svc32'])),
+                    (ARMEL, ARMEL_EXCEPTION_TRACE, Filter(pcs=[(0xffff0000, 0xffff0020)], lns=[(20, 60)])),
+                    (ARMEL, ARMEL_TRACE, Filter(pcs=[(0x8000, 0x8400), (0, 1)], lns=[(100, 800)])),
+                    (MIPSEL, MIPSEL_TRACE, Filter(pcs=[(0x80008000, 0x80009000)], modes=['kernel'])),
+                    (MIPSEL, MIPSEL_TRACE, Filter(lns=[(0, 300), (600, 700)])),
+                    (ARMEL, path, Filter(lns=[(250, 400)]))]:
+                pql = get_pql(arch, trace)
+                pql.load_all()
+                expected = {cpurf_id: cpurf for cpurf_id, cpurf in pql.cpurfs.items()
+                            if f.match_ln(cpurf['ln']) and f.match_pc(pql.get_pc(cpurf)) and
+                            f.match_mode(cpurf.get('mode'))}
+                self.assertTrue(expected)
+                self.assertLess(len(expected), len(pql.cpurfs))
+                for kwargs in [{}, {'fast': True}, {'jobs': 2}]:
+                    filtered = get_pql(arch, trace, filter=f, **kwargs)
+                    filtered.load_all()
+                    self.assertEqual(filtered.cpurfs, expected)
+                    for cpurf in expected.values():
+                        self.assertEqual(filtered.get_bb(cpurf)['instructions'], pql.get_bb(cpurf)['instructions'])
+                    filtered = get_pql(arch, trace, filter=f, **kwargs)
+                    filtered.load_cpurf()
+                    self.assertEqual(filtered.cpurfs, expected)
+                self.assertEqual(list(get_pql(arch, trace, filter=f).iter_cpurfs()), list(expected.values()))
+
+            # the cached cpurfs of a filtered load are not the ones of the whole trace
+            filtered = get_pql(ARMEL, path, filter=Filter(lns=[(250, 400)]), cache='pickle')
+            filtered.load_all()
+            pql = get_pql(ARMEL, path, cache='pickle')
+            pql.load_all()
+            self.assertLess(len(filtered.cpurfs), 50)
+            self.assertEqual(len(pql.cpurfs), 50)
+            self.assertTrue(get_pql(ARMEL, path, cache='pickle').load_cache('cpurfs'))
+            self.assertFalse(get_pql(ARMEL, path, filter=Filter(lns=[(250, 400)]), cache='pickle').load_cache('cpurfs'))
+        finally:
+            os.unlink(path)
+            if os.path.exists(path + '.pqlcache'):
+                os.unlink(path + '.pqlcache')
+        self.assertRaises(NotImplementedError, get_pql, ARMEL, ARMEL_TRACE, storage='columnar', filter=Filter())
+
+        # the parsers are instrumented through the filter
+        f = Filter(modes=['svc32'])
+        pql = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE, filter=f)
+        pql.load_all()
+        for mode in ['plain', 'generator']:
+            stats = Stats()
+            filtered = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE, mode=mode, stats=stats, filter=f)
+            if mode == 'plain':
+                filtered.load_cpurf()
+            else:
+                for _ in filtered.load_all():
+                    pass
+            self.assertEqual(filtered.cpurfs, pql.cpurfs)
+            self.assertTrue(stats.states)
+        self.assertEqual(list(get_pql(ARMEL, ARMEL_EXCEPTION_TRACE, stats=Stats(), filter=f).iter_cpurfs()),
+                         list(pql.cpurfs.values()))
+
+    def test_diff(self):
+        with open(ARMEL_TRACE) as f:
+            lines = f.readlines()
+        # cpurf 10 is not executed and R00 of cpurf 19 differs
+        self.assertTrue(lines[268].startswith('R00=00000000'))
+        lines[268] = 'R00=12345678' + lines[268][12:]
+        del lines[142:147]
+        fd, path = tempfile.mkstemp(suffix='.trace')
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+        try:
+            pql = get_pql(ARMEL, ARMEL_TRACE)
+            pql.load_all()
+            for mode in ['plain', 'stream']:
+                other = get_pql(ARMEL, path, mode=mode)
+                if mode == 'plain':
+                    other.load_all()
+                for run in [4, 256]:
+                    diff = pql.diff(other, run=run)
+                    self.assertEqual(list(diff), [
+                        {'kind': 'path', 'left': [(10, pql.get_bb(pql.cpurfs[10]))], 'right': []},
+                        {'kind': 'registers', 'left': 19, 'right': 18, 'pc': '000083bc',
+                         'registers': {'R00': ('00000000', '12345678')}}])
+                    self.assertEqual(diff.first['kind'], 'path')
+                    self.assertEqual((diff.aligned, diff.divergences, diff.mismatches), (78, 1, 1))
+            self.assertEqual(list(pql.diff(other, registers=['R01'])), [diff.first])
+            # basic blocks, and cpurfs, are loaded if they are not
+            other = get_pql(ARMEL, path)
+            other.load_cpurf()
+            self.assertEqual(list(get_pql(ARMEL, ARMEL_TRACE).diff(other, registers=['R01'])), [diff.first])
+            self.assertEqual(list(pql.diff(pql)), [])
+
+            with open(path, 'w') as f:
+                f.writelines(lines[:lines.index('----------------\n', 300)])
+            other = get_pql(ARMEL, path)
+            other.load_all()
+            events = list(pql.diff(other, registers=[]))
+            self.assertEqual(events[-1], {'kind': 'end', 'left': len(other.cpurfs) + 1, 'right': None})
+        finally:
+            os.unlink(path)
+
+    def test_batch(self):
+        fd, malformed = tempfile.mkstemp(suffix='.trace')
+        with os.fdopen(fd, 'w') as f:
+            f.write('R00=00000000\nR04=00000000\nR08=00000000\nR12=00000000 R13=0 R14=0 R15=00008000\nPSR=\n')
+        try:
+            traces = [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE), (ARMEL, ARMEL_EXCEPTION_TRACE),
+                      (ARMEL, malformed), (MIPSEB, 'tests/missing.trace')]
+            batch = Batch(traces, jobs=2, in_flight=2, reduce=(lambda n, summary: n + len(summary['blocks']), 0))
+            summaries = {summary['tracefile']: summary for summary in batch}
+            self.assertEqual(set(summaries), {path for _, path in traces})
+            for arch, trace in traces[:3]:
+                pql = get_pql(arch, trace)
+                pql.load_all()
+                summary = summaries[trace]
+                self.assertIsNone(summary['error'])
+                self.assertEqual(summary['cpurfs'], len(pql.cpurfs))
+                self.assertEqual(summary['blocks'], pql.coverage().block_hits())
+                modes = {}
+                for cpurf in pql.cpurfs.values():
+                    modes[cpurf['mode']] = modes.get(cpurf['mode'], 0) + 1
+                self.assertEqual(summary['modes'], modes)
+            self.assertEqual(summaries[ARMEL_EXCEPTION_TRACE]['exceptions'], {'irq': 1, 'dabt': 1, 'ret': 2})
+            self.assertIn('FileNotFoundError', summaries['tests/missing.trace']['error'])
+            self.assertIsNotNone(summaries[malformed]['error'])
+            self.assertEqual(len(batch.errors), 2)
+            self.assertEqual(batch.cpurfs, sum(summaries[trace]['cpurfs'] for _, trace in traces[:3]))
+            self.assertEqual(batch.reduced, sum(len(summaries[trace]['blocks']) for _, trace in traces[:3]))
+
+            # a crash only takes its own tracefile down
+            traces = [(ARMEL, ARMEL_EXCEPTION_TRACE), (ARMEL, ARMEL_TRACE), (ARMEL, ARMEL_TRACE)]
+            reducers = {'sp': (deepest_stack, 0xffffffff), 'crash': (crash_on_exception, None)}
+            summaries = list(Batch(traces, jobs=2, reducers=reducers))
+            pql = get_pql(ARMEL, ARMEL_TRACE)
+            pql.load_cpurf()
+            self.assertEqual(sorted(summary['error'] or '' for summary in summaries), ['', '', 'worker crashed'])
+            self.assertEqual([summary['reduced']['sp'] for summary in summaries if summary['error'] is None],
+                             [min(int(cpurf['register_files']['R13'], 16) for cpurf in pql.cpurfs.values())] * 2)
+
+            # so does a reducer that cannot be sent to the workers
+            traces = [(ARMEL, ARMEL_EXCEPTION_TRACE), (ARMEL, malformed)]
+            summaries = list(Batch(traces, jobs=2, reducers={'n': (lambda n, cpurf, pql: n + 1, 0)}))
+            self.assertEqual(len(summaries), 2)
+            self.assertTrue(all(summary['error'] for summary in summaries))
+        finally:
+            os.unlink(malformed)
+        fd, output = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        try:
+            main(['tests/mips*.trace', '--arch', MIPSEL, '--format', 'summary', '--jobs', '2', '-o', output])
+            with open(output) as f:
+                lines = [json.loads(line) for line in f]
+        finally:
+            os.unlink(output)
+        self.assertEqual(lines[-1]['totals']['traces'], 2)
+        self.assertEqual(sum(line['cpurfs'] for line in lines[:-1]), lines[-1]['totals']['cpurfs'])
+        self.assertEqual(glob_traces(MIPSEL, 'tests/mips*.trace', 'x.trace'),
+                         [(MIPSEL, MIPSEB_TRACE), (MIPSEL, MIPSEL_TRACE), (MIPSEL, 'x.trace')])
+
+    def test_positional_mode(self):
+        self.assertEqual(PQL_AARCH32('l', ARMEL_TRACE, 'stream').mode, 'stream')
+        self.assertEqual(PQL_MIPS32('l', MIPSEL_TRACE, 'generator', storage='columnar').mode, 'generator')
+
+    def test_follow_mode(self):
+        for arch, trace in [(ARMEL, ARMEL_TRACE), (MIPSEL, MIPSEL_TRACE), (ARMEL, ARMEL_EXCEPTION_TRACE)]:
+            pql = get_pql(arch, trace, mode='stream')
+            cpurfs = list(pql.load_all())
+            with open(trace, 'rb') as f:
+                data = f.read()
+            fd, path = tempfile.mkstemp(suffix='.trace')
+            try:
+                follower = TraceFollower(get_pql(arch, path))
+                found = []
+                # QEMU flushes at any byte, not at line or record boundaries
+                for i in range(0, len(data), 333):
+                    os.write(fd, data[i:i + 333])
+                    for chunk in iter(lambda: follower.poll(size=100), None):
+                        found.extend(chunk)
+                followed = [cpurf for kind, cpurf in found if kind == 'cpurf']
+                # the last cpurf is never known to be complete
+                self.assertEqual(cpurfs[:-1], followed)
+                # unless the trace is over
+                self.assertEqual(follower.flush(), [('cpurf', cpurfs[-1])])
+                follower.close()
+                found = list(get_pql(arch, path).follow(interval=0.01, idle_timeout=0.02))
+                self.assertEqual([cpurf for kind, cpurf in found if kind == 'cpurf'], cpurfs)
+                self.assertEqual(len([bb for kind, bb in found if kind == 'bb']),
+                                 sum(len(chain) for _, chain in pql.bb_index.values()))
+            finally:
+                os.close(fd)
+                os.unlink(path)
+
+    def test_afollow(self):
+        pql = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE)
+        pql.load_all()
+
+        async def collect():
+            follower = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE)
+            found = []
+            async for kind, item in follower.afollow(interval=0.01, idle_timeout=0.05):
+                if kind == 'cpurf':
+                    self.assertEqual(pql.get_bb(pql.cpurfs[item['id']]), follower.get_bb(item))
+                found.append(item)
+            return found
+
+        found = asyncio.run(collect())
+        self.assertEqual(len(found), len(pql.cpurfs) + len(pql.bbs))
+        self.assertEqual(found[-1], pql.cpurfs[len(pql.cpurfs) - 1])
+
+        # other tasks run while a long trace is caught up with
+        async def interleave(found, ticks):
+            async def follow():
+                async for _, item in get_pql(ARMEL, ARMEL_TRACE).afollow(interval=0.01, idle_timeout=0.02):
+                    found.append(item)
+
+            task = asyncio.ensure_future(follow())
+            while not task.done():
+                ticks.append(len(found))
+                await asyncio.sleep(0)
+
+        found, ticks = [], []
+        with mock.patch('pyqemulog.BUFFER_SIZE', 256):
+            asyncio.run(interleave(found, ticks))
+        self.assertGreater(len(set(tick for tick in ticks if 0 < tick < len(found) - 1)), 1)
+
+    def test_exception_index(self):
+        pql = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE)
+        pql.load_all()
+        self.assertEqual([cpurf['id'] for cpurf in pql.exceptions()], [1, 3])
+        self.assertEqual([cpurf['id'] for cpurf in pql.exceptions(type='irq')], [1])
+        self.assertEqual(list(pql.exceptions(type='svc')), [])
+        self.assertIsNone(pql.exception_span(pql.cpurfs[0]))
+        self.assertEqual(pql.exception_span(pql.cpurfs[1]), (pql.cpurfs[1], pql.cpurfs[2]))
+        self.assertEqual(pql.exception_span(pql.cpurfs[2]), (pql.cpurfs[1], pql.cpurfs[2]))
+        self.assertEqual(pql.exception_span(pql.cpurfs[4]), (pql.cpurfs[3], pql.cpurfs[4]))
+        self.assertIsNone(pql.exception_span(pql.cpurfs[5]))
+
+        generator = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE, mode='stream', window=8)
+        generator.load_in_asm()
+        for k, cpurf in generator.get_cpurf():
+            self.assertEqual(pql.get_exception_return_cpurf(pql.cpurfs[k]),
+                             generator.get_exception_return_cpurf(cpurf))
+            if k == 5:
+                self.assertIsNone(pql.get_exception_return_cpurf(pql.cpurfs[k]))
+            else:
+                self.assertEqual(pql.get_exception_return_bb(pql.cpurfs[k]),
+                                 generator.get_exception_return_bb(cpurf))
+
+        # an irq at 10 interrupted by a data abort at 12
+        index = ExceptionIndex([(10, {'type': 'irq'}), (12, {'type': 'dabt'}), (14, {'ret': True}),
+                                (20, {'ret': True}), (30, {'type': 'irq'})])
+        self.assertEqual(index.span(9), None)
+        self.assertEqual(index.span(11), (10, 20))
+        self.assertEqual(index.span(13), (12, 14))
+        self.assertEqual(index.span(16), (10, 20))
+        self.assertEqual(index.span(21), None)
+        self.assertEqual(index.span(31), (30, None))
+        self.assertEqual(index.next_return(15), 20)
+        self.assertEqual(index.next_return(21), None)
+
+    def test_export_npz(self):
+        fd, path = tempfile.mkstemp(suffix='.npz')
+        os.close(fd)
+        try:
+            for arch, trace in [(MIPSEL, MIPSEL_TRACE), (ARMEL, ARMEL_EXCEPTION_TRACE)]:
+                pql = get_pql(arch, trace, mode='stream')
+                cpurfs = list(pql.load_all())
+                pql.export_cpurfs(path, batch_size=4)
+                columns = read_npz(path)
+                self.assertEqual(columns['id'], list(range(len(cpurfs))))
+                self.assertEqual(columns['ln'], [cpurf['ln'] for cpurf in cpurfs])
+                self.assertEqual(columns['mode'], [cpurf['mode'] for cpurf in cpurfs])
+                for name in pql.register_schema:
+                    self.assertEqual(columns[name], [int(cpurf['register_files'][name], 16) for cpurf in cpurfs])
+
+                pql.export_instructions(path, batch_size=5)
+                columns = read_npz(path)
+                instructions = [instruction for _, chain in pql.bb_index.values()
+                                for bb in chain for instruction in bb['instructions']]
+                instructions.sort(key=lambda instruction: instruction['ln'])
+                self.assertEqual(columns['ln'], [instruction['ln'] for instruction in instructions])
+                self.assertEqual(columns['raw'], [instruction['raw'] for instruction in instructions])
+                self.assertEqual(columns['operand'], [' '.join(instruction['operand'] or [])
+                                                      for instruction in instructions])
+        finally:
+            os.unlink(path)
+
+        pql = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE)
+        fd, path = tempfile.mkstemp(suffix='.npz')
+        os.close(fd)
+        try:
+            pql.export_cpurfs(path)
+            columns = read_npz(path)
+            self.assertEqual(columns['exception'][1], '{"type": "irq"}')
+            self.assertEqual(columns['extras'][3], '{"DFSR": "0x8", "DFAR": "0xf1012014"}')
+            self.assertEqual(columns['extras'][0], '')
+        finally:
+            os.unlink(path)
+
+    @skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_export_parquet(self):
+        import pyarrow.parquet
+        pql = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE)
+        fd, path = tempfile.mkstemp(suffix='.parquet')
+        os.close(fd)
+        try:
+            pql.export_cpurfs(path, batch_size=4)
+            table = pyarrow.parquet.read_table(path)
+            self.assertEqual(table.column('R15').to_pylist()[:3], [0x8000, 0x8100, 0xffff0018])
+        finally:
+            os.unlink(path)
+
+    def test_lazy_imports(self):
+        # the optional dependencies are imported by what needs them only
+        script = 'import sys, pyqemulog; print(sorted(set(sys.modules) & {"numpy", "pyarrow"}))'
+        self.assertEqual(subprocess.check_output([sys.executable, '-c', script],
+                                                 cwd=os.path.dirname(os.path.abspath(__file__))).strip(), b'[]')
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_register_queries(self):
+        for arch, trace, sp in [(ARMEL, ARMEL_EXCEPTION_TRACE, 'R13'), (MIPSEL, MIPSEL_TRACE, 'sp')]:
+            for storage in ['dict', 'columnar', 'delta']:
+                pql = get_pql(arch, trace, storage=storage)
+                pql.load_all()
+                cpurfs = list(pql.cpurfs.values())
+                sps = [int(cpurf['register_files'][sp], 16) for cpurf in cpurfs]
+                self.assertEqual(pql.registers(sp).tolist(), sps)
+                threshold = sorted(sps)[len(sps) // 2]
+                self.assertEqual(pql.where(pql.registers(sp) < threshold).tolist(),
+                                 [cpurf['id'] for cpurf, value in zip(cpurfs, sps) if value < threshold])
+                for cpurf_id in pql.where(pql.registers(sp) < threshold):
+                    self.assertEqual(pql.cpurfs[cpurf_id], cpurfs[cpurf_id])
+                    self.assertLess(int(pql.cpurfs[cpurf_id]['register_files'][sp], 16), threshold)
+                pcs, counts = pql.pc_histogram()
+                histogram = {}
+                for cpurf in cpurfs:
+                    pc = int(pql.get_pc(cpurf), 16)
+                    histogram[pc] = histogram.get(pc, 0) + 1
+                self.assertEqual(dict(zip(pcs.tolist(), counts.tolist())), histogram)
+                self.assertEqual(pql.register_deltas(sp).tolist(), [b - a for a, b in zip(sps, sps[1:])])
+        self.assertEqual(pql.registers('LLAddr').dtype, numpy.uint64)
+
+        pql = get_pql(ARMEL, ARMEL_EXCEPTION_TRACE, storage='columnar')
+        pql.load_cpurf()
+        self.assertEqual(pql.registers('DFAR').tolist(), [0, 0, 0, 0xf1012014, 0, 0])